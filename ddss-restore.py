@@ -2,16 +2,31 @@ import os
 import sys
 import json
 import time
-import requests
 import shutil
 import socket
-import boto3
+import select
+import sqlite3
 import subprocess
-import urllib3
+import base64
 import hashlib
-from concurrent.futures import ThreadPoolExecutor
-import subprocess
-urllib3.disable_warnings()
+import bisect
+import heapq
+import math
+import signal
+import argparse
+import itertools
+import threading
+import zlib
+import fnmatch
+import glob
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from urllib.parse import urlparse
+from s3_access import S3Access
 
 # Configuration
 BUCKET_JSON = "bucket_structure.json"
@@ -26,56 +41,462 @@ LOCAL_BASE_PATH = os.getenv("LOCAL_BASE_PATH") or "/splunkdata/indexes/"
 PROCESS_BUCKET_SCRIPT = "./process_bucket.sh"
 LOG_FILE_PATH = os.getenv("LOG_FILE_PATH") or "/opt/splunk/var/log/splunk/splunkd.log"  # Path to your Splunk log file
 MAX_WORKERS = int(os.getenv("MAX_WORKERS") or 10)
+READY_TIMEOUT = int(os.getenv("READY_TIMEOUT") or 300)  # Maximum seconds to wait for each restart readiness phase
+READY_BACKOFF_MIN = float(os.getenv("READY_BACKOFF_MIN") or 0.25)  # First retry delay for port/health probes
+READY_BACKOFF_MAX = float(os.getenv("READY_BACKOFF_MAX") or 2)  # Retry delay cap for port/health probes
+LOG_POLL_INTERVAL = 0.2  # Log follow interval when inotify is unavailable
+RESTART_STATE_JSON = os.getenv("RESTART_STATE_JSON") or "restart_state.json"
+DOWNTIME_PER_TB_FLOOR = 10 ** 10  # Restored bytes below which downtime per TB is not extrapolated (reported as n/a)
+RESTART_MODE = os.getenv("RESTART_MODE") or "coalesce"  # "coalesce", "always" or "never" (registration works without a restart)
+RESTART_MIN_BUCKETS = int(os.getenv("RESTART_MIN_BUCKETS") or 100)  # Restart once this many thawed buckets are waiting
+RESTART_MIN_BYTES = int(os.getenv("RESTART_MIN_BYTES") or 0)  # ...or once this many thawed bytes are waiting (0 disables)
+RESTART_MAX_WAIT = int(os.getenv("RESTART_MAX_WAIT") or 1800)  # ...or once the oldest waiting bucket is this many seconds old (0 disables)
+DEDUP_PREFERENCE = os.getenv("DEDUP_PREFERENCE") or "origin"  # Replicated copy to keep: "origin", "smallest", "newest" or "off"
+RESTORE_EARLIEST = os.getenv("RESTORE_EARLIEST")  # Only restore buckets overlapping this window (epoch or ISO 8601)
+RESTORE_LATEST = os.getenv("RESTORE_LATEST")
+RESTORE_ORDER = os.getenv("RESTORE_ORDER") or ""  # "newest" or "oldest" first; empty keeps listing order
+RESTORE_POLICY = os.getenv("RESTORE_POLICY") or ""  # Todo priority, e.g. "requested,index,newest": requested/index/newest/oldest/smallest (empty: RESTORE_ORDER)
+INDEX_PRIORITY = os.getenv("INDEX_PRIORITY") or ""  # Comma separated indexes restored first, in this order ("index" policy)
+RESTORE_REQUEST_FILE = os.getenv("RESTORE_REQUEST_FILE") or ""  # Bids or bucket names, one per line, restored first in file order ("requested" policy)
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE") or "ddss_restore.prom"  # Prometheus textfile (point at the node exporter textfile directory)
+METRICS_SUMMARY_JSON = os.getenv("METRICS_SUMMARY_JSON") or "ddss_run_summary.json"
+METRICS_SAMPLES = int(os.getenv("METRICS_SAMPLES") or 2048)  # Recent samples kept per stage for percentiles
+STATUS_SNAPSHOT_INTERVAL = float(os.getenv("STATUS_SNAPSHOT_INTERVAL") or 60)  # Minimum seconds between progress snapshots kept for the status command
+STATUS_HISTORY_SECONDS = float(os.getenv("STATUS_HISTORY_SECONDS") or 7 * 86400)  # Progress snapshots older than this are dropped
+STATUS_WINDOWS = os.getenv("STATUS_WINDOWS") or "15m,1h,24h"  # Throughput windows shown by the status command
+METRICS_HISTORY = os.getenv("METRICS_HISTORY", "ddss_metrics_history.jsonl")  # One line of totals per run, used by the plan command (empty disables)
+METRICS_HISTORY_INTERVAL = float(os.getenv("METRICS_HISTORY_INTERVAL") or 600)  # Daemon: seconds between history lines
+PLAN_HISTORY_RUNS = int(os.getenv("PLAN_HISTORY_RUNS") or 20)  # Most recent runs the plan command derives throughput from
+S3_LIST_PRICE = float(os.getenv("S3_LIST_PRICE") or 0.005)  # USD per 1,000 LIST requests
+S3_GET_PRICE = float(os.getenv("S3_GET_PRICE") or 0.0004)  # USD per 1,000 GET/HEAD requests
+S3_TRANSFER_PRICE = float(os.getenv("S3_TRANSFER_PRICE") or 0)  # USD per GB downloaded (0 within the bucket's region)
+PROFILE_STAGES = os.getenv("PROFILE_STAGES") or ""  # Comma separated stage functions to profile, e.g. "generate_bucket_structure"
+PROFILE_MODE = os.getenv("PROFILE_MODE") or "cpu"  # "cpu" (cProfile), "memory" (tracemalloc) or "both"
+PROFILE_DIR = os.getenv("PROFILE_DIR") or "profiles"
+PROFILE_TOP = int(os.getenv("PROFILE_TOP") or 15)  # Entries shown per profile in the end-of-run summary
+DAEMON_CONTROL_FILE = os.getenv("DAEMON_CONTROL_FILE") or "ddss-daemon.json"  # Runtime overrides, re-read when it changes
+DAEMON_TICK = float(os.getenv("DAEMON_TICK") or 5)  # Seconds between daemon scheduling passes
+DAEMON_SAVE_INTERVAL = float(os.getenv("DAEMON_SAVE_INTERVAL") or 60)  # Seconds between state saves in daemon mode
+DAEMON_CHECK_BATCH = int(os.getenv("DAEMON_CHECK_BATCH") or 50)  # Uploaded buckets polled per cacheman search
+RECEIPT_INDEX_MODE = os.getenv("RECEIPT_INDEX_MODE") or "exact"  # "exact" (packed sorted array) or "bloom" (filter only, hits confirmed with a HEAD)
+RECEIPT_BLOOM_FP_RATE = float(os.getenv("RECEIPT_BLOOM_FP_RATE") or 0.01)  # Bloom false positive rate (each costs one HEAD)
+RECEIPT_INDEX_DIR = os.getenv("RECEIPT_INDEX_DIR") or ""  # Persist each index's receipt index here after listing and reuse it for RECEIPT_NEGATIVE_TTL seconds (empty disables)
+RECEIPT_CACHE_DB = os.getenv("RECEIPT_CACHE_DB", "receipt_cache.db")  # Local receipt cache shared by all stages (empty disables)
+RECEIPT_NEGATIVE_TTL = int(os.getenv("RECEIPT_NEGATIVE_TTL") or 900)  # Seconds a "no receipt" answer is trusted
+RECEIPT_LIST_MIN = int(os.getenv("RECEIPT_LIST_MIN") or 1000)  # List an index's receipts once this many are unknown, HEAD them otherwise
+INVENTORY_NUMPY = os.getenv("INVENTORY_NUMPY") or "auto"  # "auto" joins bucket lists against receipt indexes with NumPy when installed, "off" never
+INVENTORY_WORKERS = max(1, int(os.getenv("INVENTORY_WORKERS") or 4))  # Indexes listed and classified at once during the inventory
+INVENTORY_CHECKPOINT_DIR = os.getenv("INVENTORY_CHECKPOINT_DIR") or ""  # Per-index inventory checkpoints (default: <BUCKET_JSON root>.inventory)
+INVENTORY_RESUME_MAX_AGE = float(os.getenv("INVENTORY_RESUME_MAX_AGE") or 21600)  # Resume an interrupted inventory started less than this many seconds ago (0 never resumes)
+RECEIPT_REFRESH_INTERVAL = int(os.getenv("RECEIPT_REFRESH_INTERVAL") or 300)  # Daemon: seconds between refreshes of expired negatives
+RECEIPT_REFRESH_BATCH = int(os.getenv("RECEIPT_REFRESH_BATCH") or 1000)  # Daemon: expired negatives re-checked per refresh
+DOWNLOAD_RATE = os.getenv("DOWNLOAD_RATE") or ""  # journal.zst download limit shared by all workers, e.g. "100M" bytes/s (empty or 0 = unlimited)
+DOWNLOAD_RATE_SCHEDULE = os.getenv("DOWNLOAD_RATE_SCHEDULE") or ""  # Time-of-day limits, e.g. "08:00-20:00=20M;20:00-08:00=0" (first match wins)
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE") or 1024 * 1024)
+DOWNLOAD_PROGRESS_INTERVAL = float(os.getenv("DOWNLOAD_PROGRESS_INTERVAL") or 30)  # Seconds between per-bucket progress lines
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES") or 3)  # Resumes of an interrupted journal download before the bucket fails
+INTEGRITY_RETRIES = int(os.getenv("INTEGRITY_RETRIES") or 2)  # Fresh downloads after a checksum mismatch before "integrityfailed"
+SCRATCH_PATH = os.getenv("SCRATCH_PATH") or ""  # Fast local staging directory (NVMe/tmpfs) for download + rebuild (empty rebuilds in place)
+SCRATCH_BUDGET = os.getenv("SCRATCH_BUDGET") or ""  # Scratch that in-flight buckets may reserve, e.g. "400G" (empty = free space at start)
+SCRATCH_EXPANSION = float(os.getenv("SCRATCH_EXPANSION") or 2.0)  # Rebuilt bucket size as a multiple of its journal.zst
+LEASE_DURATION = int(os.getenv("LEASE_DURATION") or 1800)  # Seconds an "inprogress" lease lasts without renewal
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+COORDINATION = os.getenv("COORDINATION") or ""  # Multi-host state store: "sqlite:/shared/ddss-coord.db" or "memory" (empty = single host)
+COORD_HOST_ID = os.getenv("COORD_HOST_ID") or socket.gethostname()  # This host's name in the store (one restore process per host)
+COORD_HEARTBEAT = float(os.getenv("COORD_HEARTBEAT") or 30)  # Seconds between heartbeats (each renews the host's leases)
+COORD_HOST_TIMEOUT = float(os.getenv("COORD_HOST_TIMEOUT") or 180)  # Hosts silent this long are dead and their buckets are handed back
 
 CACHEMANAGER_JSON_CONTENT = {
     "file_types": ["strings_data", "sourcetypes_data", "sources_data", "hosts_data", "bucket_info", "bfidx", "tsidx", "bloomfilter", "journal_gz", "deletes"]
 }
-s3 = boto3.client("s3")
+# Files (relative to the bucket directory) that make up each of those file types
+CACHEMANAGER_FILE_PATTERNS = {
+    "strings_data": ["Strings.data"],
+    "sourcetypes_data": ["SourceTypes.data"],
+    "sources_data": ["Sources.data"],
+    "hosts_data": ["Hosts.data"],
+    "bucket_info": ["bucket_info.csv"],
+    "bfidx": ["*.bfidx"],
+    "tsidx": ["*.tsidx"],
+    "bloomfilter": ["bloomfilter"],
+    "journal_gz": ["rawdata/journal.gz", "rawdata/journal.zst"],
+    "deletes": ["rawdata/deletes"],
+}
+LOCAL_REQUIRED_FILE_TYPES = [
+    file_type for file_type in (os.getenv("LOCAL_REQUIRED_FILE_TYPES") or "tsidx,bloomfilter,journal_gz,hosts_data,sources_data,sourcetypes_data").split(",") if file_type
+]  # File types a local bucket needs before it counts as rebuilt
+CACHEMANAGER_UPLOAD_JSON = os.getenv("CACHEMANAGER_UPLOAD_JSON") or "/opt/splunk/var/run/splunk/cachemanager_upload.json"  # Where process_bucket.sh registers rebuilt BIDs
+SPLUNK_SESSION = None  # Reuses connections to splunkd across REST calls, created on the first one
+
+
+# Metrics
+class Metrics:
+    """
+    Thread-safe, in-process run metrics: stage durations, request counts/latencies, bytes moved and statuses.
+
+    Recording is a dict update under a lock, cheap enough to leave on in production. Durations keep a
+    bounded window of recent samples for percentiles; everything else is running totals.
+    """
+
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.durations = {}
+        self.counters = {}
+        self.gauges = {}
+        self.bucket_durations = deque(maxlen=METRICS_SAMPLES)
+
+    def observe(self, stage, seconds, bucket=None):
+        """Record one duration for a stage (optionally for a specific bucket)."""
+        with self.lock:
+            summary = self.durations.get(stage)
+            if summary is None:
+                summary = self.durations[stage] = {"count": 0, "sum": 0.0, "max": 0.0, "samples": deque(maxlen=METRICS_SAMPLES)}
+            summary["count"] += 1
+            summary["sum"] += seconds
+            summary["max"] = max(summary["max"], seconds)
+            summary["samples"].append(seconds)
+            if bucket is not None:
+                self.bucket_durations.append({"bucket": bucket, "stage": stage, "seconds": round(seconds, 3)})
+
+    @contextmanager
+    def timer(self, stage, bucket=None):
+        """Time the enclosed block as one observation of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, bucket)
+
+    def count(self, name, value=1, **labels):
+        """Increment a counter, e.g. count("bytes", 1024, direction="download")."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def request(self, kind, op, seconds, outcome="ok"):
+        """Record one REST or S3 request with its latency."""
+        self.count("requests", kind=kind, op=op, outcome=outcome)
+        self.observe(f"{kind}_{op}", seconds)
+
+    def set_status_counts(self, bucket_data):
+        """Publish the number of buckets per index and status."""
+        counts = {}
+        for index_name, buckets in bucket_data.items():
+            for bucket_info in buckets:
+                key = (index_name, bucket_info["status"])
+                counts[key] = counts.get(key, 0) + 1
+        self.set_status_gauges(counts)
+
+    def set_status_gauges(self, counts):
+        """Replace the per-index, per-status bucket gauges with (index, status) -> count."""
+        with self.lock:
+            self.gauges = {key: value for key, value in self.gauges.items() if key[0] != "buckets"}
+            for (index_name, status), value in counts.items():
+                self.gauges[("buckets", (("index", index_name), ("status", status)))] = value
+
+    def snapshot(self):
+        """Return the current metrics as plain data (used by both exporters)."""
+        with self.lock:
+            durations = {}
+            for stage, summary in self.durations.items():
+                samples = sorted(summary["samples"])
+                durations[stage] = {
+                    "count": summary["count"],
+                    "sum": round(summary["sum"], 3),
+                    "max": round(summary["max"], 3),
+                    "quantiles": {
+                        str(quantile): round(samples[min(len(samples) - 1, int(quantile * len(samples)))], 3)
+                        for quantile in self.QUANTILES
+                    } if samples else {},
+                }
+            return {
+                "started": self.started,
+                "elapsed": round(time.time() - self.started, 3),
+                "durations": durations,
+                "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.gauges.items()],
+                "bucket_durations": list(self.bucket_durations),
+            }
+
+    def export_prometheus(self, path=METRICS_TEXTFILE):
+        """Write the metrics in Prometheus text format, atomically so node exporter never reads a partial file."""
+        if not path:
+            return
+        snapshot = self.snapshot()
+
+        def labels(values):
+            return "{" + ",".join(f'{key}="{value}"' for key, value in values.items()) + "}" if values else ""
+
+        lines = [
+            "# HELP ddss_restore_stage_seconds Duration of restore stages and requests.",
+            "# TYPE ddss_restore_stage_seconds summary",
+        ]
+        for stage, summary in sorted(snapshot["durations"].items()):
+            for quantile, value in summary["quantiles"].items():
+                lines.append(f"ddss_restore_stage_seconds{labels({'stage': stage, 'quantile': quantile})} {value}")
+            lines.append(f"ddss_restore_stage_seconds_sum{labels({'stage': stage})} {summary['sum']}")
+            lines.append(f"ddss_restore_stage_seconds_count{labels({'stage': stage})} {summary['count']}")
+        seen = set()
+        for counter in sorted(snapshot["counters"], key=lambda item: item["name"]):
+            if counter["name"] not in seen:
+                seen.add(counter["name"])
+                lines.append(f"# TYPE ddss_restore_{counter['name']}_total counter")
+            lines.append(f"ddss_restore_{counter['name']}_total{labels(counter['labels'])} {counter['value']}")
+        for gauge in sorted(snapshot["gauges"], key=lambda item: item["name"]):
+            if gauge["name"] not in seen:
+                seen.add(gauge["name"])
+                lines.append(f"# TYPE ddss_restore_{gauge['name']} gauge")
+            lines.append(f"ddss_restore_{gauge['name']}{labels(gauge['labels'])} {gauge['value']}")
+        lines.append(f"ddss_restore_last_export_timestamp_seconds {time.time():.0f}")
+
+        with open(f"{path}.tmp", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+    def append_history(self, thawed, path=METRICS_HISTORY):
+        """
+        Append this run's totals to the metrics history (one JSON line; a daemon appends one per interval).
+
+        Lines of the same run share "started", so readers keep only the last one.
+        """
+        if not path:
+            return
+        snapshot = self.snapshot()
+        record = {
+            "started": snapshot["started"],
+            "elapsed": snapshot["elapsed"],
+            "workers": MAX_WORKERS,
+            "thawed": thawed,
+            "download_bytes": sum(
+                counter["value"] for counter in snapshot["counters"]
+                if counter["name"] == "bytes" and counter["labels"].get("direction") == "download"
+            ),
+            "stages": {stage: {"count": summary["count"], "sum": summary["sum"]} for stage, summary in snapshot["durations"].items()},
+        }
+        with open(path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+    def export_json(self, path=METRICS_SUMMARY_JSON, extra=None):
+        """Write the run summary JSON (snapshot plus any extra run totals)."""
+        if not path:
+            return
+        summary = self.snapshot()
+        summary.update(extra or {})
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(summary, file, indent=4)
+        os.replace(f"{path}.tmp", path)
+
+
+METRICS = Metrics()
+
+
+def record_s3_request(op, seconds, outcome, nbytes):
+    """S3Access observer: feed every S3 request and its bytes into the run metrics."""
+    METRICS.request("s3", op, seconds, outcome)
+    if nbytes:
+        METRICS.count("s3_bytes", nbytes, op=op)
+
+
+# Receipt HEAD fan-out and INVENTORY_WORKERS concurrent index listings run alongside MAX_WORKERS rebuilds
+s3 = S3Access(concurrency=MAX_WORKERS * 2 + INVENTORY_WORKERS, observer=record_s3_request)
+# The HEAD fan-out (receipts, journal sizes) of every inventory thread shares these MAX_WORKERS threads,
+# so concurrent index scans never exceed the connections reserved for it above
+S3_FANOUT = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="s3-fanout")
+
+
+def splunk_session():
+    """Return the shared splunkd session, importing requests only once a stage actually calls splunkd."""
+    global SPLUNK_SESSION
+    if SPLUNK_SESSION is None:
+        import requests
+        import urllib3
+
+        urllib3.disable_warnings()
+        SPLUNK_SESSION = requests.Session()
+    return SPLUNK_SESSION
+
+
+def splunk_request(method, url, op, **kwargs):
+    """
+    Send a request to splunkd over the shared session and record its count and latency.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Full URL.
+        op (str): Short operation name used in metrics (e.g. "attach").
+        **kwargs: Passed through to requests.
+
+    Returns:
+        requests.Response: The response.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = splunk_session().request(method, url, auth=AUTH, verify=False, **kwargs)
+        outcome = str(response.status_code)
+        return response
+    finally:
+        METRICS.request("rest", op, time.perf_counter() - start, outcome)
 
 
 # Utility Functions
-def wait_for_logs(timeout):
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+
+def open_inotify_watch(directory):
+    """
+    Open an inotify watch on a directory so log followers can block until the directory changes.
+
+    :param directory: The directory to watch (watching the directory rather than the file also catches rotation)
+    :return: The inotify file descriptor, or None if inotify is unavailable on this platform
+    """
+    try:
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+def wait_for_log_change(inotify_fd, timeout):
+    """
+    Block until the watched log directory changes or the timeout expires.
+
+    :param inotify_fd: The inotify file descriptor from open_inotify_watch, or None to fall back to polling
+    :param timeout: Maximum time to block (in seconds)
+    """
+    if inotify_fd is None:
+        time.sleep(min(timeout, LOG_POLL_INTERVAL))
+        return
+    readable, _, _ = select.select([inotify_fd], [], [], timeout)
+    if readable:
+        try:
+            # Drain the queued events; we only care that something changed
+            os.read(inotify_fd, 65536)
+        except BlockingIOError:
+            pass
+
+
+def get_log_position():
+    """
+    Capture the current identity and size of the Splunk log file.
+
+    Taking this before the restart request means the follower cannot miss a fast startup message.
+
+    :return: A tuple of (inode, offset), or None if the log file does not exist
+    """
+    try:
+        stat = os.stat(LOG_FILE_PATH)
+        return stat.st_ino, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def wait_for_logs(timeout, position=None):
     """
-    Tail the Splunk log file and wait for a specific log message indicating Splunk is back online.
+    Follow the Splunk log file and wait for a specific log message indicating Splunk is back online.
+
+    New lines are picked up as soon as they are written (inotify where available, short polling otherwise),
+    and rotation or truncation of the log file is followed by reopening it from the start.
 
     :param timeout: Maximum time to wait (in seconds)
+    :param position: Optional (inode, offset) from get_log_position to start following from
     :return: True if the log message is detected, False otherwise
     """
-    import os
-
     start_time = time.time()
 #    expected_message = 'INFO  ServerConfig [0 MainThread] - My server name is'
     expected_message = 'My server name is'
 
     print(f"Waiting for log message: {expected_message}")
 
+    inotify_fd = open_inotify_watch(os.path.dirname(LOG_FILE_PATH) or ".")
+    log_file = None
     try:
-        # Open the log file in read mode and seek to the end
-        with open(LOG_FILE_PATH, 'r') as log_file:
-            log_file.seek(0, os.SEEK_END)
-
-            while time.time() - start_time < timeout:
-                # Read new lines from the log file
+        while time.time() - start_time < timeout:
+            if log_file is None:
+                try:
+                    log_file = open(LOG_FILE_PATH, "r", errors="replace")
+                except FileNotFoundError:
+                    wait_for_log_change(inotify_fd, timeout - (time.time() - start_time))
+                    continue
+                inode = os.fstat(log_file.fileno()).st_ino
+                if position is None:
+                    log_file.seek(0, os.SEEK_END)
+                elif position[0] == inode:
+                    log_file.seek(position[1])
+                # A different inode means the log rotated since the position was taken, so read it from the start
+                position = None
+                partial = ""
+
+            # Read everything written since the last pass
+            while True:
                 line = log_file.readline()
-                if not line:  # If no new line, wait and retry
-                    time.sleep(1)
+                if not line:
+                    break
+                if not line.endswith("\n"):
+                    # Incomplete line, keep it until the rest is written
+                    partial += line
                     continue
-
+                line, partial = partial + line, ""
                 if expected_message in line:
                     print(f"Detected log message: {line.strip()}")
                     return True
 
-    except FileNotFoundError:
-        print(f"Log file not found: {LOG_FILE_PATH}")
+            # Reopen on rotation (new inode at the path) or truncation (file shorter than our offset)
+            try:
+                stat = os.stat(LOG_FILE_PATH)
+                rotated = stat.st_ino != os.fstat(log_file.fileno()).st_ino
+                truncated = stat.st_size < log_file.tell()
+            except FileNotFoundError:
+                rotated, truncated = True, False
+            if rotated:
+                log_file.close()
+                log_file = None
+                position = (None, 0)
+                continue
+            if truncated:
+                log_file.seek(0)
+                partial = ""
+                continue
+
+            wait_for_log_change(inotify_fd, max(0, min(1, timeout - (time.time() - start_time))))
+
     except Exception as e:
         print(f"\033[31mError reading log file: {e}\033[0m")
+    finally:
+        if log_file is not None:
+            log_file.close()
+        if inotify_fd is not None:
+            os.close(inotify_fd)
 
     print("Timeout reached without detecting the log message.")
     return False
 
 def wait_for_port(host, port, timeout):
     """
-    Wait for a port to become available.
+    Wait for a port to become available, retrying with a short exponential backoff.
 
     :param host: The host to check (e.g., "localhost")
     :param port: The port to check
@@ -83,52 +504,318 @@ def wait_for_port(host, port, timeout):
     :return: True if the port is available, False otherwise
     """
     start_time = time.time()
+    delay = READY_BACKOFF_MIN
     while time.time() - start_time < timeout:
         try:
             with socket.create_connection((host, port), timeout=5):
                 return True
-        except (socket.timeout, ConnectionRefusedError):
-            time.sleep(5)
+        except OSError:
+            time.sleep(delay)
+            delay = min(delay * 2, READY_BACKOFF_MAX)
+    return False
+
+def wait_for_splunkd_ready(timeout):
+    """
+    Poll /services/server/info until splunkd answers REST requests, retrying with a short exponential backoff.
+
+    :param timeout: Maximum time to wait (in seconds)
+    :return: True if splunkd responded successfully, False otherwise
+    """
+    import requests
+
+    start_time = time.time()
+    delay = READY_BACKOFF_MIN
+    while time.time() - start_time < timeout:
+        try:
+            response = splunk_request(
+                "GET",
+                f"{SPLUNK_URL}/services/server/info",
+                "server_info",
+                params={"output_mode": "json"},
+                timeout=5,
+            )
+            if response.status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(delay)
+        delay = min(delay * 2, READY_BACKOFF_MAX)
     return False
 
-def restart_splunk():
+def restart_splunk(timings=None):
     """
-    Restart Splunk using the REST API.
+    Restart Splunk using the REST API and wait until it is ready to accept REST requests again.
 
-    :param auth: A tuple containing (username, password) for authentication
+    Readiness is detected in three phases (startup log message, management port, /services/server/info),
+    and the time spent in each phase is reported once Splunk is back.
+
+    :param timings: Optional dict that is filled with the duration (in seconds) of each restart phase
+    :return: True if Splunk came back online, False otherwise
     """
+    import requests
+
     restart_endpoint = f"{SPLUNK_URL}/services/server/control/restart"
+    splunk_url = urlparse(SPLUNK_URL)
+    host, port = splunk_url.hostname or "localhost", splunk_url.port or 8089
+    timings = {} if timings is None else timings
+    timeout = READY_TIMEOUT
 
     print("Restarting Splunk...")
+    restart_start = time.time()
+    phase_start = restart_start
     try:
-        response = requests.post(
-            restart_endpoint,
-            auth=AUTH, #HTTPBasicAuth(*auth),
-            verify=False  # Disable SSL verification if using self-signed certificates
-        )
+        log_position = get_log_position()
+        response = splunk_request("POST", restart_endpoint, "restart")
+        timings["restart_request"] = time.time() - phase_start
 
         if response.status_code == 200:
             print("Splunk restarted successfully.")
         else:
             print(f"\033[31mError restarting Splunk: {response.status_code} - {response.text}\033[0m")
-        timeout=300
-        if wait_for_logs(timeout):
-            print("Log message detected. Verifying port availability...")
-            if wait_for_port("localhost", 8089, timeout):
-                print("Splunk is back online and responding on port 8089.")
-                return True
+
+        phase_start = time.time()
+        log_detected = wait_for_logs(timeout, log_position)
+        timings["log_message"] = time.time() - phase_start
+        if log_detected:
+            print(f"Log message detected. Verifying port {port} availability...")
+            phase_start = time.time()
+            port_open = wait_for_port(host, port, timeout)
+            timings["port"] = time.time() - phase_start
+            if port_open:
+                phase_start = time.time()
+                ready = wait_for_splunkd_ready(timeout)
+                timings["health"] = time.time() - phase_start
+                if ready:
+                    print(f"Splunk is back online and responding on port {port}.")
+                    return True
+                print("\033[31mError: /services/server/info is not responding.\033[0m")
             else:
-                print("\033[31mError: Port 8089 is not responding.\033[0m")
+                print(f"\033[31mError: Port {port} is not responding.\033[0m")
         else:
             print("\033[31mError: Log message not detected within timeout.\033[0m")
 
     except requests.RequestException as e:
         print(f"\033[31mError making API request: {e}\033[0m")
+    finally:
+        timings["total"] = time.time() - restart_start
+        for phase, seconds in timings.items():
+            METRICS.observe(f"restart_{phase}", seconds)
+        print("Restart phases: " + ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in timings.items()))
+    return False
+
+
+# Restart Scheduling
+def load_restart_state():
+    """
+    Load the restart scheduler state, which survives between workflow runs.
+
+    Returns:
+        dict: Buckets thawed since the last restart ("pending", bid -> bytes), when the oldest of them
+              was thawed, and lifetime restart totals.
+    """
+    state = {"pending": {}, "first_pending_at": None, "restart_count": 0, "restart_seconds": 0.0, "restored_bytes": 0}
+    try:
+        with open(RESTART_STATE_JSON, "r") as file:
+            state.update(json.load(file))
+    except FileNotFoundError:
+        pass
+    return state
+
+
+def save_restart_state(state):
+    """Save the restart scheduler state back to its JSON file."""
+    with open(RESTART_STATE_JSON, "w") as file:
+        json.dump(state, file, indent=4)
+
+
+def get_bid(index_name, bucket_name):
+    """
+    Build the cacheman bucket ID (index~bucketNum~serverGUID) for a bucket directory name.
+
+    Args:
+        index_name (str): The index name.
+        bucket_name (str): The bucket name.
+
+    Returns:
+        str: The bucket ID.
+    """
+    bucket_parts = bucket_name.split("_")
+    return f"{index_name}~{bucket_parts[3]}~{bucket_parts[4]}"
+
+
+def take_lease(bucket_info):
+    """Mark a bucket "inprogress" under a lease owned by this process (also used to renew it)."""
+    bucket_info["status"] = "inprogress"
+    bucket_info["lease_owner"] = LEASE_OWNER
+    bucket_info["lease_expires"] = int(time.time()) + LEASE_DURATION
+
+
+def release_lease(bucket_info):
+    bucket_info.pop("lease_owner", None)
+    bucket_info.pop("lease_expires", None)
+
+
+def lease_active(bucket_info, now=None):
+    """
+    Check whether an "inprogress" bucket is still owned by a live worker.
+
+    A lease is dead once it expires, or straight away if its owner was a process on this host that no
+    longer exists (e.g. after a crash and restart).
+
+    Returns:
+        bool: True if the lease is still held.
+    """
+    if bucket_info.get("status") != "inprogress" or bucket_info.get("lease_expires", 0) <= (now or time.time()):
+        return False
+    host, _, pid = str(bucket_info.get("lease_owner", "")).rpartition(":")
+    if host == socket.gethostname() and pid.isdigit() and int(pid) != os.getpid():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+    return True
+
+
+def get_local_bucket_size(index_name, bucket_name):
+    """
+    Calculate the on-disk size of a local bucket directory.
+
+    Args:
+        index_name (str): The index name.
+        bucket_name (str): The bucket name.
+
+    Returns:
+        int: Total size of the files in the bucket directory in bytes (0 if it does not exist).
+    """
+    total = 0
+    for root, _, files in os.walk(os.path.join(LOCAL_BASE_PATH, index_name, "db", bucket_name)):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def record_thawed_buckets(state, proc_results):
+    """
+    Add freshly thawed buckets to the set waiting for a restart.
+
+    Args:
+        state (dict): The restart scheduler state.
+        proc_results (list): Bucket info dicts returned by process_buckets.
+    """
+    for bucket_info in proc_results:
+        if bucket_info["status"] != "pendingupload":
+            continue
+        bid = get_bid(bucket_info["index_name"], bucket_info["bucket"])
+        state["pending"][bid] = get_local_bucket_size(bucket_info["index_name"], bucket_info["bucket"])
+    if state["pending"] and state["first_pending_at"] is None:
+        state["first_pending_at"] = time.time()
+
+
+def restart_due(state, force=False):
+    """
+    Decide whether the buckets waiting for a restart justify restarting Splunk now.
+
+    Args:
+        state (dict): The restart scheduler state.
+        force (bool): Restart whenever anything is waiting (e.g. nothing is left to thaw).
+
+    Returns:
+        str: The reason for restarting, or None if the restart should be deferred.
+    """
+    pending = state["pending"]
+    if not pending:
+        return None
+    if RESTART_MODE == "always" or force:
+        return "flush" if force else "always"
+    if len(pending) >= RESTART_MIN_BUCKETS:
+        return f"buckets={len(pending)}>={RESTART_MIN_BUCKETS}"
+    if RESTART_MIN_BYTES and sum(pending.values()) >= RESTART_MIN_BYTES:
+        return f"bytes={sum(pending.values())}>={RESTART_MIN_BYTES}"
+    waited = time.time() - (state["first_pending_at"] or time.time())
+    if RESTART_MAX_WAIT and waited >= RESTART_MAX_WAIT:
+        return f"waited={int(waited)}s>={RESTART_MAX_WAIT}s"
+    return None
+
+
+def schedule_restart(state, run_stats, force=False, report_deferral=True):
+    """
+    Restart Splunk if the restart policy says so, so that waiting buckets can be registered.
+
+    In "never" mode Splunk is not restarted and thawed buckets are released for upload straight away.
+
+    Args:
+        state (dict): The restart scheduler state, updated and saved in place.
+        run_stats (dict): Per-run counters, updated with restart count and downtime.
+        force (bool): Restart whenever anything is waiting.
+        report_deferral (bool): Print a line when the restart is deferred.
+
+    Returns:
+        bool: True if the waiting buckets are now visible to Splunk.
+    """
+    pending = state["pending"]
+    if RESTART_MODE == "never":
+        state["restored_bytes"] += sum(pending.values())
+        pending.clear()
+        state["first_pending_at"] = None
+        save_restart_state(state)
+        return True
+
+    reason = restart_due(state, force)
+    if reason is None:
+        if pending and report_deferral:
+            print(f"\033[94mDeferring restart\033[00m: {len(pending)} bucket(s), {sum(pending.values())} bytes waiting")
+        save_restart_state(state)
+        return not pending
+
+    print(f"Restarting Splunk for {len(pending)} thawed bucket(s) ({reason})")
+    timings = {}
+    restarted = restart_splunk(timings)
+    run_stats["restart_count"] += 1
+    run_stats["restart_seconds"] += timings["total"]
+    state["restart_count"] += 1
+    state["restart_seconds"] += timings["total"]
+    if restarted:
+        state["restored_bytes"] += sum(pending.values())
+        pending.clear()
+        state["first_pending_at"] = None
+    save_restart_state(state)
+    return restarted
+
+
+def print_run_summary(state, run_stats):
+    """
+    Print restart counts and downtime for this run and for the restore as a whole.
+
+    Args:
+        state (dict): The restart scheduler state.
+        run_stats (dict): Per-run counters.
+    """
+    restored_tb = state["restored_bytes"] / 1e12
+    # A few GB restored would extrapolate a couple of restarts into an absurd downtime per TB
+    per_tb = f"{state['restart_seconds'] / restored_tb:.0f}s" if state["restored_bytes"] >= DOWNTIME_PER_TB_FLOOR else "n/a"
+    print(
+        f"Run summary: restarts={run_stats['restart_count']} downtime={run_stats['restart_seconds']:.1f}s "
+        f"thawed={run_stats['thawed']} pending_restart={len(state['pending'])}"
+    )
+    if run_stats.get("duplicates"):
+        print(
+            f"Duplicates skipped: copies={run_stats['duplicates']} rebuilds_avoided={run_stats['duplicates']} "
+            f"bytes_avoided={run_stats['duplicate_bytes']}"
+        )
+    print(
+        f"Restore totals: restarts={state['restart_count']} downtime={state['restart_seconds']:.1f}s "
+        f"restored={restored_tb:.3f}TB downtime_per_TB={per_tb}"
+    )
 
 
 def splunk_api_call(endpoint, data=None, method="POST"):
     url = f"{SPLUNK_URL}{endpoint}"
-    response = requests.request(method, url, auth=AUTH, data=data, verify=False)
+    response = splunk_request(method, url, endpoint.strip("/").split("/")[-1], data=data)
     if response.status_code == 200:
         return response.json()
     else:
@@ -152,9 +839,165 @@ def calculate_sha(bucket_num, server_guid):
     return sha1_hash
 
 
-def check_receipt_on_s3(index_name, bucket_num, server_guid):
+class ReceiptCache:
+    """
+    On-disk cache of receipt.json lookups, keyed by index and bid, shared by every stage and run.
+
+    A receipt is permanent once SmartStore has written it, so present entries never expire; missing
+    entries are only trusted for RECEIPT_NEGATIVE_TTL seconds. Rows are (index_name, bid, present, checked).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        # Opened on first use so importing the script does not create the database
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS receipts ("
+                "index_name TEXT NOT NULL, bid TEXT NOT NULL, present INTEGER NOT NULL, checked REAL NOT NULL, "
+                "PRIMARY KEY (index_name, bid))"
+            )
+            # Bids of one batch lookup (see get_many), private to this connection
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (position INTEGER PRIMARY KEY, bid TEXT NOT NULL)")
+        return self.connection
+
+    def get(self, index_name, bid):
+        """
+        Look up a cached answer.
+
+        Returns:
+            bool: True (present), False (missing, checked within the TTL) or None (unknown or expired).
+        """
+        with self.lock:
+            row = self.connect().execute(
+                "SELECT present, checked FROM receipts WHERE index_name = ? AND bid = ?", (index_name, bid)
+            ).fetchone()
+        if row is None:
+            return None
+        present, checked = row
+        if present:
+            return True
+        return False if time.time() - checked < RECEIPT_NEGATIVE_TTL else None
+
+    def get_many(self, index_name, bids):
+        """
+        Look up many bids of an index in one query, joining them against the cache through a temp table.
+
+        Only the requested bids are read, however many the cache holds for the index.
+
+        Returns:
+            list: True, False or None per bid (as get), aligned with bids.
+        """
+        cutoff = time.time() - RECEIPT_NEGATIVE_TTL
+        answers = [None] * len(bids)
+        with self.lock:
+            connection = self.connect()
+            connection.execute("DELETE FROM lookup")
+            connection.executemany("INSERT INTO lookup (position, bid) VALUES (?, ?)", enumerate(bids))
+            rows = connection.execute(
+                "SELECT lookup.position, receipts.present FROM lookup JOIN receipts "
+                "ON receipts.index_name = ? AND receipts.bid = lookup.bid WHERE receipts.present = 1 OR receipts.checked >= ?",
+                (index_name, cutoff),
+            )
+            for position, present in rows:
+                answers[position] = bool(present)
+            connection.execute("DELETE FROM lookup")
+            connection.commit()
+        return answers
+
+    def record(self, index_name, results):
+        """
+        Store lookup results; a present entry is never downgraded to missing.
+
+        Args:
+            index_name (str): The index name.
+            results (dict): bid -> True/False.
+        """
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            connection.executemany(
+                "INSERT INTO receipts (index_name, bid, present, checked) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (index_name, bid) DO UPDATE SET present = max(present, excluded.present), checked = excluded.checked",
+                [(index_name, bid, int(present), now) for bid, present in results.items()],
+            )
+            connection.commit()
+
+    def expired_negatives(self, limit):
+        """Return up to limit (index_name, bid) pairs whose missing answer has expired, oldest first."""
+        with self.lock:
+            return self.connect().execute(
+                "SELECT index_name, bid FROM receipts WHERE present = 0 AND checked < ? ORDER BY checked LIMIT ?",
+                (time.time() - RECEIPT_NEGATIVE_TTL, limit),
+            ).fetchall()
+
+    def refresh_negatives(self, limit=RECEIPT_REFRESH_BATCH):
+        """
+        Re-check expired missing entries on S3; present entries are never re-checked.
+
+        Returns:
+            int: Number of receipts that turned out to exist now.
+        """
+        found = 0
+        for index_name, bid in self.expired_negatives(limit):
+            _, bucket_num, server_guid = bid.split("~", 2)
+            present = head_receipt(index_name, bucket_num, server_guid)
+            self.record(index_name, {bid: present})
+            found += present
+        return found
+
+    def start_refresher(self, interval=RECEIPT_REFRESH_INTERVAL):
+        """Refresh expired missing entries every interval seconds in a background thread."""
+        def refresh_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    found = self.refresh_negatives()
+                    if found:
+                        print(f"Receipt cache refresh found {found} new receipt(s)")
+                except Exception as e:
+                    print(f"\033[31mReceipt cache refresh failed: {e}\033[0m")
+
+        thread = threading.Thread(target=refresh_loop, name="receipt-cache-refresh", daemon=True)
+        thread.start()
+        return thread
+
+
+RECEIPT_CACHE = ReceiptCache(RECEIPT_CACHE_DB) if RECEIPT_CACHE_DB else None
+
+
+def check_receipt_on_s3(index_name, bucket_num, server_guid, fresh=False):
+    """
+    Check if the receipt.json file exists on S3 for the given bucket, through the receipt cache.
+
+    Args:
+        index_name (str): The index name.
+        bucket_num (str): The bucket number.
+        server_guid (str): The server GUID.
+        fresh (bool): Ignore cached "missing" answers, e.g. right after an upload completed.
+
+    Returns:
+        bool: True if the receipt.json file exists, False otherwise.
+    """
+    bid = f"{index_name}~{bucket_num}~{server_guid}"
+    if RECEIPT_CACHE is not None:
+        cached = RECEIPT_CACHE.get(index_name, bid)
+        if cached or (cached is False and not fresh):
+            return cached
+    present = head_receipt(index_name, bucket_num, server_guid)
+    if RECEIPT_CACHE is not None:
+        RECEIPT_CACHE.record(index_name, {bid: present})
+    return present
+
+
+def head_receipt(index_name, bucket_num, server_guid):
     """
-    Check if the receipt.json file exists on S3 for the given bucket.
+    HEAD a bucket's receipt.json on S3, bypassing the receipt cache.
 
     Args:
         index_name (str): The index name.
@@ -185,8 +1028,7 @@ def update_json_file(json_path, bucket_name, status):
         for bucket in buckets:
             if bucket["bucket"] == bucket_name:
                 bucket["status"] = status
-    with open(json_path, "w") as file:
-        json.dump(data, file, indent=4)
+    save_bucket_structure(json_path, data)
 
 def update_multiple_status(json_path, updates):
     index_updates = {}
@@ -196,151 +1038,2223 @@ def update_multiple_status(json_path, updates):
             index_updates[update['index_name']] = {}
         index_updates[update['index_name']][update['bucket']] = update['status']
 
-    with open(json_path, "r") as file:
-        data = json.load(file)
-    for index_name, buckets in data.items():
-        if index_name in index_updates:
-            for bucket in buckets:
-                if bucket["bucket"] in index_updates[index_name]:
-                    bucket["status"] = index_updates[index_name][bucket['bucket']]
-    with open(json_path, "w") as file:
-        json.dump(data, file, indent=4)
+    with open(json_path, "r") as file:
+        data = json.load(file)
+    for index_name, buckets in data.items():
+        if index_name in index_updates:
+            for bucket in buckets:
+                if bucket["bucket"] in index_updates[index_name]:
+                    bucket["status"] = index_updates[index_name][bucket['bucket']]
+    save_bucket_structure(json_path, data)
+
+def optional_numpy():
+    """Return NumPy for vectorized inventory work, or None if it is not installed or INVENTORY_NUMPY is "off"."""
+    if INVENTORY_NUMPY == "off":
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def local_bucket_names(index_name, base_path=None):
+    """
+    List the bucket directories of an index with a single scandir.
+
+    Args:
+        index_name (str): The index name.
+        base_path (str): Directory holding the indexes (default: LOCAL_BASE_PATH).
+
+    Returns:
+        set: Directory names in <base_path>/<index>/db (empty if it does not exist).
+    """
+    try:
+        with os.scandir(os.path.join(base_path or LOCAL_BASE_PATH, index_name, "db")) as entries:
+            return {entry.name for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
+def check_local_status(index_name, bucket_name):
+    """
+    Check if Hosts.data exists locally for the given bucket.
+
+    Args:
+        index_name (str): The index name.
+        bucket_name (str): The bucket name.
+
+    Returns:
+        bool: True if Hosts.data exists, False otherwise.
+    """
+    local_path = os.path.join(LOCAL_BASE_PATH, index_name, "db", bucket_name, "Hosts.data")
+    return os.path.exists(local_path)
+
+def local_file_types(bucket_dir):
+    """
+    Return the CACHEMANAGER file types present in a bucket directory.
+
+    Only the bucket directory and its rawdata directory are listed (one scandir each), never walked.
+
+    Args:
+        bucket_dir (str): The bucket directory.
+
+    Returns:
+        set: File types from CACHEMANAGER_FILE_PATTERNS with at least one matching file (empty if the directory does not exist).
+    """
+    names = []
+    for subdir in ("", "rawdata"):
+        try:
+            with os.scandir(os.path.join(bucket_dir, subdir)) as entries:
+                names.extend(f"{subdir}/{entry.name}" if subdir else entry.name for entry in entries)
+        except (FileNotFoundError, NotADirectoryError):
+            if not subdir:
+                return set()
+    return {
+        file_type for file_type, patterns in CACHEMANAGER_FILE_PATTERNS.items()
+        if any(fnmatch.filter(names, pattern) for pattern in patterns)
+    }
+
+
+def load_registered_bids(path=None):
+    """
+    Load the BIDs process_bucket.sh has registered in cachemanager_upload.json.
+
+    The script appends a bucket's BID as its very last step, so a registered BID marks a rebuild that ran to the end.
+
+    Returns:
+        set: Registered BIDs (empty if the file is missing or unreadable).
+    """
+    try:
+        with open(path or CACHEMANAGER_UPLOAD_JSON, "r") as file:
+            return set(json.load(file).get("bucket_ids", []))
+    except (OSError, ValueError, AttributeError):
+        return set()
+
+
+def reconcile_local_bucket(index_name, bucket_name, registered):
+    """
+    Work out how far a bucket without a receipt has got locally, so finished rebuild work is not repeated.
+
+    - "rebuilt": every LOCAL_REQUIRED_FILE_TYPES file is in LOCAL_BASE_PATH (the bucket is pendingupload).
+    - "promoted": a rebuild that finished on SCRATCH_PATH (complete and registered) but was never promoted
+      has been promoted now (pendingupload).
+    - "partial": some files are there but the rebuild did not finish; it runs again (todo) and reuses a
+      downloaded journal.
+    - "absent": nothing local (todo).
+
+    Args:
+        index_name (str): The index name.
+        bucket_name (str): The bucket name.
+        registered (set): BIDs registered in cachemanager_upload.json.
+
+    Returns:
+        str: "rebuilt", "promoted", "partial" or "absent".
+    """
+    bucket_dir = os.path.join(LOCAL_BASE_PATH, index_name, "db", bucket_name)
+    present = local_file_types(bucket_dir)
+    if present.issuperset(LOCAL_REQUIRED_FILE_TYPES):
+        return "rebuilt"
+    if SCRATCH_PATH and get_bid(index_name, bucket_name) in registered:
+        scratch_dir = os.path.join(SCRATCH_PATH, index_name, "db", bucket_name)
+        if local_file_types(scratch_dir).issuperset(LOCAL_REQUIRED_FILE_TYPES):
+            promote_bucket(scratch_dir, bucket_dir)
+            if SCRATCH is not None:
+                SCRATCH.release(SCRATCH.take_held(scratch_dir))
+            return "promoted"
+    return "partial" if present else "absent"
+
+
+class ReceiptIndex:
+    """
+    Compact set of the receipt.json files present in SmartStore for one index.
+
+    Instead of full key strings, each receipt is stored as a packed 64-bit (bucket_num << 24 | guid_id)
+    in a sorted array, with server GUIDs interned (an index has one GUID per indexer that ever wrote to
+    it), about 8 bytes per receipt. Receipts that do not fit the packing are kept in a small overflow set.
+
+    In "bloom" mode only a Bloom filter over the receipts' SHA1 is kept (about 1.2 bytes per receipt at a
+    1% false positive rate); a hit is confirmed with a HEAD so lookups still never report a missing receipt.
+
+    Only keys at the expected <sha[:2]>/<sha[2:4]>/<num>~<guid>/receipt.json location count, as before.
+    """
+
+    NUM_SHIFT = 24
+    MAX_GUIDS = 1 << NUM_SHIFT
+    MAX_NUM = 1 << (64 - NUM_SHIFT)
+    MAGIC = "ddss-receipt-index-v1"
+
+    def __init__(self, index_name, mode="exact"):
+        self.index_name = index_name
+        self.mode = mode
+        self.guid_ids = {}
+        self.packed = array("Q")
+        self.overflow = set()
+        self.bloom = None
+        self.bloom_hashes = 0
+        self.count = 0
+
+    def pack(self, bucket_num, server_guid, intern=False):
+        """Return the packed form of a receipt, or None if it does not fit (or the GUID is unknown)."""
+        if not bucket_num.isdigit() or int(bucket_num) >= self.MAX_NUM:
+            return None
+        guid_id = self.guid_ids.get(server_guid)
+        if guid_id is None:
+            if not intern or len(self.guid_ids) >= self.MAX_GUIDS:
+                return None
+            guid_id = self.guid_ids[server_guid] = len(self.guid_ids)
+        return (int(bucket_num) << self.NUM_SHIFT) | guid_id
+
+    def add_key(self, key, prefix):
+        """
+        Add a listed S2 key, ignoring anything that is not a receipt at its expected location.
+
+        Args:
+            key (str): The S3 key.
+            prefix (str): The listing prefix, "<S2_PATH_NAME><index>/db/".
+        """
+        parts = key[len(prefix):].split("/")
+        if len(parts) != 4 or parts[3] != "receipt.json" or "~" not in parts[2]:
+            return
+        digest = hashlib.sha1(parts[2].encode()).digest()
+        if digest[:2].hex() != parts[0] + parts[1]:
+            return
+        self.count += 1
+        bucket_num, server_guid = parts[2].split("~", 1)
+        packed = self.pack(bucket_num, server_guid, intern=True)
+        if packed is None:
+            self.overflow.add(parts[2])
+        else:
+            self.packed.append(packed)
+
+    def finalize(self):
+        """Sort the packed receipts for lookups (or fold them into the Bloom filter) once listing is done."""
+        if self.mode == "bloom":
+            ids_to_guid = {guid_id: guid for guid, guid_id in self.guid_ids.items()}
+            names = (f"{packed >> self.NUM_SHIFT}~{ids_to_guid[packed & (self.MAX_GUIDS - 1)]}" for packed in self.packed)
+            bits = max(64, int(-self.count * math.log(RECEIPT_BLOOM_FP_RATE) / math.log(2) ** 2))
+            self.bloom = bytearray((bits + 7) // 8)
+            self.bloom_hashes = max(1, round(bits / max(self.count, 1) * math.log(2)))
+            for name in itertools.chain(names, self.overflow):
+                for position in self.bloom_positions(hashlib.sha1(name.encode()).digest()):
+                    self.bloom[position >> 3] |= 1 << (position & 7)
+            self.packed = array("Q")
+            self.overflow = set()
+            self.guid_ids = {}
+        else:
+            self.packed = array("Q", sorted(self.packed))
+        return self
+
+    def bloom_positions(self, digest):
+        # Double hashing over two 64-bit halves of the SHA1
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:16], "big") | 1
+        bits = len(self.bloom) * 8
+        return [(first + number * second) % bits for number in range(self.bloom_hashes)]
+
+    def contains(self, index_name, bucket_num, server_guid):
+        """
+        Check whether a bucket's receipt was listed.
+
+        Returns:
+            bool: True if the receipt exists (in bloom mode, confirmed on S3), False otherwise.
+        """
+        if index_name != self.index_name:
+            return False
+        if self.bloom is not None:
+            digest = hashlib.sha1(f"{bucket_num}~{server_guid}".encode()).digest()
+            if not all(self.bloom[position >> 3] & (1 << (position & 7)) for position in self.bloom_positions(digest)):
+                return False
+            return check_receipt_on_s3(index_name, bucket_num, server_guid)
+        packed = self.pack(bucket_num, server_guid)
+        if packed is None:
+            return f"{bucket_num}~{server_guid}" in self.overflow
+        position = bisect.bisect_left(self.packed, packed)
+        return position < len(self.packed) and self.packed[position] == packed
+
+    def contains_many(self, index_name, bucket_nums, server_guids):
+        """
+        Batch form of contains() for a whole index at once.
+
+        In exact mode with NumPy available (see INVENTORY_NUMPY) the buckets are packed into one uint64
+        array and joined against the sorted receipts with a single searchsorted; otherwise each bucket is
+        looked up on its own.
+
+        Args:
+            index_name (str): The index name.
+            bucket_nums (list): Bucket numbers (strings).
+            server_guids (list): Server GUIDs, aligned with bucket_nums.
+
+        Returns:
+            list: True/False per bucket, aligned with bucket_nums.
+        """
+        numpy = optional_numpy()
+        vectorizable = all(map(str.isdigit, bucket_nums)) and max(map(len, bucket_nums), default=0) < 20
+        if index_name != self.index_name or self.bloom is not None or numpy is None or not vectorizable:
+            return list(map(self.contains, itertools.repeat(index_name), bucket_nums, server_guids))
+        nums = numpy.array(bucket_nums).astype(numpy.uint64) if bucket_nums else numpy.zeros(0, numpy.uint64)
+        guid_ids = numpy.fromiter(map(self.guid_ids.get, server_guids, itertools.repeat(-1)), numpy.int64, len(server_guids))
+        packable = (nums < self.MAX_NUM) & (guid_ids >= 0)
+        packed = (nums << numpy.uint64(self.NUM_SHIFT)) | guid_ids.clip(0).astype(numpy.uint64)
+        receipts = numpy.frombuffer(self.packed, dtype=numpy.uint64) if len(self.packed) else numpy.zeros(1, numpy.uint64) + numpy.uint64(2**64 - 1)
+        positions = numpy.searchsorted(receipts, packed).clip(0, len(receipts) - 1)
+        found = (packable & (receipts[positions] == packed)).tolist()
+        if self.overflow:
+            # Receipts that did not fit the packing (or from an unknown GUID) are only in the overflow set
+            for position in numpy.flatnonzero(~packable).tolist():
+                found[position] = f"{bucket_nums[position]}~{server_guids[position]}" in self.overflow
+        return found
+
+    def __len__(self):
+        return self.count
+
+    def save(self, path):
+        """Persist the index: a JSON header line followed by the packed array or Bloom filter bytes."""
+        header = {
+            "magic": self.MAGIC,
+            "index_name": self.index_name,
+            "mode": self.mode,
+            "count": self.count,
+            "guids": sorted(self.guid_ids, key=self.guid_ids.get),
+            "overflow": sorted(self.overflow),
+            "bloom_hashes": self.bloom_hashes,
+        }
+        with open(f"{path}.tmp", "wb") as file:
+            file.write(json.dumps(header).encode() + b"\n")
+            file.write(bytes(self.bloom) if self.bloom is not None else self.packed.tobytes())
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save()."""
+        with open(path, "rb") as file:
+            header = json.loads(file.readline())
+            payload = file.read()
+        if header.get("magic") != cls.MAGIC:
+            raise ValueError(f"{path} is not a receipt index")
+        receipt_index = cls(header["index_name"], header["mode"])
+        receipt_index.count = header["count"]
+        receipt_index.guid_ids = {guid: guid_id for guid_id, guid in enumerate(header["guids"])}
+        receipt_index.overflow = set(header["overflow"])
+        if header["mode"] == "bloom":
+            receipt_index.bloom = bytearray(payload)
+            receipt_index.bloom_hashes = header["bloom_hashes"]
+        else:
+            receipt_index.packed.frombytes(payload)
+        return receipt_index
+
+
+def load_s2_index_structure(index_name):
+    """
+    Load the structure of the S3 bucket for a given index into memory.
+
+    With RECEIPT_INDEX_DIR set, the index persisted by a listing less than RECEIPT_NEGATIVE_TTL seconds
+    old is reused instead of listing again. Receipts are permanent, so it can only miss receipts written
+    since, and "no receipt" answers are trusted for that long anyway (see ReceiptCache).
+
+    Args:
+        index_name (str): The index name.
+
+    Returns:
+        ReceiptIndex: The receipt.json files listed for the index.
+    """
+    path = os.path.join(RECEIPT_INDEX_DIR, f"{index_name}.receipts") if RECEIPT_INDEX_DIR else None
+    if path is not None and os.path.exists(path) and time.time() - os.path.getmtime(path) < RECEIPT_NEGATIVE_TTL:
+        try:
+            receipt_index = ReceiptIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"\033[31mIgnoring persisted receipt index {path}: {e}\033[0m")
+        else:
+            if (receipt_index.index_name, receipt_index.mode) == (index_name, RECEIPT_INDEX_MODE):
+                METRICS.count("receipt_index_reused")
+                return receipt_index
+    receipt_index = ReceiptIndex(index_name, RECEIPT_INDEX_MODE)
+    prefix = f"{S2_PATH_NAME}{index_name}/db/"
+    for page in s3.list_pages(Bucket=S2_BUCKET_NAME, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith("receipt.json"):
+                receipt_index.add_key(obj["Key"], prefix)
+    receipt_index.finalize()
+    if path is not None:
+        os.makedirs(RECEIPT_INDEX_DIR, exist_ok=True)
+        receipt_index.save(path)
+    return receipt_index
+
+def check_receipt_in_structure(receipt_keys, index_name, bucket_num, server_guid):
+    """
+    Check if the receipt.json file exists in the preloaded S3 structure.
+
+    Args:
+        receipt_keys (ReceiptIndex or set): The preloaded receipts (a set of full S3 keys is also accepted).
+        index_name (str): The index name.
+        bucket_num (str): The bucket number.
+        server_guid (str): The server GUID.
+
+    Returns:
+        bool: True if the receipt.json file exists, False otherwise.
+    """
+    if isinstance(receipt_keys, ReceiptIndex):
+        return receipt_keys.contains(index_name, bucket_num, server_guid)
+    # Calculate SHA1 and construct S3 key
+    sha1_hash = calculate_sha(bucket_num, server_guid)
+    sha_part1 = sha1_hash[:2]
+    sha_part2 = sha1_hash[2:4]
+    s3_key = f"{S2_PATH_NAME}{index_name}/db/{sha_part1}/{sha_part2}/{bucket_num}~{server_guid}/receipt.json"
+
+    return s3_key in receipt_keys
+
+def get_journal_info(bucket_name, journal_key):
+    """
+    Fetch the size and modification time of a bucket's journal.zst on S3.
+
+    Args:
+        bucket_name (str): Name of the S3 bucket.
+        journal_key (str): Key of the journal.zst object.
+
+    Returns:
+        tuple: (size in bytes, last modified epoch), or (None, None) if the journal could not be read.
+    """
+    try:
+        response = s3.head_object(Bucket=bucket_name, Key=journal_key)
+        return response["ContentLength"], response["LastModified"].timestamp()
+    except s3.exceptions.ClientError:
+        return None, None
+
+
+def deduplicate_buckets(bucket_name, index_prefix, index_name, splunk_bucket_names, known_info):
+    """
+    Pick one copy of every bucket that was archived more than once (db_ origin plus rb_ replicas).
+
+    Copies are grouped by bucketNum~serverGUID. A copy that is already rebuilt locally always wins so that
+    no finished work is repeated; otherwise DEDUP_PREFERENCE decides: "origin" prefers the db_ copy,
+    "smallest" the smallest journal and "newest" the most recently archived journal.
+
+    Args:
+        bucket_name (str): Name of the DDSS S3 bucket.
+        index_prefix (str): S3 prefix of the index in the DDSS bucket.
+        index_name (str): The index name.
+        splunk_bucket_names (list): Bucket directory names listed for the index.
+        known_info (dict): Bucket name -> (size, modified) already known from a previous inventory.
+
+    Returns:
+        tuple: (dict of skipped bucket name -> preferred bucket name,
+                dict of bucket name -> (size, modified) for every copy in a duplicate group)
+    """
+    if DEDUP_PREFERENCE == "off":
+        return {}, {}
+    groups = {}
+    for splunk_bucket_name in splunk_bucket_names:
+        # The name without its db_/rb_ prefix and time range is bucketNum_serverGUID
+        groups.setdefault(splunk_bucket_name.split("_", 3)[3], []).append(splunk_bucket_name)
+    groups = [copies for copies in groups.values() if len(copies) > 1]
+    if not groups:
+        return {}, {}
+
+    # Only copies in duplicate groups are inspected, and only once across inventories
+    copies_info = {name: known_info[name] for copies in groups for name in copies if name in known_info}
+    to_fetch = [name for copies in groups for name in copies if name not in copies_info]
+    fetched = S3_FANOUT.map(lambda name: get_journal_info(bucket_name, f"{index_prefix}{name}/rawdata/journal.zst"), to_fetch)
+    copies_info.update(zip(to_fetch, fetched))
+
+    def preference(name):
+        size, modified = copies_info.get(name, (None, None))
+        if DEDUP_PREFERENCE == "smallest":
+            policy_key = size if size is not None else float("inf")
+        elif DEDUP_PREFERENCE == "newest":
+            policy_key = -(modified or 0)
+        else:
+            policy_key = 0
+        return (not check_local_status(index_name, name), policy_key, not name.startswith("db_"), name)
+
+    skipped = {}
+    for copies in groups:
+        preferred, *others = sorted(copies, key=preference)
+        for name in others:
+            skipped[name] = preferred
+    return skipped, copies_info
+
+
+def lookup_receipts(index_name, bucket_nums, server_guids):
+    """
+    Find out which buckets of an index have a receipt, spending as few S3 requests as possible.
+
+    Answers come from the receipt cache first. If RECEIPT_LIST_MIN or more buckets are still unknown
+    the index's receipts are listed and joined against the unknown buckets in one batch (see
+    ReceiptIndex.contains_many), otherwise the unknown ones are HEADed; either way the answers are
+    cached. Without a cache the index is always listed.
+
+    Args:
+        index_name (str): The index name.
+        bucket_nums (list): Bucket numbers of the buckets to look up.
+        server_guids (list): Their server GUIDs, aligned with bucket_nums.
+
+    Returns:
+        list: True per bucket whose receipt.json exists, aligned with bucket_nums.
+    """
+    if RECEIPT_CACHE is None:
+        with METRICS.timer("s2_listing"):
+            s2_index_files = load_s2_index_structure(index_name)
+        return s2_index_files.contains_many(index_name, bucket_nums, server_guids)
+
+    bids = [f"{index_name}~{bucket_num}~{server_guid}" for bucket_num, server_guid in zip(bucket_nums, server_guids)]
+    receipts = RECEIPT_CACHE.get_many(index_name, bids)
+    unknown = [position for position, present in enumerate(receipts) if present is None]
+    if len(unknown) >= RECEIPT_LIST_MIN:
+        with METRICS.timer("s2_listing"):
+            s2_index_files = load_s2_index_structure(index_name)
+        found = s2_index_files.contains_many(
+            index_name, [bucket_nums[position] for position in unknown], [server_guids[position] for position in unknown]
+        )
+    else:
+        found = list(S3_FANOUT.map(lambda position: head_receipt(index_name, bucket_nums[position], server_guids[position]), unknown))
+
+    for position, present in zip(unknown, found):
+        receipts[position] = present
+    if found:
+        RECEIPT_CACHE.record(index_name, {bids[position]: present for position, present in zip(unknown, found)})
+    return receipts
+
+
+def classify_index_buckets(index_name, bucket_names, skipped, copies_info, carried, uploaded, registered, reconciled):
+    """
+    Decide the initial status of every bucket of an index in one batch.
+
+    The names are split once, receipts are looked up for the whole index at once (lookup_receipts) and
+    local presence comes from a single scandir of the index's db directory. Every bucket starts as "done"
+    or "todo" from its receipt; only the few that are skipped copies, carried over or present locally
+    are looked at one by one, so buckets with nothing local cost no filesystem calls.
+
+    Args:
+        index_name (str): The index name.
+        bucket_names (list): Bucket directory names listed for the index.
+        skipped (dict): Skipped duplicate copy -> preferred copy (see deduplicate_buckets).
+        copies_info (dict): Copy -> (size, modified) for duplicate groups.
+        carried (dict): Bucket name -> entry fields kept from the previous inventory for this index.
+        uploaded (set): Buckets of this index registered with cacheman in the previous inventory.
+        registered (set): BIDs registered in cachemanager_upload.json.
+        reconciled (dict): Local reconciliation counters, updated in place.
+
+    Returns:
+        list: Bucket structure entries, aligned with bucket_names.
+    """
+    positions = [position for position, name in enumerate(bucket_names) if name not in skipped] if skipped else range(len(bucket_names))
+    # Two throwaway splits are cheaper than keeping a million part lists alive for the garbage collector to scan
+    bucket_nums = [bucket_names[position].split("_")[3] for position in positions]
+    server_guids = [bucket_names[position].split("_")[4] for position in positions]
+    receipts = [False] * len(bucket_names)
+    for position, present in zip(positions, lookup_receipts(index_name, bucket_nums, server_guids)):
+        receipts[position] = present
+
+    entries = [{"bucket": name, "status": "done" if present else "todo"} for name, present in zip(bucket_names, receipts)]
+
+    local_names = local_bucket_names(index_name)
+    # A rebuild left on scratch may still be promoted (see reconcile_local_bucket)
+    scratch_names = local_bucket_names(index_name, SCRATCH_PATH) if SCRATCH_PATH else set()
+    special = local_names.union(scratch_names, skipped, copies_info, carried, uploaded)
+    for position in [position for position, name in enumerate(bucket_names) if name in special]:
+        name, entry, receipt_exists = bucket_names[position], entries[position], receipts[position]
+        if name in skipped:
+            entry["status"] = "duplicate"
+            entry["duplicate_of"] = skipped[name]
+        else:
+            carried_entry = carried.get(name)
+            if carried_entry is not None and not receipt_exists:
+                entry.update(carried_entry)
+            elif receipt_exists:
+                if name in local_names and check_local_status(index_name, name):
+                    entry["status"] = "pendingevict"
+            elif name in local_names or name in scratch_names:
+                # Land in the most advanced state the local copy supports instead of rebuilding again
+                local_state = reconcile_local_bucket(index_name, name, registered)
+                if local_state == "partial":
+                    reconciled["partial"] = reconciled.get("partial", 0) + 1
+                elif local_state != "absent":
+                    entry["status"] = "uploaded" if name in uploaded else "pendingupload"
+                    reconciled[local_state] = reconciled.get(local_state, 0) + 1
+                    if get_bid(index_name, name) in registered:
+                        reconciled["registered"] = reconciled.get("registered", 0) + 1
+        if name in copies_info and copies_info[name][0] is not None:
+            entry["size"], entry["modified"] = copies_info[name]
+    return entries
+
+
+class InventoryCheckpoint:
+    """
+    Per-index checkpoints of a running inventory, so the scan streams instead of building the archive in memory.
+
+    Every finished index is written to <directory>/<index>.ndjson: a header line with its status counts, then
+    its bucket entries as one JSON array line. manifest.json lists the finished indexes and the counters so
+    far. An interrupted inventory of the same archive resumes from the finished indexes (if it started less than
+    INVENTORY_RESUME_MAX_AGE seconds ago), and BUCKET_JSON is assembled from the checkpoints at the end by
+    copying their lines, one index at a time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.manifest = None
+
+    def path(self, index_name):
+        return os.path.join(self.directory, f"{index_name}.ndjson")
+
+    def save_manifest(self):
+        path = os.path.join(self.directory, "manifest.json")
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(self.manifest, file)
+        os.replace(f"{path}.tmp", path)
+
+    def start(self, bucket_name, prefix):
+        """
+        Resume an interrupted inventory of the same archive, or start a fresh one.
+
+        Returns:
+            dict: The manifest; its "indexes" are the indexes already finished.
+        """
+        try:
+            with open(os.path.join(self.directory, "manifest.json"), "r") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            manifest = None
+        if (
+            manifest is not None
+            and (manifest.get("bucket"), manifest.get("prefix")) == (bucket_name, prefix)
+            and time.time() - manifest.get("started", 0) < INVENTORY_RESUME_MAX_AGE
+        ):
+            self.manifest = manifest
+            return manifest
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        self.manifest = {"bucket": bucket_name, "prefix": prefix, "started": time.time(), "indexes": [], "stats": {}}
+        self.save_manifest()
+        return self.manifest
+
+    def write_index(self, index_name, entries, counts, stats):
+        """
+        Checkpoint a finished index.
+
+        Args:
+            index_name (str): The index name.
+            entries (list): Its bucket structure entries.
+            counts (dict): Status -> buckets.
+            stats (dict): Counters to add to the manifest's totals.
+        """
+        path = self.path(index_name)
+        with open(f"{path}.tmp", "w") as file:
+            file.write(json.dumps({"index": index_name, "counts": counts}) + "\n")
+            file.write(json.dumps(entries) + "\n")
+        os.replace(f"{path}.tmp", path)
+        with self.lock:
+            self.manifest["indexes"].append(index_name)
+            totals = self.manifest["stats"]
+            for key, value in stats.items():
+                if isinstance(value, dict):
+                    for sub_key, sub_value in value.items():
+                        totals.setdefault(key, {})[sub_key] = totals.get(key, {}).get(sub_key, 0) + sub_value
+                else:
+                    totals[key] = totals.get(key, 0) + value
+            self.save_manifest()
+
+    def counts(self, index_name):
+        """Return the status counts recorded for a finished index."""
+        with open(self.path(index_name), "r") as file:
+            return json.loads(file.readline())["counts"]
+
+    def assemble(self, json_file, index_names):
+        """Write the bucket structure from the checkpoints of index_names (in that order), one index in memory at a time."""
+        def index_lines():
+            for index_name in index_names:
+                with open(self.path(index_name), "r") as file:
+                    file.readline()
+                    yield index_name, file.readline().rstrip("\n")
+
+        with open(f"{json_file}.tmp", "w") as file:
+            write_bucket_structure(file, index_lines())
+        os.replace(f"{json_file}.tmp", json_file)
+
+    def finish(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def inventory_checkpoint_dir(json_file):
+    """Checkpoint directory for an inventory of json_file, e.g. bucket_structure.inventory."""
+    return INVENTORY_CHECKPOINT_DIR or f"{os.path.splitext(json_file)[0]}.inventory"
+
+
+def inventory_index(bucket_name, index_prefix, index_name, previous, registered):
+    """
+    List, deduplicate and classify one index.
+
+    Args:
+        bucket_name (str): Name of the DDSS S3 bucket.
+        index_prefix (str): S3 prefix of the index in the DDSS bucket.
+        index_name (str): The index name.
+        previous (dict): What the previous inventory knew about the index ("known", "carried", "uploaded").
+        registered (set): BIDs registered in cachemanager_upload.json.
+
+    Returns:
+        tuple: (bucket structure entries, counters: "duplicates", "duplicate_bytes", "reconciled")
+    """
+    # Paginate through S3 objects for buckets under the index
+    splunk_bucket_names = []
+    with METRICS.timer("ddss_listing"):
+        for sub_page in s3.list_pages(Bucket=bucket_name, Prefix=index_prefix, Delimiter="/"):
+            # Each common prefix is "<index_prefix><bucket>/"
+            splunk_bucket_names.extend(bucket_info["Prefix"][len(index_prefix):-1] for bucket_info in sub_page.get("CommonPrefixes", []))
+
+    # Skip replicated copies of the same bucket before anything gets downloaded twice
+    skipped, copies_info = deduplicate_buckets(bucket_name, index_prefix, index_name, splunk_bucket_names, previous["known"])
+    stats = {
+        "duplicates": len(skipped),
+        "duplicate_bytes": sum(copies_info.get(name, (None, None))[0] or 0 for name in skipped),
+        "reconciled": {},
+    }
+    with METRICS.timer("inventory_classify"):
+        entries = classify_index_buckets(
+            index_name, splunk_bucket_names, skipped, copies_info, previous["carried"], previous["uploaded"], registered, stats["reconciled"]
+        )
+    return entries, stats
+
+
+def generate_bucket_structure(bucket_name, prefix=""):
+    """
+    Generate a JSON structure with indexes and their corresponding buckets from an S3 bucket.
+    Checks local files and a secondary S3 bucket for the receipt.json file.
+
+    The inventory streams: each index is classified, checkpointed (see InventoryCheckpoint), published to the
+    COORDINATOR and dropped before the next one, so memory stays bounded to one index; an interrupted scan
+    resumes from the finished indexes.
+
+    Args:
+        bucket_name (str): Name of the S3 bucket.
+        prefix (str): Prefix for filtering objects in the bucket.
+
+    Returns:
+        dict: Inventory counters ("duplicates" skipped and the "duplicate_bytes" they would have downloaded).
+    """
+    stats = {"duplicates": 0, "duplicate_bytes": 0}
+
+    # What the previous inventory knew, read one index at a time:
+    # - "known": sizes of duplicate copies, so each copy is only inspected once
+    # - "carried": buckets another worker is still thawing keep their lease (expired leases are recovered)
+    #   and buckets whose journal failed its integrity check stay parked
+    # - "uploaded": buckets already registered with cacheman stay "uploaded" while their local copy is intact
+    previous = {}
+    if os.path.exists(BUCKET_JSON):
+        now = time.time()
+        for index_name, buckets in iter_bucket_structure(BUCKET_JSON):
+            known, carried, uploaded = {}, {}, set()
+            for bucket_info in buckets:
+                if "size" in bucket_info and DEDUP_PREFERENCE != "off":
+                    known[bucket_info["bucket"]] = (bucket_info["size"], bucket_info.get("modified"))
+                if bucket_info["status"] == "integrityfailed":
+                    carried[bucket_info["bucket"]] = {"status": "integrityfailed"}
+                elif bucket_info["status"] == "uploaded":
+                    uploaded.add(bucket_info["bucket"])
+                elif bucket_info["status"] == "inprogress":
+                    if lease_active(bucket_info, now):
+                        carried[bucket_info["bucket"]] = {key: bucket_info[key] for key in ("status", "lease_owner", "lease_expires")}
+                    else:
+                        stats["recovered_leases"] = stats.get("recovered_leases", 0) + 1
+            if known or carried or uploaded:
+                previous[index_name] = {"known": known, "carried": carried, "uploaded": uploaded}
+    empty = {"known": {}, "carried": {}, "uploaded": set()}
+    registered = load_registered_bids()
+
+    checkpoint = InventoryCheckpoint(inventory_checkpoint_dir(BUCKET_JSON))
+    manifest = checkpoint.start(bucket_name, prefix)
+    finished = set(manifest["indexes"])
+    if finished:
+        print(f"Resuming the inventory started {time.time() - manifest['started']:.0f}s ago: {len(finished)} index(es) already scanned")
+
+    # Paginate through S3 objects for indexes
+    index_prefixes = []
+    for page in s3.list_pages(Bucket=bucket_name, Prefix=prefix, Delimiter="/"):
+        index_prefixes.extend((index["Prefix"].rstrip("/").split("/")[-1], index["Prefix"]) for index in page.get("CommonPrefixes", []))
+    index_names = [index_name for index_name, _ in index_prefixes]
+    counts = {index_name: checkpoint.counts(index_name) for index_name in index_names if index_name in finished}
+    todo = [(index_name, index_prefix) for index_name, index_prefix in index_prefixes if index_name not in finished]
+
+    # Scan INVENTORY_WORKERS indexes at once so their DDSS listing, S2 listing and local scans overlap. Results
+    # are checkpointed here as each index finishes (in any order) and assembled in listing order below, so the
+    # saved structure does not depend on which index finished first.
+    scanned = 0
+    error = None
+    with ThreadPoolExecutor(max_workers=INVENTORY_WORKERS) as executor:
+        queue = iter(todo)
+        running = {}
+        while True:
+            # Only keep INVENTORY_WORKERS indexes in flight, so memory stays bounded to that many indexes.
+            # After a failure the indexes still running are finished and checkpointed for the next run.
+            for index_name, index_prefix in itertools.islice(queue, 0 if error else INVENTORY_WORKERS - len(running)):
+                future = executor.submit(inventory_index, bucket_name, index_prefix, index_name, previous.get(index_name, empty), registered)
+                running[future] = (index_name, time.perf_counter())
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index_name, started = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                entries, index_stats = future.result()
+                index_counts = counts[index_name] = {}
+                for bucket_info in entries:
+                    index_counts[bucket_info["status"]] = index_counts.get(bucket_info["status"], 0) + 1
+                checkpoint.write_index(index_name, entries, index_counts, index_stats)
+                if COORDINATOR is not None:
+                    # Other hosts (and this one) can claim the index's buckets while the scan goes on
+                    with METRICS.timer("coordination_publish"):
+                        COORDINATOR.publish_inventory({index_name: entries})
+                scanned += 1
+                METRICS.observe("inventory_index", time.perf_counter() - started)
+                METRICS.set_gauge("inventory_indexes_remaining", len(todo) - scanned)
+                print(
+                    f"Inventory {scanned}/{len(todo)}: {index_name} {len(entries)} buckets "
+                    f"(todo={index_counts.get('todo', 0)} done={index_counts.get('done', 0)}) "
+                    f"in {time.perf_counter() - started:.1f}s"
+                )
+                del entries
+    if error is not None:
+        raise error
+
+    # Save result to file
+    checkpoint.assemble(BUCKET_JSON, index_names)
+    write_status_summary(BUCKET_JSON, counts)
+    METRICS.set_status_gauges({(index_name, status): count for index_name, index_counts in counts.items() for status, count in index_counts.items()})
+    checkpoint.finish()
+    print("Bucket structure saved to bucket_structure.json")
+    totals = manifest["stats"]
+    stats["duplicates"] += totals.get("duplicates", 0)
+    stats["duplicate_bytes"] += totals.get("duplicate_bytes", 0)
+    reconciled = totals.get("reconciled", {})
+    if stats.get("recovered_leases"):
+        print(f"Recovered {stats['recovered_leases']} bucket(s) whose inprogress lease expired or whose worker died")
+    if reconciled:
+        for kind, count in reconciled.items():
+            METRICS.count("local_reconciled", count, kind=kind)
+        print(
+            f"Reconciled local buckets: rebuilt={reconciled.get('rebuilt', 0)} "
+            f"(registered in cachemanager_upload.json={reconciled.get('registered', 0)}) "
+            f"promoted from scratch={reconciled.get('promoted', 0)} partial, rebuilding again={reconciled.get('partial', 0)}"
+        )
+    stats["reconciled"] = reconciled
+    if stats["duplicates"]:
+        print(
+            f"Skipped {stats['duplicates']} duplicate bucket copies "
+            f"(rebuilds avoided={stats['duplicates']}, bytes avoided={stats['duplicate_bytes']})"
+        )
+    return stats
+
+
+def load_bucket_structure(json_file):
+    """Load bucket structure from the JSON file."""
+    with open(json_file, "r") as file:
+        return json.load(file)
+
+
+def iter_bucket_structure(json_file):
+    """
+    Yield (index_name, buckets) from a bucket structure one index at a time.
+
+    Structures written by write_bucket_structure hold one index per line and are parsed line by line;
+    any other layout (e.g. the indented files of older versions) is loaded whole.
+    """
+    with open(json_file, "r") as file:
+        first, second = file.readline(), file.readline()
+        if first.strip() != "{" or not (second.startswith('"') or second.strip() == "}"):
+            file.seek(0)
+            yield from json.load(file).items()
+            return
+        for line in itertools.chain([second], file):
+            line = line.rstrip().removesuffix(",")
+            if line == "}":
+                return
+            yield from json.loads(f"{{{line}}}").items()
+
+
+def write_bucket_structure(file, index_lines):
+    """
+    Write a bucket structure as JSON with one index per line, so it can be read and written an index at a time.
+
+    Args:
+        file: Open text file.
+        index_lines (iterable): (index_name, JSON text of its bucket list) pairs.
+    """
+    file.write("{")
+    separator = "\n"
+    for index_name, buckets_json in index_lines:
+        file.write(f"{separator}{json.dumps(index_name)}: {buckets_json}")
+        separator = ",\n"
+    file.write("\n}\n")
+
+
+def save_bucket_structure(json_file, bucket_data):
+    """Save updated bucket structure back to the JSON file (and refresh its status summary)."""
+    # Write to a temporary file first so a crash mid-write cannot truncate the state
+    with open(f"{json_file}.tmp", "w") as file:
+        write_bucket_structure(file, ((index_name, json.dumps(buckets)) for index_name, buckets in bucket_data.items()))
+    os.replace(f"{json_file}.tmp", json_file)
+    update_status_summary(json_file, bucket_data)
+
+
+# Status Summary
+PROGRESSED_STATUSES = ("pendingupload", "uploaded", "pendingevict", "done")
+REMAINING_STATUSES = ("todo", "inprogress")
+
+
+def status_summary_path(json_file):
+    """The status summary kept next to a bucket structure, e.g. bucket_structure.status.json."""
+    return f"{os.path.splitext(json_file)[0]}.status.json"
+
+
+def update_status_summary(json_file, bucket_data):
+    """
+    Write the per-index, per-status counts of a bucket structure to its status summary.
+
+    The summary also keeps a ring of progress snapshots (buckets per index that got past the thaw), at
+    most one per STATUS_SNAPSHOT_INTERVAL seconds and none older than STATUS_HISTORY_SECONDS, so the status command
+    can report throughput and ETAs without reading the structure itself.
+    """
+    counts = {}
+    for index_name, buckets in bucket_data.items():
+        index_counts = counts[index_name] = {}
+        for bucket_info in buckets:
+            index_counts[bucket_info["status"]] = index_counts.get(bucket_info["status"], 0) + 1
+    write_status_summary(json_file, counts)
+
+
+def write_status_summary(json_file, counts):
+    """Write the status summary of json_file from index -> {status: buckets} counts (see update_status_summary)."""
+    path = status_summary_path(json_file)
+    snapshots = []
+    try:
+        with open(path, "r") as file:
+            snapshots = json.load(file).get("snapshots", [])
+    except (OSError, ValueError):
+        pass
+    now = time.time()
+    if not snapshots or now - snapshots[-1]["time"] >= STATUS_SNAPSHOT_INTERVAL:
+        snapshots.append({
+            "time": now,
+            "progressed": {
+                index_name: sum(index_counts.get(status, 0) for status in PROGRESSED_STATUSES)
+                for index_name, index_counts in counts.items()
+            },
+        })
+    snapshots = [snapshot for snapshot in snapshots if now - snapshot["time"] <= STATUS_HISTORY_SECONDS]
+    with open(f"{path}.tmp", "w") as file:
+        json.dump({"updated": now, "counts": counts, "snapshots": snapshots}, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def parse_duration(value):
+    """Parse a duration such as "90", "15m", "1h" or "7d" into seconds."""
+    value = str(value).strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def print_status_summary(json_file=BUCKET_JSON):
+    """
+    Print bucket counts, recent throughput and an ETA per index from the status summary.
+
+    Only the summary file (and the coordination store, if configured) is read: neither S3 nor Splunk is
+    contacted and the bucket structure is not loaded. Throughput is buckets per hour getting past the
+    thaw over each of STATUS_WINDOWS; the ETA divides the remaining "todo"/"inprogress" buckets by the
+    rate over the longest window with data.
+
+    Returns:
+        dict: The summary, or None if none has been written yet.
+    """
+    path = status_summary_path(json_file)
+    try:
+        with open(path, "r") as file:
+            summary = json.load(file)
+    except (OSError, ValueError):
+        print(f"No status summary at {path} yet; it is written whenever {json_file} is saved")
+        return None
+    windows = [(window, parse_duration(window)) for window in STATUS_WINDOWS.split(",") if window]
+    updated, snapshots = summary["updated"], summary["snapshots"]
+
+    def rates(index_names):
+        current = sum(summary["counts"].get(index_name, {}).get(status, 0) for index_name in index_names for status in PROGRESSED_STATUSES)
+        result = {}
+        for label, seconds in windows:
+            base = next((snapshot for snapshot in snapshots if snapshot["time"] >= updated - seconds), None)
+            if base is None or updated - base["time"] < 1:
+                result[label] = None
+                continue
+            progressed = current - sum(base["progressed"].get(index_name, 0) for index_name in index_names)
+            result[label] = max(progressed, 0) * 3600 / (updated - base["time"])
+        return result
+
+    def describe(counts, index_names):
+        window_rates = rates(index_names)
+        remaining = sum(counts.get(status, 0) for status in REMAINING_STATUSES)
+        rate = next((value for value in reversed(list(window_rates.values())) if value), None)
+        if not remaining:
+            eta = "complete"
+        else:
+            eta = f"{remaining / rate:.1f}h" if rate else "unknown"
+        return (
+            " ".join(f"{status}={count}" for status, count in sorted(counts.items()))
+            + " | " + " ".join(f"{label}={'-' if value is None else f'{value:.1f}'}/h" for label, value in window_rates.items())
+            + f" | eta={eta}"
+        )
+
+    print(f"\033[46mStatus\033[0m from {path} (updated {time.time() - updated:.0f}s ago):")
+    totals = {}
+    for index_name, counts in sorted(summary["counts"].items()):
+        print(f"  {index_name}: {describe(counts, [index_name])}")
+        for status, count in counts.items():
+            totals[status] = totals.get(status, 0) + count
+    print(f"Total: {describe(totals, list(summary['counts']))}")
+    if COORDINATOR is not None:
+        print("Coordination store: " + " ".join(f"{status}={count}" for status, count in sorted(COORDINATOR.status_counts().items())))
+        COORDINATOR.print_report()
+    return summary
+
+# Time Range Selection
+def parse_restore_time(value):
+    """
+    Parse a restore window boundary given as epoch seconds or an ISO 8601 date/time.
+
+    Args:
+        value (str): The boundary, e.g. "1651609155" or "2022-05-03T20:00:00+00:00" (ints are passed through).
+
+    Returns:
+        int: Epoch seconds, or None if no boundary was given.
+    """
+    if value in (None, ""):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def bucket_time_range(bucket_name):
+    """
+    Extract the event time range from a bucket name (db_<latest>_<earliest>_<bucketNum>_<serverGUID>).
+
+    Args:
+        bucket_name (str): The bucket name.
+
+    Returns:
+        tuple: (earliest, latest) epoch seconds.
+    """
+    bucket_parts = bucket_name.split("_")
+    return int(bucket_parts[2]), int(bucket_parts[1])
+
+
+class TimeIndex:
+    """
+    Interval index over the time ranges of inventoried buckets, one per index.
+
+    Buckets are kept sorted by earliest time together with the widest bucket span of the index, so a window
+    query only has to look at buckets whose earliest time lies in [window_earliest - max_span, window_latest].
+    """
+
+    def __init__(self, bucket_data):
+        self.indexes = {}
+        for index_name, buckets in bucket_data.items():
+            entries = sorted(
+                (bucket_time_range(bucket_info["bucket"]) + (position,) for position, bucket_info in enumerate(buckets)),
+            )
+            max_span = max((latest - earliest for earliest, latest, _ in entries), default=0)
+            self.indexes[index_name] = ([entry[0] for entry in entries], entries, max_span, buckets)
+
+    def overlapping(self, index_name, earliest=None, latest=None):
+        """
+        Find the buckets of an index whose time range overlaps [earliest, latest].
+
+        Args:
+            index_name (str): The index name.
+            earliest (int): Window start in epoch seconds (None for unbounded).
+            latest (int): Window end in epoch seconds (None for unbounded).
+
+        Returns:
+            list: Bucket info dicts of the overlapping buckets, in listing order.
+        """
+        if index_name not in self.indexes:
+            return []
+        starts, entries, max_span, buckets = self.indexes[index_name]
+        low = 0 if earliest is None else bisect.bisect_left(starts, earliest - max_span)
+        high = len(starts) if latest is None else bisect.bisect_right(starts, latest)
+        positions = [
+            position for bucket_earliest, bucket_latest, position in entries[low:high]
+            if earliest is None or bucket_latest >= earliest
+        ]
+        return [buckets[position] for position in sorted(positions)]
+
+
+def restore_candidates(bucket_data, index_name, status="todo", time_index=None):
+    """
+    Find the buckets of an index with a status inside the restore window, in listing order.
+
+    Args:
+        bucket_data (dict): The bucket structure.
+        index_name (str): The index name.
+        status (str): Only buckets with this status are returned.
+        time_index (TimeIndex): A prebuilt index over bucket_data (built on demand if a window is set).
+
+    Returns:
+        list: Bucket info dicts.
+    """
+    earliest, latest = parse_restore_time(RESTORE_EARLIEST), parse_restore_time(RESTORE_LATEST)
+    if earliest is None and latest is None:
+        buckets = bucket_data.get(index_name, [])
+    else:
+        time_index = time_index or TimeIndex({index_name: bucket_data.get(index_name, [])})
+        buckets = time_index.overlapping(index_name, earliest, latest)
+    return [bucket_info for bucket_info in buckets if bucket_info["status"] == status]
+
+
+def select_restore_buckets(bucket_data, index_name, status="todo", time_index=None, limit=None):
+    """
+    Select the buckets of an index to restore, honouring the restore window and priority policy.
+
+    Args:
+        bucket_data (dict): The bucket structure.
+        index_name (str): The index name.
+        status (str): Only buckets with this status are selected.
+        time_index (TimeIndex): A prebuilt index over bucket_data (built on demand if a window is set).
+        limit (int): Only return the first limit buckets.
+
+    Returns:
+        list: Bucket info dicts in the order they should be restored.
+    """
+    candidates = restore_candidates(bucket_data, index_name, status, time_index)
+    queue = RestoreQueue(((index_name, bucket_info) for bucket_info in candidates), make_priority_key())
+    return [bucket_info for _, bucket_info in queue.take(len(queue) if limit is None else limit)]
+
+
+# Restore Scheduling
+RESTORE_POLICIES = ("requested", "index", "newest", "oldest", "smallest")
+
+
+def parse_restore_policy(value):
+    """
+    Validate a restore policy such as "requested,index,newest".
+
+    Returns:
+        str: The policy with blanks removed.
+
+    Raises:
+        ValueError: A policy name is not one of RESTORE_POLICIES.
+    """
+    policies = [policy.strip() for policy in (value or "").split(",") if policy.strip()]
+    unknown = [policy for policy in policies if policy not in RESTORE_POLICIES]
+    if unknown:
+        raise ValueError(f"Unknown restore policy {', '.join(unknown)} (choose from {', '.join(RESTORE_POLICIES)})")
+    return ",".join(policies)
+
+
+def restore_policies():
+    """The active policies, most significant first: RESTORE_POLICY, else RESTORE_ORDER on its own."""
+    policy = parse_restore_policy(RESTORE_POLICY) or RESTORE_ORDER
+    return policy.split(",") if policy else []
+
+
+def load_restore_requests(path=None):
+    """
+    Load the request file for the "requested" policy.
+
+    Each line holds a bid (index~bucketNum~serverGUID) or a bucket name; blank lines and "#" comments are skipped.
+
+    Returns:
+        dict: Bid or bucket name -> position in the file (empty if no file is set).
+    """
+    path = path or RESTORE_REQUEST_FILE
+    if not path:
+        return {}
+    requests_by_name = {}
+    with open(path, "r") as file:
+        for line in file:
+            name = line.split("#", 1)[0].strip()
+            if name:
+                requests_by_name.setdefault(name, len(requests_by_name))
+    return requests_by_name
+
+
+def make_priority_key(policies=None):
+    """
+    Build the priority key for the active restore policies.
+
+    - "requested": buckets in RESTORE_REQUEST_FILE first, in file order.
+    - "index": indexes in INDEX_PRIORITY first, in list order.
+    - "newest" / "oldest": by the bucket's latest (descending) / earliest (ascending) event time.
+    - "smallest": smallest journal first, for quick wins (buckets without a known "size" last).
+
+    Args:
+        policies (list): Policy names, most significant first (defaults to restore_policies()).
+
+    Returns:
+        callable: key(index_name, bucket_info) -> tuple, smaller restores first; None without a policy
+                  (listing order).
+    """
+    policies = restore_policies() if policies is None else policies
+    if not policies:
+        return None
+    requested = load_restore_requests() if "requested" in policies else {}
+    index_order = {name: position for position, name in enumerate(filter(None, INDEX_PRIORITY.split(",")))}
+
+    def key(index_name, bucket_info):
+        bucket_name = bucket_info["bucket"]
+        parts = []
+        for policy in policies:
+            if policy == "requested":
+                parts.append(requested.get(get_bid(index_name, bucket_name), requested.get(bucket_name, len(requested))))
+            elif policy == "index":
+                parts.append(index_order.get(index_name, len(index_order)))
+            elif policy == "newest":
+                parts.append(-bucket_time_range(bucket_name)[1])
+            elif policy == "oldest":
+                parts.append(bucket_time_range(bucket_name)[0])
+            elif policy == "smallest":
+                parts.append(bucket_info.get("size", math.inf))
+        return tuple(parts)
+
+    return key
+
+
+class RestoreQueue:
+    """
+    Priority queue of (index_name, bucket_info) pairs to restore, smallest key first.
+
+    Backed by a binary heap: building it is O(n) and taking the next k buckets O(k log n), however large the
+    inventory. Ties keep insertion order, so without a key the queue is plain listing order.
+    """
+
+    def __init__(self, items=(), key=None):
+        """
+        Args:
+            items (iterable): (index_name, bucket_info) pairs.
+            key (callable): Priority key, key(index_name, bucket_info) (see make_priority_key).
+        """
+        self.key = key
+        self.sequence = itertools.count()
+        self.heap = [self.entry(index_name, bucket_info) for index_name, bucket_info in items]
+        heapq.heapify(self.heap)
+
+    def entry(self, index_name, bucket_info):
+        priority = self.key(index_name, bucket_info) if self.key is not None else ()
+        return (priority, next(self.sequence), index_name, bucket_info)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, index_name, bucket_info):
+        heapq.heappush(self.heap, self.entry(index_name, bucket_info))
+
+    def peek(self):
+        """Return the next (index_name, bucket_info) without removing it."""
+        return self.heap[0][2:]
+
+    def pop(self):
+        """Remove and return the next (index_name, bucket_info)."""
+        return heapq.heappop(self.heap)[2:]
+
+    def take(self, limit):
+        """Remove and return up to limit pairs in priority order."""
+        return [self.pop() for _ in range(min(limit, len(self.heap)))]
+
+
+# Downloads
+def parse_size(value):
+    """
+    Parse a size such as "400G", "512KB" or "1.5T" (1024-based).
+
+    Returns:
+        float: Bytes, 0 if no size was given.
+    """
+    value = str(value or "0").strip().upper().removesuffix("B")
+    multiplier = 1
+    if value and value[-1] in "KMGT":
+        multiplier = 1024 ** ("KMGT".index(value[-1]) + 1)
+        value = value[:-1]
+    return float(value) * multiplier
+
+
+def parse_rate(value):
+    """
+    Parse a bandwidth limit such as "100M", "512KB/s" or "1.5G" (bytes per second, 1024-based).
+
+    Returns:
+        float: Bytes per second, 0 for unlimited.
+    """
+    return parse_size(str(value or "0").strip().upper().removesuffix("/S"))
+
+
+def parse_rate_schedule(schedule):
+    """
+    Parse a time-of-day schedule such as "08:00-20:00=20M;20:00-08:00=0".
+
+    Returns:
+        list: (start minute, end minute, bytes per second) windows; a window may wrap past midnight.
+    """
+    windows = []
+    for entry in filter(None, (part.strip() for part in schedule.split(";"))):
+        window, rate = entry.split("=", 1)
+        start, end = window.split("-", 1)
+        minutes = [int(clock.split(":")[0]) * 60 + int(clock.split(":")[1]) for clock in (start, end)]
+        windows.append((minutes[0], minutes[1], parse_rate(rate)))
+    return windows
+
+
+class BandwidthGovernor:
+    """
+    Token bucket shared by every download worker.
+
+    Workers take tokens for each chunk before writing it; when the bucket runs dry they sleep off the
+    debt, so concurrent downloads share the limit fairly. The limit comes from a runtime override (daemon
+    control file), else the first matching DOWNLOAD_RATE_SCHEDULE window, else DOWNLOAD_RATE, and is
+    re-evaluated on every chunk. At most one second worth of tokens is banked.
+    """
+
+    def __init__(self, rate=0, schedule=()):
+        self.default_rate = rate
+        self.schedule = list(schedule)
+        self.override = None
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.window = deque()
+        self.window_bytes = 0
+        self.total_bytes = 0
+        self.last_export = 0
+
+    def set_override(self, rate):
+        """Replace the configured limit at runtime (None returns to the schedule/default)."""
+        with self.lock:
+            self.override = rate
+
+    def rate(self):
+        """Return the limit in effect right now (bytes per second, 0 for unlimited)."""
+        if self.override is not None:
+            return self.override
+        now = datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self.default_rate
+
+    def consume(self, nbytes):
+        """Account for nbytes downloaded, sleeping as long as the limit requires."""
+        rate = self.rate()
+        with self.lock:
+            now = time.monotonic()
+            self.total_bytes += nbytes
+            self.window.append((now, nbytes))
+            self.window_bytes += nbytes
+            while self.window and now - self.window[0][0] > 10:
+                self.window_bytes -= self.window.popleft()[1]
+            if rate > 0:
+                self.tokens = min(rate, self.tokens + (now - self.updated) * rate) - nbytes
+                delay = -self.tokens / rate if self.tokens < 0 else 0
+            else:
+                self.tokens = 0.0
+                delay = 0
+            self.updated = now
+            export = now - self.last_export >= 1
+            if export:
+                self.last_export = now
+        if export:
+            METRICS.set_gauge("download_rate_limit_bytes", rate)
+            METRICS.set_gauge("download_bytes_per_second", round(self.throughput()))
+        if delay:
+            time.sleep(delay)
+
+    def throughput(self):
+        """Return the aggregate download rate over the last 10 seconds (bytes per second)."""
+        with self.lock:
+            if not self.window:
+                return 0.0
+            elapsed = max(time.monotonic() - self.window[0][0], 1.0)
+            return self.window_bytes / elapsed
+
+
+GOVERNOR = BandwidthGovernor(parse_rate(DOWNLOAD_RATE), parse_rate_schedule(DOWNLOAD_RATE_SCHEDULE))
+
+
+class IntegrityError(Exception):
+    """A downloaded journal did not match its S3 checksum after every retry."""
+
+
+class DownloadError(Exception):
+    """A journal download kept failing (connection, streaming or local write errors) after every retry."""
+
+
+class JournalVerifier:
+    """
+    Checks a journal against what S3 reports for it while the bytes stream past (no second read).
+
+    The strongest available check wins: a full-object SHA256, SHA1 or CRC32 checksum stored by S3
+    (composite multipart checksums are skipped), else the ETag as the MD5 of the object, or of its parts
+    for multipart uploads ("<md5 of part md5s>-<parts>", with the part size from a HEAD of part 1). ETags of
+    SSE-KMS/SSE-C objects are not MD5s, so those fall back to the size check that always applies.
+    """
+
+    def __init__(self, meta):
+        self.size = meta["size"]
+        self.received = 0
+        self.algorithm, self.expected = "size", None
+        checksums = meta.get("checksums") or {}
+        etag = (meta.get("etag") or "").strip('"')
+        for algorithm in ("SHA256", "SHA1", "CRC32"):
+            value = checksums.get(f"Checksum{algorithm}")
+            if value and "-" not in value:
+                self.algorithm, self.expected = algorithm.lower(), value
+                break
+        else:
+            if etag and not meta.get("sse_kms"):
+                if "-" not in etag:
+                    self.algorithm, self.expected = "md5", etag
+                elif meta.get("part_size"):
+                    self.algorithm, self.expected = "multipart", etag
+        self.part_size = meta.get("part_size")
+        self.part_digests = []
+        self.part_filled = 0
+        self.crc = 0
+        self.hash = hashlib.new(self.algorithm) if self.algorithm in ("sha256", "sha1", "md5") else hashlib.md5()
+
+    def update(self, chunk):
+        self.received += len(chunk)
+        if self.algorithm == "crc32":
+            self.crc = zlib.crc32(chunk, self.crc)
+        elif self.algorithm == "multipart":
+            view = memoryview(chunk)
+            while view:
+                take = min(len(view), self.part_size - self.part_filled)
+                self.hash.update(view[:take])
+                self.part_filled += take
+                view = view[take:]
+                if self.part_filled == self.part_size:
+                    self.part_digests.append(self.hash.digest())
+                    self.hash = hashlib.md5()
+                    self.part_filled = 0
+        elif self.algorithm != "size":
+            self.hash.update(chunk)
+
+    def verify(self):
+        """
+        Returns:
+            tuple: (True if the journal matches, description of the check or mismatch).
+        """
+        if self.received != self.size:
+            return False, f"size {self.received} != {self.size}"
+        if self.algorithm == "size":
+            return True, "size"
+        if self.algorithm == "crc32":
+            actual = base64.b64encode(self.crc.to_bytes(4, "big")).decode()
+        elif self.algorithm == "multipart":
+            digests = self.part_digests + ([self.hash.digest()] if self.part_filled else [])
+            actual = f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+        elif self.algorithm == "md5":
+            actual = self.hash.hexdigest()
+        else:
+            actual = base64.b64encode(self.hash.digest()).decode()
+        if actual != self.expected:
+            return False, f"{self.algorithm} {actual} != {self.expected}"
+        return True, self.algorithm
+
+
+def journal_meta(response, key):
+    """Describe a journal from a full GET response: ETag, size and whatever checksums S3 stores for it."""
+    meta = {
+        "etag": response.get("ETag"),
+        "size": response["ContentLength"],
+        "checksums": {name: value for name, value in response.items() if name.startswith("Checksum") and name != "ChecksumType"},
+        "sse_kms": response.get("ServerSideEncryption") == "aws:kms" or "SSECustomerAlgorithm" in response,
+    }
+    if "-" in (meta["etag"] or "") and not meta["sse_kms"]:
+        # Multipart ETags are built from the MD5 of every part; part 1 gives the part size
+        try:
+            meta["part_size"] = s3.head_object(Bucket=DDSS_BUCKET_NAME, Key=key, PartNumber=1)["ContentLength"]
+        except s3.exceptions.ClientError:
+            pass
+    return meta
 
-def check_local_status(index_name, bucket_name):
+
+def open_journal_stream(key, part_path, meta_path):
     """
-    Check if Hosts.data exists locally for the given bucket.
+    Start (or resume) the GET for a journal download.
+
+    A previous partial download is resumed with a ranged GET when its recorded ETag and size still match
+    the object (If-Match makes S3 refuse the range otherwise); anything else starts again from byte zero.
+
+    Returns:
+        tuple: (GET response or None if the .part file is already complete, bytes already on disk, journal meta).
+    """
+    offset = 0
+    meta = None
+    if os.path.exists(part_path) and os.path.exists(meta_path):
+        try:
+            with open(meta_path, "r") as file:
+                meta = json.load(file)
+            offset = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            meta = None
+    if meta and 0 < offset < meta["size"]:
+        try:
+            response = s3.get_object(Bucket=DDSS_BUCKET_NAME, Key=key, Range=f"bytes={offset}-", IfMatch=meta["etag"])
+            if response.get("ETag") == meta["etag"]:
+                return response, offset, meta
+            response["Body"].close()
+        except s3.exceptions.ClientError as e:
+            if str(e.response.get("Error", {}).get("Code")) not in ("PreconditionFailed", "412", "InvalidRange", "416"):
+                raise
+        print(f"Partial download of {key} no longer matches the object, starting again")
+    elif meta and offset == meta["size"]:
+        # Fully downloaded before the crash, only the verification and rename are missing
+        return None, offset, meta
+    response = s3.get_object(Bucket=DDSS_BUCKET_NAME, Key=key, ChecksumMode="ENABLED")
+    meta = journal_meta(response, key)
+    with open(meta_path, "w") as file:
+        json.dump(meta, file)
+    return response, 0, meta
+
+
+def download_journal(index_name, bucket_name, bucket_dir, label=""):
+    """
+    Download a bucket's journal.zst from the DDSS archive through the bandwidth governor.
+
+    The file is written as journal.zst.part (with its ETag, size and checksums in journal.zst.part.meta)
+    and renamed once complete and verified. An interrupted download, in this run or a crashed one, resumes
+    from the bytes already on disk; a stalled stream is retried up to DOWNLOAD_RETRIES times. The journal
+    is checked against its S3 checksum while it streams (see JournalVerifier); a mismatch discards it and
+    downloads again, up to INTEGRITY_RETRIES times. A journal that is already present is kept, so
+    process_bucket.sh only has to rebuild.
 
     Args:
         index_name (str): The index name.
         bucket_name (str): The bucket name.
+        bucket_dir (str): Local bucket directory.
+        label (str): Prefix for progress lines.
 
     Returns:
-        bool: True if Hosts.data exists, False otherwise.
+        int: Bytes downloaded.
+
+    Raises:
+        IntegrityError: The journal never matched its checksum.
+        DownloadError: The GET or its stream failed DOWNLOAD_RETRIES + 1 times in a row.
     """
-    local_path = os.path.join(LOCAL_BASE_PATH, index_name, "db", bucket_name, "Hosts.data")
-    return os.path.exists(local_path)
+    journal_path = os.path.join(bucket_dir, "rawdata", "journal.zst")
+    if os.path.exists(journal_path):
+        return 0
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+    key = f"{DDSS_PATH_NAME or ''}{index_name}/{bucket_name}/rawdata/journal.zst"
+    part_path = f"{journal_path}.part"
+    meta_path = f"{journal_path}.part.meta"
+    downloaded = 0
+    start = last_report = time.monotonic()
+    for integrity_attempt in range(INTEGRITY_RETRIES + 1):
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                response, offset, meta = open_journal_stream(key, part_path, meta_path)
+            except s3.exceptions.ClientError:
+                # S3 answered (e.g. the journal is missing): retrying will not help
+                raise
+            except Exception as e:
+                # Connection errors surface from botocore (EndpointConnectionError, ReadTimeoutError, ...)
+                if attempt == DOWNLOAD_RETRIES:
+                    raise DownloadError(f"GET of {key} failed {attempt + 1} times: {e}") from e
+                print(f"{label}\033[31mGET of {bucket_name} failed ({e}), retrying\033[0m")
+                continue
+            total = meta["size"]
+            verifier = JournalVerifier(meta)
+            if offset:
+                # Only a resumed download reads back what is already on disk
+                with open(part_path, "rb") as file:
+                    for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        verifier.update(chunk)
+            if response is None:
+                break
+            if offset:
+                print(f"{label}Resuming {bucket_name} at {offset / 1048576:.0f}/{total / 1048576:.0f} MB")
+            try:
+                with open(part_path, "ab" if offset else "wb") as file:
+                    for chunk in response["Body"].iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                        GOVERNOR.consume(len(chunk))
+                        verifier.update(chunk)
+                        file.write(chunk)
+                        downloaded += len(chunk)
+                        offset += len(chunk)
+                        now = time.monotonic()
+                        if now - last_report >= DOWNLOAD_PROGRESS_INTERVAL:
+                            last_report = now
+                            print(
+                                f"{label}Downloading {bucket_name}: {offset / 1048576:.0f}/{total / 1048576:.0f} MB "
+                                f"({downloaded / (now - start) / 1048576:.1f} MB/s, all downloads {GOVERNOR.throughput() / 1048576:.1f} MB/s)"
+                            )
+            except Exception as e:
+                # Connection resets and read timeouts surface from botocore/urllib3; the .part file is kept for the retry
+                if attempt == DOWNLOAD_RETRIES:
+                    raise DownloadError(f"Download of {bucket_name} failed {attempt + 1} times: {e}") from e
+                print(f"{label}\033[31mDownload of {bucket_name} interrupted at {offset / 1048576:.0f} MB ({e}), resuming\033[0m")
+                continue
+            if offset >= total:
+                break
+
+        matches, detail = verifier.verify()
+        if matches:
+            os.replace(part_path, journal_path)
+            os.remove(meta_path)
+            METRICS.count("bytes", downloaded, direction="download")
+            METRICS.count("integrity_checks", result="ok", algorithm=verifier.algorithm)
+            return downloaded
+        METRICS.count("integrity_checks", result="mismatch", algorithm=verifier.algorithm)
+        print(f"{label}\033[31mIntegrity check failed for {bucket_name} ({detail}), downloading again\033[0m")
+        os.remove(part_path)
+        os.remove(meta_path)
+    METRICS.count("bytes", downloaded, direction="download")
+    raise IntegrityError(f"journal.zst of {bucket_name} failed its integrity check {INTEGRITY_RETRIES + 1} times ({detail})")
+
+
+# Scratch Staging
+class ScratchBudget:
+    """
+    Space reservations on the scratch tier.
 
-def load_s2_index_structure(index_name):
+    Each bucket reserves its estimated rebuilt size before it starts and releases it once promoted (or
+    failed). One-shot workers wait for space; the daemon only admits buckets whose reservation fits.
+    A bucket larger than the whole budget is still admitted when nothing else holds a reservation.
+
+    A failed bucket keeps its journal download on scratch so the next attempt resumes it; those bytes
+    stay reserved as "held" for its directory until a retry takes them over (take_held). Leftovers from
+    earlier runs are found and held when the budget is first used.
     """
-    Load the structure of the S3 bucket for a given index into memory.
 
-    Args:
-        index_name (str): The index name.
+    def __init__(self, path, budget=0):
+        self.path = path
+        self.capacity = budget
+        self.reserved = 0
+        self.held = None
+        self.condition = threading.Condition()
+
+    def ensure_capacity(self):
+        if not self.capacity:
+            os.makedirs(self.path, exist_ok=True)
+            self.capacity = shutil.disk_usage(self.path).free
+        if self.held is None:
+            self.held = {}
+            for bucket_dir in glob.glob(os.path.join(self.path, "*", "db", "*")):
+                nbytes = sum(
+                    os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(bucket_dir) for name in names
+                )
+                if nbytes:
+                    self.held[bucket_dir] = nbytes
+                    self.reserved += nbytes
+
+    def hold(self, bucket_dir, nbytes):
+        """Keep nbytes of an ending reservation held for bucket_dir (files left on scratch for a retry)."""
+        with self.condition:
+            self.ensure_capacity()
+            self.held[bucket_dir] = self.held.get(bucket_dir, 0) + nbytes
+
+    def take_held(self, bucket_dir):
+        """Hand over the bytes held for bucket_dir (still reserved) to the caller's reservation."""
+        with self.condition:
+            self.ensure_capacity()
+            return self.held.pop(bucket_dir, 0)
+
+    def fits(self, nbytes):
+        return self.reserved == 0 or self.reserved + nbytes <= self.capacity
+
+    def try_reserve(self, nbytes):
+        """Reserve nbytes if they fit now; returns False otherwise."""
+        with self.condition:
+            self.ensure_capacity()
+            if not self.fits(nbytes):
+                return False
+            self.reserved += nbytes
+        METRICS.set_gauge("scratch_reserved_bytes", self.reserved)
+        return True
 
-    Returns:
-        set: A set containing keys for all receipt.json files.
+    def reserve(self, nbytes):
+        """Reserve nbytes, waiting for other buckets to release space if needed."""
+        with self.condition:
+            self.ensure_capacity()
+            while not self.fits(nbytes):
+                self.condition.wait()
+            self.reserved += nbytes
+        METRICS.set_gauge("scratch_reserved_bytes", self.reserved)
+
+    def release(self, nbytes):
+        with self.condition:
+            self.reserved = max(0, self.reserved - nbytes)
+            self.condition.notify_all()
+        METRICS.set_gauge("scratch_reserved_bytes", self.reserved)
+
+
+SCRATCH = ScratchBudget(SCRATCH_PATH, parse_size(SCRATCH_BUDGET)) if SCRATCH_PATH else None
+# Files of a failed bucket kept on scratch: its journal, complete or resumable (see download_journal)
+SCRATCH_KEPT_FILES = ("journal.zst", "journal.zst.part", "journal.zst.part.meta")
+
+
+def trim_failed_scratch(work_dir):
     """
-    receipt_keys = set()
-    prefix = f"{S2_PATH_NAME}{index_name}/db/"
-    paginator = s3.get_paginator("list_objects_v2")
-    for page in paginator.paginate(Bucket=S2_BUCKET_NAME, Prefix=prefix):
-        for obj in page.get("Contents", []):
-            if obj["Key"].endswith("receipt.json"):
-                receipt_keys.add(obj["Key"])
-    return receipt_keys
+    Remove a failed bucket's rebuilt files from scratch, keeping its journal download for the next attempt.
 
-def check_receipt_in_structure(receipt_keys, index_name, bucket_num, server_guid):
+    Returns:
+        int: Bytes left on scratch (0 if the directory was removed).
     """
-    Check if the receipt.json file exists in the preloaded S3 structure.
+    kept = 0
+    rawdata_dir = os.path.join(work_dir, "rawdata")
+    for parent in (work_dir, rawdata_dir):
+        try:
+            entries = list(os.scandir(parent))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if parent == rawdata_dir and entry.name in SCRATCH_KEPT_FILES and entry.is_file(follow_symlinks=False):
+                kept += entry.stat().st_size
+            elif parent == work_dir and entry.name == "rawdata":
+                continue
+            elif entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+    if not kept:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return kept
+# Journal sizes fetched for scratch estimates, so a bucket waiting for space is only HEADed once
+SCRATCH_JOURNAL_SIZES = {}
+
+
+def estimate_scratch_bytes(index_name, bucket_info):
+    """Estimate the scratch space a bucket needs: its journal size (HEAD if unknown) times SCRATCH_EXPANSION."""
+    size = bucket_info.get("size")
+    if size is None:
+        key = (index_name, bucket_info["bucket"])
+        if key not in SCRATCH_JOURNAL_SIZES:
+            journal_key = f"{DDSS_PATH_NAME or ''}{index_name}/{bucket_info['bucket']}/rawdata/journal.zst"
+            SCRATCH_JOURNAL_SIZES[key], _ = get_journal_info(DDSS_BUCKET_NAME, journal_key)
+        size = SCRATCH_JOURNAL_SIZES[key]
+    return int((size or 0) * SCRATCH_EXPANSION)
+
+
+def promote_bucket(scratch_dir, bucket_dir):
+    """
+    Move a rebuilt bucket from scratch into its index directory.
+
+    Within one filesystem this is a single atomic rename. Across filesystems the bucket is copied into a
+    hidden ".<bucket>.promoting" directory next to its destination (Splunk ignores it) and then renamed,
+    so Splunk never sees a half-copied bucket.
 
     Args:
-        receipt_keys (set): A set of preloaded S3 keys.
-        index_name (str): The index name.
-        bucket_num (str): The bucket number.
-        server_guid (str): The server GUID.
+        scratch_dir (str): The rebuilt bucket on scratch.
+        bucket_dir (str): Its final location under LOCAL_BASE_PATH.
+    """
+    parent = os.path.dirname(bucket_dir)
+    os.makedirs(parent, exist_ok=True)
+    if os.path.exists(bucket_dir):
+        if local_file_types(bucket_dir).issuperset(LOCAL_REQUIRED_FILE_TYPES):
+            # A complete bucket is never deleted: keep it in a hidden directory (Splunk ignores it) for inspection
+            aside_dir = os.path.join(parent, f".{os.path.basename(bucket_dir)}.replaced.{int(time.time())}")
+            print(f"\033[31m{bucket_dir} already holds a complete bucket, moving it aside to {aside_dir}\033[0m")
+            os.rename(bucket_dir, aside_dir)
+        else:
+            # Leftover of an earlier in-place attempt that never finished its rebuild
+            shutil.rmtree(bucket_dir)
+    if os.stat(scratch_dir).st_dev == os.stat(parent).st_dev:
+        os.rename(scratch_dir, bucket_dir)
+        return
+    staging_dir = os.path.join(parent, f".{os.path.basename(bucket_dir)}.promoting")
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    shutil.copytree(scratch_dir, staging_dir)
+    os.rename(staging_dir, bucket_dir)
+    shutil.rmtree(scratch_dir)
 
-    Returns:
-        bool: True if the receipt.json file exists, False otherwise.
+
+# Coordination
+class Coordinator(ABC):
+    """
+    Shared state for restoring one archive from several hosts at once.
+
+    Every host publishes its inventory into one store and claims "todo" buckets from it under a lease
+    that its heartbeat renews. Each index has an affinity to one live host (rendezvous hashing), so a
+    host keeps rebuilding the same indexes; once its own indexes are exhausted it steals from the index
+    with the largest backlog. A host that stops heartbeating for COORD_HOST_TIMEOUT seconds loses its
+    leases, so its buckets become claimable again and its indexes re-hash onto the remaining hosts.
+
+    Backends store one row per bucket (index_name, bucket, status, owner, lease_expires, rank, earliest,
+    latest) and one per host (host, started, heartbeat, thawed, failed, bytes). Buckets this host declined
+    (see decline) are only remembered by this process and are never claimed or waited for by it again.
+    Backends implement every abstract method; one that misses any fails as soon as it is created.
     """
-    # Calculate SHA1 and construct S3 key
-    sha1_hash = calculate_sha(bucket_num, server_guid)
-    sha_part1 = sha1_hash[:2]
-    sha_part2 = sha1_hash[2:4]
-    s3_key = f"{S2_PATH_NAME}{index_name}/db/{sha_part1}/{sha_part2}/{bucket_num}~{server_guid}/receipt.json"
 
-    return s3_key in receipt_keys
+    def __init__(self, host):
+        self.host = host
+        self.joined = False
+
+    @abstractmethod
+    def publish(self, rows):
+        """Insert new bucket rows; a row whose status is not "todo" also settles a todo/inprogress row."""
+
+    @abstractmethod
+    def join(self, now):
+        """Register this host and hand back leases left over from an earlier run under the same host ID."""
+
+    @abstractmethod
+    def heartbeat(self, now):
+        """Refresh this host's heartbeat and renew the leases it holds."""
+
+    @abstractmethod
+    def live_hosts(self, now):
+        """Return the hosts that heartbeated within the last COORD_HOST_TIMEOUT seconds."""
+
+    @abstractmethod
+    def claimable_counts(self, indexes, now, earliest, latest):
+        """Return {index_name: claimable buckets} for the given indexes (None for all)."""
+
+    @abstractmethod
+    def remaining_counts(self, indexes, earliest, latest):
+        """Return {index_name: "todo"/"inprogress" buckets, claimable or leased by any host} for the given indexes (None for all)."""
+
+    @abstractmethod
+    def claim(self, index_name, limit, now, earliest, latest):
+        """Atomically lease up to limit claimable buckets of an index, in restore order; returns their names."""
+
+    @abstractmethod
+    def finish(self, index_name, bucket_name, status, nbytes=0, counted=True):
+        """
+        Record the outcome of a claimed bucket: "todo" hands it back, anything else keeps this host as owner.
+
+        Thawed buckets, failures and bytes count towards the host's throughput unless counted is False
+        (the bucket was handed back without an attempt).
+
+        Returns:
+            bool: False if the lease had already been lost to another host.
+        """
+
+    @abstractmethod
+    def decline(self, index_name, bucket_name):
+        """Hand a claimed bucket back for other hosts; this process never claims it again."""
+
+    @abstractmethod
+    def status_counts(self):
+        """Return {status: buckets} over the whole store."""
+
+    @abstractmethod
+    def hosts_report(self):
+        """Return one dict per host with its heartbeat, counters and in-flight leases."""
+
+    def publish_inventory(self, bucket_data):
+        """
+        Publish a bucket structure; local leases count as "todo" since claims live in the store.
+
+        Each bucket's rank is its position in the restore policy order (0 for all without a policy, so
+        claims follow publication order); a bucket keeps the rank it was first published with.
+        """
+        key = make_priority_key()
+        entries = [(index_name, bucket_info) for index_name, buckets in bucket_data.items() for bucket_info in buckets]
+        ranks = [0] * len(entries)
+        if key is not None:
+            for rank, position in enumerate(sorted(range(len(entries)), key=lambda position: key(*entries[position]))):
+                ranks[position] = rank
+        rows = []
+        for (index_name, bucket_info), rank in zip(entries, ranks):
+            earliest, latest = bucket_time_range(bucket_info["bucket"])
+            status = "todo" if bucket_info["status"] == "inprogress" else bucket_info["status"]
+            rows.append((index_name, bucket_info["bucket"], status, rank, earliest, latest))
+        self.publish(rows)
+
+    def preferred_host(self, index_name, hosts):
+        """Rendezvous hashing: the live host with the highest hash for the index owns it."""
+        return max(hosts, key=lambda host: hashlib.sha1(f"{host}|{index_name}".encode()).digest())
+
+    def claim_work(self, limit, indexes=None):
+        """
+        Claim up to limit buckets for this host, from its own indexes first and then by stealing.
+
+        Args:
+            limit (int): Maximum buckets to claim.
+            indexes (set): Indexes this host can restore (None for all).
+
+        Returns:
+            list: (index_name, bucket_name) pairs now leased to this host.
+        """
+        now = time.time()
+        if not self.joined:
+            self.join(now)
+            self.joined = True
+            self.start_heartbeat()
+        self.heartbeat(now)
+        earliest, latest = parse_restore_time(RESTORE_EARLIEST), parse_restore_time(RESTORE_LATEST)
+        hosts = self.live_hosts(now) or [self.host]
+        counts = {index_name: count for index_name, count in self.claimable_counts(indexes, now, earliest, latest).items() if count}
+        index_order = {name: position for position, name in enumerate(filter(None, INDEX_PRIORITY.split(",")))}
+        affine = sorted(
+            (index_name for index_name in counts if self.preferred_host(index_name, hosts) == self.host),
+            key=lambda index_name: (index_order.get(index_name, len(index_order)), index_name),
+        )
+        others = sorted((index_name for index_name in counts if index_name not in affine), key=lambda index_name: -counts[index_name])
+        claimed = []
+        for index_name in affine + others:
+            if len(claimed) >= limit:
+                break
+            names = self.claim(index_name, limit - len(claimed), now, earliest, latest)
+            if names:
+                METRICS.count("coordination_claims", len(names), kind="affinity" if index_name in affine else "stolen")
+            claimed.extend((index_name, name) for name in names)
+        return claimed
+
+    def exhausted(self, indexes=None):
+        """
+        True once no bucket this host could claim is left or in flight on any host.
+
+        Only buckets within the restore window (RESTORE_EARLIEST/RESTORE_LATEST) of the given indexes
+        (None for all) count, as in claim_work, and buckets this host declined do not.
+        """
+        earliest, latest = parse_restore_time(RESTORE_EARLIEST), parse_restore_time(RESTORE_LATEST)
+        return not any(self.remaining_counts(indexes, earliest, latest).values())
+
+    def start_heartbeat(self, interval=COORD_HEARTBEAT):
+        """Heartbeat (renewing this host's leases) every interval seconds in a background thread."""
+        def heartbeat_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.heartbeat(time.time())
+                except Exception as e:
+                    print(f"\033[31mCoordination heartbeat failed: {e}\033[0m")
+
+        thread = threading.Thread(target=heartbeat_loop, name="coordination-heartbeat", daemon=True)
+        thread.start()
+        return thread
+
+    def print_report(self):
+        """Print per-host throughput and publish it as gauges."""
+        now = time.time()
+        print("\033[46mHosts\033[0m:")
+        for row in self.hosts_report():
+            hours = max(row["heartbeat"] - row["started"], 1) / 3600
+            rate = row["thawed"] / hours
+            METRICS.set_gauge("coordination_host_buckets_per_hour", round(rate, 1), host=row["host"])
+            METRICS.set_gauge("coordination_host_bytes_per_hour", round(row["bytes"] / hours), host=row["host"])
+            print(
+                f"  {row['host']}: {'live' if now - row['heartbeat'] < COORD_HOST_TIMEOUT else 'dead'} "
+                f"in_flight={row['in_flight']} thawed={row['thawed']} failed={row['failed']} "
+                f"gb={row['bytes'] / 1073741824:.2f} buckets/hour={rate:.1f}"
+            )
+
+
+class SQLiteCoordinator(Coordinator):
+    """
+    Coordinator backed by one SQLite file that every host opens, e.g. on shared storage.
 
-def generate_bucket_structure(bucket_name, prefix=""):
+    The rollback journal is used instead of WAL, which does not work across hosts; the filesystem must
+    support POSIX locks. Claims run in BEGIN IMMEDIATE transactions so two hosts never lease the same bucket.
     """
-    Generate a JSON structure with indexes and their corresponding buckets from an S3 bucket.
-    Checks local files and a secondary S3 bucket for the receipt.json file.
 
-    Args:
-        bucket_name (str): Name of the S3 bucket.
-        prefix (str): Prefix for filtering objects in the bucket.
+    NOT_DECLINED = "NOT EXISTS (SELECT 1 FROM declined WHERE declined.index_name = buckets.index_name AND declined.bucket = buckets.bucket)"
+
+    def __init__(self, path, host):
+        super().__init__(host)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self.connection.executescript(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "index_name TEXT NOT NULL, bucket TEXT NOT NULL, status TEXT NOT NULL, owner TEXT, "
+                "lease_expires REAL NOT NULL DEFAULT 0, rank REAL NOT NULL, earliest INTEGER NOT NULL, latest INTEGER NOT NULL, "
+                "PRIMARY KEY (index_name, bucket));"
+                "CREATE INDEX IF NOT EXISTS buckets_claim ON buckets (index_name, status, rank);"
+                "CREATE INDEX IF NOT EXISTS buckets_owner ON buckets (owner, status);"
+                "CREATE TABLE IF NOT EXISTS hosts ("
+                "host TEXT PRIMARY KEY, started REAL NOT NULL, heartbeat REAL NOT NULL, "
+                "thawed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0);"
+                # Private to this connection, so declined buckets are only skipped by this process
+                "CREATE TEMP TABLE IF NOT EXISTS declined (index_name TEXT NOT NULL, bucket TEXT NOT NULL, PRIMARY KEY (index_name, bucket));"
+            )
+        return self.connection
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def publish(self, rows):
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO buckets (index_name, bucket, status, rank, earliest, latest) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (index_name, bucket) DO UPDATE SET status = excluded.status, owner = NULL, lease_expires = 0 "
+                "WHERE excluded.status != 'todo' AND (buckets.status IN ('todo', 'inprogress') OR excluded.status IN ('done', 'duplicate'))",
+                rows,
+            )
+
+    def join(self, now):
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE buckets SET status = 'todo', owner = NULL, lease_expires = 0 WHERE owner = ? AND status = 'inprogress'",
+                (self.host,),
+            )
+
+    def heartbeat(self, now):
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO hosts (host, started, heartbeat) VALUES (?, ?, ?) "
+                "ON CONFLICT (host) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.host, now, now),
+            )
+            connection.execute(
+                "UPDATE buckets SET lease_expires = ? WHERE owner = ? AND status = 'inprogress'",
+                (now + COORD_HOST_TIMEOUT, self.host),
+            )
+
+    def live_hosts(self, now):
+        with self.lock:
+            rows = self.connect().execute("SELECT host FROM hosts WHERE heartbeat >= ?", (now - COORD_HOST_TIMEOUT,)).fetchall()
+        return [host for host, in rows]
+
+    def claimable_counts(self, indexes, now, earliest, latest):
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT index_name, count(*) FROM buckets "
+                "WHERE (status = 'todo' OR (status = 'inprogress' AND lease_expires < ?)) AND latest >= ? AND earliest <= ? "
+                f"AND {self.NOT_DECLINED} GROUP BY index_name",
+                (now, earliest or 0, latest if latest is not None else 2 ** 62),
+            ).fetchall()
+        return {index_name: count for index_name, count in rows if indexes is None or index_name in indexes}
+
+    def remaining_counts(self, indexes, earliest, latest):
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT index_name, count(*) FROM buckets "
+                "WHERE status IN ('todo', 'inprogress') AND latest >= ? AND earliest <= ? "
+                f"AND {self.NOT_DECLINED} GROUP BY index_name",
+                (earliest or 0, latest if latest is not None else 2 ** 62),
+            ).fetchall()
+        return {index_name: count for index_name, count in rows if indexes is None or index_name in indexes}
+
+    def claim(self, index_name, limit, now, earliest, latest):
+        with self.transaction() as connection:
+            names = [name for name, in connection.execute(
+                "SELECT bucket FROM buckets WHERE index_name = ? "
+                "AND (status = 'todo' OR (status = 'inprogress' AND lease_expires < ?)) AND latest >= ? AND earliest <= ? "
+                f"AND {self.NOT_DECLINED} ORDER BY rank, rowid LIMIT ?",
+                (index_name, now, earliest or 0, latest if latest is not None else 2 ** 62, limit),
+            )]
+            connection.executemany(
+                "UPDATE buckets SET status = 'inprogress', owner = ?, lease_expires = ? WHERE index_name = ? AND bucket = ?",
+                [(self.host, now + COORD_HOST_TIMEOUT, index_name, name) for name in names],
+            )
+        return names
+
+    def finish(self, index_name, bucket_name, status, nbytes=0, counted=True):
+        with self.transaction() as connection:
+            updated = connection.execute(
+                "UPDATE buckets SET status = ?, owner = ?, lease_expires = 0 WHERE index_name = ? AND bucket = ? AND owner = ?",
+                (status, None if status == "todo" else self.host, index_name, bucket_name, self.host),
+            ).rowcount
+            if counted and updated:
+                connection.execute(
+                    "UPDATE hosts SET thawed = thawed + ?, failed = failed + ?, bytes = bytes + ? WHERE host = ?",
+                    (int(status == "pendingupload"), int(status in ("todo", "integrityfailed")), nbytes, self.host),
+                )
+        return bool(updated)
+
+    def decline(self, index_name, bucket_name):
+        with self.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO declined (index_name, bucket) VALUES (?, ?)", (index_name, bucket_name))
+        self.finish(index_name, bucket_name, "todo", counted=False)
+
+    def status_counts(self):
+        with self.lock:
+            return dict(self.connect().execute("SELECT status, count(*) FROM buckets GROUP BY status").fetchall())
+
+    def hosts_report(self):
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT host, started, heartbeat, thawed, failed, bytes, "
+                "(SELECT count(*) FROM buckets WHERE owner = hosts.host AND status = 'inprogress') FROM hosts ORDER BY host"
+            ).fetchall()
+        keys = ("host", "started", "heartbeat", "thawed", "failed", "bytes", "in_flight")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class MemoryCoordinator(Coordinator):
+    """
+    In-process stand-in for the shared store, for tests and benchmarks.
 
-    Returns:
-        dict: Dictionary with indexes as keys and list of buckets as values.
+    Every instance created with the same state dict (by default one per process) sees the same buckets,
+    so several "hosts" can be simulated from one process.
     """
-    paginator = s3.get_paginator("list_objects_v2")
-    result = {}
 
-    # Paginate through S3 objects for indexes
-    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/"):
-        if "CommonPrefixes" in page:
-            for index in page["CommonPrefixes"]:
-                index_name = index["Prefix"].rstrip("/").split("/")[-1]
-                sub_prefix = index["Prefix"]
-                result[index_name.split("/")[-1]] = []
-                #Get S2 listing here
-                s2_index_files = load_s2_index_structure(index_name)
-                # Paginate through S3 objects for buckets under each index
-                sub_paginator = s3.get_paginator("list_objects_v2")
-                for sub_page in sub_paginator.paginate(Bucket=bucket_name, Prefix=sub_prefix, Delimiter="/"):
-                    for bucket_info in sub_page.get("CommonPrefixes", []):
-                        splunk_bucket_name = bucket_info["Prefix"].split("/")[-2]
-                        bucket_parts = splunk_bucket_name.split("_")
-                        bucket_num = bucket_parts[3]
-                        server_guid = bucket_parts[4]
-
-                        # Determine initial status
-#                        receipt_exists = check_receipt_on_s3(index_name, bucket_num, server_guid)
-                        receipt_exists = check_receipt_in_structure(s2_index_files, index_name, bucket_num, server_guid)
-                        hosts_data_exists = check_local_status(index_name, splunk_bucket_name)
-
-                        if receipt_exists:
-                            if hosts_data_exists:
-                                status = "pendingevict"
-                            else:
-                                status = "done"
-                        else:
-                            if hosts_data_exists:
-                                status = "pendingupload"
-                            else:
-                                status = "todo"
-
-                        result[index_name.split("/")[-1]].append(
-                            {"bucket": splunk_bucket_name, "status": status}
-                        )
+    shared_state = {"buckets": {}, "hosts": {}, "lock": threading.Lock(), "sequence": itertools.count()}
+
+    def __init__(self, host, state=None):
+        super().__init__(host)
+        self.state = state if state is not None else MemoryCoordinator.shared_state
+        self.declined = set()
+
+    def in_window(self, row, earliest, latest):
+        return (earliest is None or row["latest"] >= earliest) and (latest is None or row["earliest"] <= latest)
+
+    def claimable(self, row, now, earliest, latest):
+        return (row["status"] == "todo" or (row["status"] == "inprogress" and row["lease_expires"] < now)) and self.in_window(row, earliest, latest)
+
+    def publish(self, rows):
+        with self.state["lock"]:
+            for index_name, bucket_name, status, rank, earliest, latest in rows:
+                buckets = self.state["buckets"].setdefault(index_name, {})
+                row = buckets.get(bucket_name)
+                if row is None:
+                    buckets[bucket_name] = {
+                        "status": status, "owner": None, "lease_expires": 0, "rank": rank,
+                        "sequence": next(self.state["sequence"]), "earliest": earliest, "latest": latest,
+                    }
+                elif status != "todo" and (row["status"] in ("todo", "inprogress") or status in ("done", "duplicate")):
+                    row.update(status=status, owner=None, lease_expires=0)
+
+    def join(self, now):
+        with self.state["lock"]:
+            for buckets in self.state["buckets"].values():
+                for row in buckets.values():
+                    if row["owner"] == self.host and row["status"] == "inprogress":
+                        row.update(status="todo", owner=None, lease_expires=0)
+
+    def heartbeat(self, now):
+        with self.state["lock"]:
+            host = self.state["hosts"].setdefault(self.host, {"started": now, "thawed": 0, "failed": 0, "bytes": 0})
+            host["heartbeat"] = now
+            for buckets in self.state["buckets"].values():
+                for row in buckets.values():
+                    if row["owner"] == self.host and row["status"] == "inprogress":
+                        row["lease_expires"] = now + COORD_HOST_TIMEOUT
+
+    def live_hosts(self, now):
+        with self.state["lock"]:
+            return [host for host, row in self.state["hosts"].items() if row["heartbeat"] >= now - COORD_HOST_TIMEOUT]
+
+    def claimable_counts(self, indexes, now, earliest, latest):
+        with self.state["lock"]:
+            return {
+                index_name: sum(
+                    1 for name, row in buckets.items()
+                    if self.claimable(row, now, earliest, latest) and (index_name, name) not in self.declined
+                )
+                for index_name, buckets in self.state["buckets"].items()
+                if indexes is None or index_name in indexes
+            }
+
+    def remaining_counts(self, indexes, earliest, latest):
+        with self.state["lock"]:
+            return {
+                index_name: sum(
+                    1 for name, row in buckets.items()
+                    if row["status"] in ("todo", "inprogress") and self.in_window(row, earliest, latest) and (index_name, name) not in self.declined
+                )
+                for index_name, buckets in self.state["buckets"].items()
+                if indexes is None or index_name in indexes
+            }
+
+    def claim(self, index_name, limit, now, earliest, latest):
+        with self.state["lock"]:
+            buckets = self.state["buckets"].get(index_name, {})
+            candidates = sorted(
+                (name for name, row in buckets.items() if self.claimable(row, now, earliest, latest) and (index_name, name) not in self.declined),
+                key=lambda name: (buckets[name]["rank"], buckets[name]["sequence"]),
+            )[:limit]
+            for name in candidates:
+                buckets[name].update(status="inprogress", owner=self.host, lease_expires=now + COORD_HOST_TIMEOUT)
+        return candidates
+
+    def finish(self, index_name, bucket_name, status, nbytes=0, counted=True):
+        with self.state["lock"]:
+            row = self.state["buckets"].get(index_name, {}).get(bucket_name)
+            owned = row is not None and row["owner"] == self.host
+            if owned:
+                row.update(status=status, owner=None if status == "todo" else self.host, lease_expires=0)
+            host = self.state["hosts"].get(self.host)
+            if host is not None and counted and owned:
+                host["thawed"] += status == "pendingupload"
+                host["failed"] += status in ("todo", "integrityfailed")
+                host["bytes"] += nbytes
+        return owned
+
+    def decline(self, index_name, bucket_name):
+        self.declined.add((index_name, bucket_name))
+        self.finish(index_name, bucket_name, "todo", counted=False)
+
+    def status_counts(self):
+        counts = {}
+        with self.state["lock"]:
+            for buckets in self.state["buckets"].values():
+                for row in buckets.values():
+                    counts[row["status"]] = counts.get(row["status"], 0) + 1
+        return counts
+
+    def hosts_report(self):
+        with self.state["lock"]:
+            in_flight = {}
+            for buckets in self.state["buckets"].values():
+                for row in buckets.values():
+                    if row["status"] == "inprogress" and row["owner"]:
+                        in_flight[row["owner"]] = in_flight.get(row["owner"], 0) + 1
+            return [
+                {"host": host, **row, "in_flight": in_flight.get(host, 0)}
+                for host, row in sorted(self.state["hosts"].items())
+            ]
+
+
+def make_coordinator(spec, host=None):
+    """
+    Build the coordinator for a COORDINATION setting.
 
-    # Save result to file
-    with open(BUCKET_JSON, "w") as file:
-        json.dump(result, file, indent=4)
-    print("Bucket structure saved to bucket_structure.json")
+    Args:
+        spec (str): "sqlite:<path>" for a shared SQLite file or "memory" for the in-process stand-in.
+        host (str): Host ID (defaults to COORD_HOST_ID).
 
+    Returns:
+        Coordinator: The coordinator.
+    """
+    host = host or COORD_HOST_ID
+    if spec == "memory":
+        return MemoryCoordinator(host)
+    if spec.startswith("sqlite:"):
+        return SQLiteCoordinator(spec[len("sqlite:"):], host)
+    raise ValueError(f"Unknown COORDINATION backend: {spec}")
 
-def load_bucket_structure(json_file):
-    """Load bucket structure from the JSON file."""
-    with open(json_file, "r") as file:
-        return json.load(file)
 
+COORDINATOR = make_coordinator(COORDINATION) if COORDINATION else None
 
-def save_bucket_structure(json_file, bucket_data):
-    """Save updated bucket structure back to the JSON file."""
-    with open(json_file, "w") as file:
-        json.dump(bucket_data, file, indent=4)
 
-def process_bucket(bucket_info, index_name, bucket_data, bucket_num):
+def process_bucket(bucket_info, index_name, bucket_data, bucket_num, scratch_reserved=None):
     """
     Process a single bucket.
 
+    With SCRATCH_PATH set the bucket is downloaded and rebuilt on scratch and then promoted into
+    LOCAL_BASE_PATH; its scratch reservation is taken here unless the caller already holds one.
+
     Args:
         bucket_info (dict): Information about the bucket to process.
         index_name (str): The index name.
         bucket_data (dict): The entire bucket structure JSON data.
         bucket_num (int): Current bucket processing number.
+        scratch_reserved (int): Scratch bytes the caller already reserved for this bucket.
     """
     bucket_name = bucket_info["bucket"]
+    bucket_dir = os.path.join(LOCAL_BASE_PATH, index_name, "db", bucket_name)
+    work_dir = os.path.join(SCRATCH_PATH, index_name, "db", bucket_name) if SCRATCH_PATH else bucket_dir
 
     # Update status to "inprogress"
     bucket_info["status"] = "inprogress"
@@ -349,16 +3263,52 @@ def process_bucket(bucket_info, index_name, bucket_data, bucket_num):
     # Call process_bucket.sh
     try:
         print(f"\033[92m[{bucket_num}]\033[00m Processing bucket: {bucket_name} for index: {index_name}")
-        subprocess.run([PROCESS_BUCKET_SCRIPT, bucket_name, index_name], check=True)
+        if SCRATCH is not None:
+            # A journal kept from an earlier failed attempt is already reserved and counts towards the estimate
+            held = SCRATCH.take_held(work_dir)
+            if scratch_reserved is None:
+                estimate = estimate_scratch_bytes(index_name, bucket_info)
+                with METRICS.timer("scratch_wait", bucket=bucket_name):
+                    SCRATCH.reserve(max(estimate - held, 0))
+                scratch_reserved = max(estimate, held)
+            else:
+                SCRATCH.release(min(held, scratch_reserved))
+                scratch_reserved = max(scratch_reserved, held)
+        with METRICS.timer("thaw", bucket=bucket_name):
+            with METRICS.timer("download", bucket=bucket_name):
+                download_journal(index_name, bucket_name, work_dir, f"\033[92m[{bucket_num}]\033[00m ")
+            script_env = {**os.environ, "LOCAL_BASE_PATH": LOCAL_BASE_PATH, "BUCKET_DIR": work_dir, "CACHEMANAGER_UPLOAD_JSON": CACHEMANAGER_UPLOAD_JSON}
+            subprocess.run([PROCESS_BUCKET_SCRIPT, bucket_name, index_name], check=True, env=script_env)
+            if work_dir != bucket_dir:
+                with METRICS.timer("promote", bucket=bucket_name):
+                    promote_bucket(work_dir, bucket_dir)
         # Update status to "pendingupload" after successful processing
         bucket_info["status"] = "pendingupload"
         print(f"\033[92m[{bucket_num}]\033[00m \033[94mThawed bucket\033[00m: {bucket_name} for index: {index_name}")
 
-    except subprocess.CalledProcessError as e:
+    except IntegrityError as e:
+        print(f"\033[31mError processing bucket {bucket_name}: {e}\033[0m")
+        # A journal that never matches its checksum is parked instead of being retried on every run
+        bucket_info["status"] = "integrityfailed"
+
+    except (subprocess.CalledProcessError, DownloadError, OSError, s3.exceptions.ClientError) as e:
         print(f"\033[31mError processing bucket {bucket_name}: {e}\033[0m")
         # Update status back to "todo" in case of an error
         bucket_info["status"] = "todo"
 
+    finally:
+        kept = 0
+        if work_dir != bucket_dir and bucket_info["status"] != "pendingupload":
+            # Only the journal download survives a failure, so the next attempt resumes it (see download_journal)
+            kept = trim_failed_scratch(work_dir)
+        if SCRATCH is not None and scratch_reserved is not None:
+            kept = min(kept, scratch_reserved)
+            if kept:
+                SCRATCH.hold(work_dir, kept)
+            SCRATCH.release(scratch_reserved - kept)
+
+    METRICS.count("status_changes", status=bucket_info["status"])
+
     update_cachemanager_file(index_name, bucket_name)
     bucket_info['index_name'] = index_name
     return bucket_info
@@ -366,38 +3316,116 @@ def process_bucket(bucket_info, index_name, bucket_data, bucket_num):
     #save_bucket_structure(BUCKET_JSON, bucket_data)
 
 
+def claim_buckets(lookup, limit, indexes):
+    """
+    Claim buckets from the COORDINATOR and match them to this host's bucket structure.
+
+    A claimed bucket this host's inventory has already settled (e.g. "done") is reported back with its
+    local status, and one missing from the local inventory is declined (handed back for other hosts and
+    never claimed again by this process).
+
+    Args:
+        lookup (dict): (index_name, bucket_name) -> bucket info dict of the local structure.
+        limit (int): Maximum buckets to claim.
+        indexes (set): Indexes this host can restore.
+
+    Returns:
+        list: (index_name, bucket info) pairs leased to this host.
+    """
+    batch = []
+    for index_name, bucket_name in COORDINATOR.claim_work(limit, indexes):
+        bucket_info = lookup.get((index_name, bucket_name))
+        if bucket_info is None:
+            print(f"\033[31mClaimed bucket {bucket_name} is not in the local inventory, leaving it to other hosts\033[0m")
+            COORDINATOR.decline(index_name, bucket_name)
+        elif bucket_info["status"] not in ("todo", "inprogress"):
+            COORDINATOR.finish(index_name, bucket_name, bucket_info["status"], counted=False)
+        else:
+            batch.append((index_name, bucket_info))
+    return batch
+
+
+def finish_claim(result):
+    """Report a thaw result (a process_bucket return value) to the COORDINATOR."""
+    nbytes = get_local_bucket_size(result["index_name"], result["bucket"]) if result["status"] == "pendingupload" else 0
+    if not COORDINATOR.finish(result["index_name"], result["bucket"], result["status"], nbytes):
+        print(f"\033[31mLease on {result['bucket']} had been lost to another host before it finished\033[0m")
+
+
 def process_buckets(index_name, num_buckets):
     """
     Process N buckets from the specified index using concurrent processing.
 
+    With COORDINATION enabled the buckets are claimed from the shared store instead, from every index
+    configured on this host (or only INDEX_NAME if set), so a batch may span several indexes.
+
     Args:
         index_name (str): The index name to process.
         num_buckets (int): The number of buckets to process.
+
+    Returns:
+        list: Bucket info dicts (with "index_name") for the processed buckets, or None if the index
+              has no "todo" buckets left (with COORDINATION: none left to claim on any host).
     """
     # Load the bucket structure
     bucket_data = load_bucket_structure(BUCKET_JSON)
 
-    # Ensure the index exists in the JSON
-    if index_name not in bucket_data:
-        print(f"Index '{index_name}' not found in {BUCKET_JSON}.")
-        return
+    if COORDINATOR is not None:
+        lookup = {(name, bucket_info["bucket"]): bucket_info for name, buckets in bucket_data.items() for bucket_info in buckets}
+        indexes = {os.getenv("INDEX_NAME")} if os.getenv("INDEX_NAME") else get_configured_indexes()
+        batch = claim_buckets(lookup, num_buckets, indexes)
+        if not batch:
+            exhausted = COORDINATOR.exhausted(indexes)
+            print("No buckets left to claim on any host" if exhausted else "No buckets claimable right now, other hosts hold them")
+            return None if exhausted else []
+    else:
+        # determine_index_for_processing found no index with "todo" buckets left
+        if index_name is None:
+            print("No index has buckets left to thaw")
+            return None
+        # Ensure the index exists in the JSON
+        if index_name not in bucket_data:
+            print(f"Index '{index_name}' not found in {BUCKET_JSON}.")
+            return []
+
+        # Filter buckets with status "todo" (within the restore window, in restore order)
+        buckets_to_process = select_restore_buckets(bucket_data, index_name, limit=num_buckets)
+        if not buckets_to_process:
+            print(f"No buckets to process for {index_name}")
+            return None
+        batch = [(index_name, bucket_info) for bucket_info in buckets_to_process]
+    # Lease the batch and persist it first, so a crash leaves the buckets recoverable instead of lost in memory
+    for _, bucket_info in batch:
+        take_lease(bucket_info)
+    save_bucket_structure(BUCKET_JSON, bucket_data)
+
+    # Process up to N buckets concurrently; workers get copies so only this thread touches bucket_data
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(process_bucket, dict(bucket_info), bucket_index, None, idx + 1): bucket_info
+            for idx, (bucket_index, bucket_info) in enumerate(batch)
+        }
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=LEASE_DURATION / 3)
+            if pending:
+                # Long downloads: renew the leases of unfinished buckets
+                for future in pending:
+                    take_lease(futures[future])
+                save_bucket_structure(BUCKET_JSON, bucket_data)
 
-    # Filter buckets with status "todo"
-    buckets_to_process = [bucket for bucket in bucket_data[index_name] if bucket["status"] == "todo"]
-    if not buckets_to_process:
-        print(f"No buckets to process for {index_name}")
-        sys.exit(10)
-    # Process up to N buckets concurrently
     proc_results = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [
-            executor.submit(process_bucket, bucket_info, index_name, bucket_data, idx + 1)
-            for idx, bucket_info in enumerate(buckets_to_process[:num_buckets])
-        ]
-        # Wait for all tasks to complete
-        for future in futures:
-            proc_results.append(future.result())
-    update_multiple_status(BUCKET_JSON, proc_results)
+    for future, bucket_info in futures.items():
+        result = future.result()
+        release_lease(bucket_info)
+        bucket_info["status"] = result["status"]
+        proc_results.append(result)
+        if COORDINATOR is not None:
+            finish_claim(result)
+    save_bucket_structure(BUCKET_JSON, bucket_data)
+    if COORDINATOR is not None:
+        COORDINATOR.print_report()
+    return proc_results
 
 def cacheman_bucket(index_name, bucket_num, server_guid):
     """
@@ -416,7 +3444,7 @@ def cacheman_bucket(index_name, bucket_num, server_guid):
     url = f"{SPLUNK_URL}/services/admin/cacheman/bid|{bid}|"
 
     # Make the POST request
-    response = requests.post(url, auth=AUTH, data={"sid": bid}, verify=False)
+    response = splunk_request("POST", url, "cacheman_init", data={"sid": bid})
 
     if response.status_code == 200:
         print(f"Successfully initialized bucket in cacheman: {bid}")
@@ -443,7 +3471,7 @@ def attach_bucket(index_name, bucket_num, server_guid):
     url = f"{SPLUNK_URL}/services/admin/cacheman/bid|{bid}|/attach"
 
     # Make the POST request
-    response = requests.post(url, auth=AUTH, data={"sid": bid, "directory": ""}, verify=False)
+    response = splunk_request("POST", url, "attach", data={"sid": bid, "directory": ""})
 
     if response.status_code == 200:
         print(f"Successfully attached bucket: {bid}")
@@ -470,7 +3498,7 @@ def close_bucket(index_name, bucket_num, server_guid):
     url = f"{SPLUNK_URL}/services/admin/cacheman/bid|{bid}|/close"
 
     # Make the POST request
-    response = requests.post(url, auth=AUTH, data={"sid": bid}, verify=False)
+    response = splunk_request("POST", url, "close", data={"sid": bid})
 
     if response.status_code == 200:
         print(f"Successfully closed bucket: {bid}")
@@ -480,12 +3508,37 @@ def close_bucket(index_name, bucket_num, server_guid):
         return False
 
 
-def upload_buckets():
+def register_bucket(index_name, bucket_name):
+    """
+    Initializes, attaches and closes a thawed bucket in cacheman so that Splunk uploads it to SmartStore.
+
+    Args:
+        index_name (str): The name of the index.
+        bucket_name (str): The bucket name.
+
+    Returns:
+        bool: True if all three requests were successful, False otherwise.
+    """
+    bucket_parts = bucket_name.split("_")
+    bucket_num = bucket_parts[3]
+    server_guid = bucket_parts[4]
+    with METRICS.timer("register", bucket=bucket_name):
+        registered = (
+            cacheman_bucket(index_name, bucket_num, server_guid)
+            and attach_bucket(index_name, bucket_num, server_guid)
+            and close_bucket(index_name, bucket_num, server_guid)
+        )
+    if registered:
+        METRICS.count("status_changes", status="uploaded")
+    return registered
+
+
+def upload_buckets(skip_bids=()):
     """
     Loops through the bucket_structure.json file and processes all buckets with "pendingupload" status.
 
     Args:
-        BUCKET_JSON (str): Path to the bucket_structure.json file.
+        skip_bids (set): Bucket IDs that Splunk has not picked up yet (still waiting for a restart).
     """
     # Load the JSON file
     with open(BUCKET_JSON, "r") as file:
@@ -497,26 +3550,19 @@ def upload_buckets():
     for index_name, buckets in bucket_data.items():
         for bucket_info in buckets:
             if bucket_info["status"] == "pendingupload":
-                # Extract bucket details
                 bucket_name = bucket_info["bucket"]
-                bucket_parts = bucket_name.split("_")
-                bucket_num = bucket_parts[3]
-                server_guid = bucket_parts[4]
+                if get_bid(index_name, bucket_name) in skip_bids:
+                    continue
 
-                # Initialize bucket in cacheman
-                if cacheman_bucket(index_name, bucket_num, server_guid):
-                    # Attach the bucket
-                    if attach_bucket(index_name, bucket_num, server_guid):
-                        # Close the bucket
-                        if close_bucket(index_name, bucket_num, server_guid):
-                            # Update the status to "uploaded"
-                            bucket_info["status"] = "uploaded"
-                            modified = True
+                # Initialize, attach and close the bucket in cacheman
+                if register_bucket(index_name, bucket_name):
+                    # Update the status to "uploaded"
+                    bucket_info["status"] = "uploaded"
+                    modified = True
 
     # Save updated JSON file if any changes were made
     if modified:
-        with open(BUCKET_JSON, "w") as file:
-            json.dump(bucket_data, file, indent=4)
+        save_bucket_structure(BUCKET_JSON, bucket_data)
         print(f"Updated {BUCKET_JSON} with uploaded statuses.")
     else:
         print("No buckets to upload.")
@@ -535,11 +3581,11 @@ def get_bucket_status(bid):
     url = f"{SPLUNK_URL}/services/admin/cacheman/"
     query = f'|rest /services/admin/cacheman/ | search title="bid|{bid}|" | table title cm:bucket.upload_status cm:bucket.status'
 
-    response = requests.post(
+    response = splunk_request(
+        "POST",
         f"{SPLUNK_URL}/services/search/jobs",
-        auth=AUTH,
+        "cacheman_status",
         data={"search": query, "output_mode": "json", "exec_mode": "oneshot"},
-        verify=False,  # Disable SSL verification for localhost; adjust as needed
     )
     if response.status_code == 200:
         results = response.json()["results"]
@@ -550,6 +3596,33 @@ def get_bucket_status(bid):
     return None, None
 
 
+def get_bucket_statuses(bids):
+    """
+    Queries Splunk REST API for the upload status and bucket status of several buckets in one search.
+
+    Args:
+        bids (list): The bucket identifiers (BIDs).
+
+    Returns:
+        dict: BID -> (upload_status, bucket_status) for every bucket cacheman reported on.
+    """
+    titles = " OR ".join(f'title="bid|{bid}|"' for bid in bids)
+    query = f'|rest /services/admin/cacheman/ | search {titles} | table title cm:bucket.upload_status cm:bucket.status'
+
+    response = splunk_request(
+        "POST",
+        f"{SPLUNK_URL}/services/search/jobs",
+        "cacheman_status",
+        data={"search": query, "output_mode": "json", "exec_mode": "oneshot"},
+    )
+    statuses = {}
+    if response.status_code == 200:
+        for result in response.json()["results"]:
+            # Titles look like "bid|index~bucketNum~serverGUID|"
+            statuses[result["title"][4:-1]] = (result["cm:bucket.upload_status"], result["cm:bucket.status"])
+    return statuses
+
+
 def check_buckets():
     """
     Processes buckets with status "uploaded" in the JSON file.
@@ -573,26 +3646,28 @@ def check_buckets():
                 bid = f"{index_name}~{bucket_num}~{server_guid}"
 
                 # Check upload status
+                wait_start = time.perf_counter()
                 while True:
                     print(f"Checking bid={bid} for path=/opt/splunk/var/lib/splunk/{index_name}/db/{bucket_name}")
                     upload_status, bucket_status = get_bucket_status(bid)
 
                     if upload_status == "idle":  # and bucket_status == "remote":
                         print(f"Bucket upload complete: BID={bid}, upload_status={upload_status}, bucket_status={bucket_status}")
+                        METRICS.observe("upload_wait", time.perf_counter() - wait_start, bucket_name)
                         break
                     else:
                         print(f"Waiting for bucket upload: BID={bid}, upload_status={upload_status}, bucket_status={bucket_status}")
                         time.sleep(5)
 
                 # Check receipt.json in S3
-                if check_receipt_on_s3(index_name, bucket_num, server_guid):
+                if check_receipt_on_s3(index_name, bucket_num, server_guid, fresh=True):
                     bucket_info["status"] = "pendingevict"
+                    METRICS.count("status_changes", status="pendingevict")
                     modified = True
 
     # Save updated JSON file if any changes were made
     if modified:
-        with open(BUCKET_JSON, "w") as file:
-            json.dump(bucket_data, file, indent=4)
+        save_bucket_structure(BUCKET_JSON, bucket_data)
         print(f"Updated {BUCKET_JSON} with pendingevict statuses.")
     else:
         print("No buckets to update.")
@@ -642,12 +3717,7 @@ def evict_bucket(index_name, bucket_num, server_guid):
     url = f"{SPLUNK_URL}/services/admin/cacheman/bid|{bid}|/evict"
 
     # Make the POST request
-    response = requests.post(
-        url,
-        auth=AUTH,
-        data={"output_mode":"json"},
-        verify=False
-    )
+    response = splunk_request("POST", url, "evict", data={"output_mode":"json"})
     if response.status_code == 200:
         print(f"Successfully evicted bucket: {bid}")
         return True
@@ -683,15 +3753,17 @@ def evict_buckets():
                 update_cachemanager_file(index_name, bucket_name)
 
                 # Evict the bucket
-                if evict_bucket(index_name, bucket_num, server_guid):
+                with METRICS.timer("evict", bucket=bucket_name):
+                    evicted = evict_bucket(index_name, bucket_num, server_guid)
+                if evicted:
                     # Update the status to "done"
                     bucket_info["status"] = "done"
+                    METRICS.count("status_changes", status="done")
                     modified = True
 
     # Save updated JSON file if any changes were made
     if modified:
-        with open(BUCKET_JSON, "w") as file:
-            json.dump(bucket_data, file, indent=4)
+        save_bucket_structure(BUCKET_JSON, bucket_data)
         print(f"Updated {BUCKET_JSON} with evicted statuses.")
     else:
         print("No pending buckets to evict.")
@@ -736,6 +3808,20 @@ def determine_index_for_processing(json_file_path):
 
         configured_indexes = get_configured_indexes()
 
+        if RESTORE_EARLIEST or RESTORE_LATEST or restore_policies():
+            # Pick the index holding the bucket that should be restored first
+            time_index = TimeIndex(data) if RESTORE_EARLIEST or RESTORE_LATEST else None
+            queue = RestoreQueue(
+                (
+                    (index_name, bucket_info)
+                    for index_name in data
+                    if index_name in configured_indexes
+                    for bucket_info in restore_candidates(data, index_name, time_index=time_index)
+                ),
+                make_priority_key(),
+            )
+            return queue.peek()[0] if len(queue) else None
+
         # Iterate through the indices and their buckets
         for index_name, buckets in data.items():
             if index_name in configured_indexes:
@@ -749,26 +3835,906 @@ def determine_index_for_processing(json_file_path):
         print(f"Error processing the JSON file: {e}")
         return None
 
-def main():
+def run_workflow(pause=30):
+    """
+    Run one inventory, thaw, restart, upload, check and evict cycle.
+
+    Args:
+        pause (int): Seconds to sleep before the next execution; 0 returns straight away.
+    """
     proc_start_time = time.time()
     print("Starting DDSS Restore Workflow...")
-    generate_bucket_structure(DDSS_BUCKET_NAME, DDSS_PATH_NAME)
+    with METRICS.timer("workflow_inventory"):
+        inventory_stats = generate_bucket_structure(DDSS_BUCKET_NAME, DDSS_PATH_NAME)
     proc_time_so_far = time.time()-proc_start_time
     print(f"Bucket Structure generation took seconds={proc_time_so_far}")
     # Get index name and number of buckets from environment variables or prompt for input
     index_name = os.getenv("INDEX_NAME") or determine_index_for_processing(BUCKET_JSON)
     print(f"Processing buckets for index={index_name}")
     num_buckets = int(os.getenv("NUM_BUCKETS") or input("Enter number of buckets to process: "))
-    process_buckets(index_name, num_buckets)
-    restart_splunk()
-    upload_buckets()
-    check_buckets()
-    evict_buckets()
+    with METRICS.timer("workflow_thaw"):
+        proc_results = process_buckets(index_name, num_buckets)
+    exhausted = proc_results is None
+    proc_results = proc_results or []
+    run_stats = {"restart_count": 0, "restart_seconds": 0.0, **inventory_stats}
+    run_stats["thawed"] = sum(1 for bucket_info in proc_results if bucket_info["status"] == "pendingupload")
+    restart_state = load_restart_state()
+    record_thawed_buckets(restart_state, proc_results)
+    # Nothing left to thaw means no more buckets will arrive to fill the batch, so flush what is waiting
+    with METRICS.timer("workflow_restart"):
+        schedule_restart(restart_state, run_stats, force=exhausted)
+    with METRICS.timer("workflow_upload"):
+        upload_buckets(skip_bids=set(restart_state["pending"]))
+    with METRICS.timer("workflow_check"):
+        check_buckets()
+    with METRICS.timer("workflow_evict"):
+        evict_buckets()
     print("Workflow complete.")
+    print_run_summary(restart_state, run_stats)
+    METRICS.export_prometheus()
+    METRICS.export_json(extra={"run_stats": run_stats, "restart_state": {key: value for key, value in restart_state.items() if key != "pending"}})
+    METRICS.append_history(run_stats["thawed"])
     proc_time_so_far = time.time()-proc_start_time
     print(f"Processing took seconds={proc_time_so_far}")
-    print("\033[46mSleeping 30 seconds before next execution\033[0m")
-    time.sleep(30)
+    if exhausted:
+        sys.exit(10)
+    if pause:
+        print(f"\033[46mSleeping {pause} seconds before next execution\033[0m")
+        time.sleep(pause)
+
+
+def run_thaw(index_name=None, num_buckets=None):
+    """
+    Thaw one batch from the saved inventory (no rescan) and queue the thawed buckets for the next restart.
+
+    Args:
+        index_name (str): Index to thaw (default: INDEX_NAME, or the first index with work left).
+        num_buckets (int): Buckets to thaw (default: NUM_BUCKETS, or prompt).
+
+    Returns:
+        bool: False once nothing is left to thaw.
+    """
+    index_name = index_name or os.getenv("INDEX_NAME") or determine_index_for_processing(BUCKET_JSON)
+    if index_name is None and COORDINATOR is None:
+        print("No index has buckets left to thaw")
+        return False
+    num_buckets = num_buckets or int(os.getenv("NUM_BUCKETS") or input("Enter number of buckets to process: "))
+    with METRICS.timer("workflow_thaw"):
+        proc_results = process_buckets(index_name, num_buckets)
+    restart_state = load_restart_state()
+    record_thawed_buckets(restart_state, proc_results or [])
+    save_restart_state(restart_state)
+    thawed = sum(1 for bucket_info in proc_results or [] if bucket_info["status"] == "pendingupload")
+    print(f"Thawed {thawed} bucket(s), {len(restart_state['pending'])} waiting for a restart")
+    METRICS.append_history(thawed)
+    return proc_results is not None
+
+
+def run_register(restart="policy"):
+    """
+    Register thawed buckets with cacheman, restarting Splunk first for those waiting for one.
+
+    Args:
+        restart (str): "policy" restarts when RESTART_MODE says so, "now" whenever buckets are waiting,
+            "never" only registers the buckets Splunk already sees.
+    """
+    restart_state = load_restart_state()
+    run_stats = {"restart_count": 0, "restart_seconds": 0.0}
+    if restart != "never":
+        with METRICS.timer("workflow_restart"):
+            schedule_restart(restart_state, run_stats, force=restart == "now")
+    with METRICS.timer("workflow_upload"):
+        upload_buckets(skip_bids=set(restart_state["pending"]))
+
+
+# Daemon Mode
+class RestoreDaemon:
+    """
+    Long-running restore loop that keeps the bucket structure and clients in memory.
+
+    Each bucket moves through thaw -> restart -> register -> check -> evict on its own: thaw workers are
+    refilled as soon as one finishes, restarts follow the coalescing policy while rebuilds keep running,
+    and registration, upload checks and eviction run every tick for whichever buckets are ready.
+
+    Signals:
+        SIGTERM/SIGINT: stop admitting buckets, wait for in-flight rebuilds, save state and exit.
+        SIGHUP: re-read the control file and re-run the inventory.
+        SIGUSR1: print a status line.
+
+    The control file (DAEMON_CONTROL_FILE) is re-read whenever it changes and may set "paused",
+    "max_workers", "index_name" and "drain" (finish in-flight work, then exit). max_workers is clamped to
+    1..the S3 connection pool size, and the thaw pool is resized to it.
+    """
+
+    def __init__(self):
+        self.bucket_data = {}
+        self.lookup = {}
+        self.by_status = {}
+        self.todo = RestoreQueue()
+        self.in_flight = {}
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="thaw")
+        self.restart_state = load_restart_state()
+        self.stats = {"restart_count": 0, "restart_seconds": 0.0, "thawed": 0, "failed": 0, "uploaded": 0, "evicted": 0}
+        self.max_workers = MAX_WORKERS
+        self.configured_indexes = set()
+        self.index_name = os.getenv("INDEX_NAME")
+        self.paused = False
+        self.draining = False
+        self.stop_requested = False
+        self.reload_requested = False
+        self.status_requested = False
+        self.wakeup = threading.Event()
+        self.control_mtime = None
+        self.dirty = False
+        self.last_save = time.time()
+        self.last_history = time.time()
+        self.bucket_counter = 0
+
+    def install_signal_handlers(self):
+        def request_stop(signum, frame):
+            print(f"\033[46mReceived signal {signum}, finishing in-flight buckets before exiting\033[0m")
+            self.stop_requested = True
+            self.wakeup.set()
+
+        def request_reload(signum, frame):
+            self.reload_requested = True
+            self.wakeup.set()
+
+        def request_status(signum, frame):
+            self.status_requested = True
+            self.wakeup.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+        signal.signal(signal.SIGUSR1, request_status)
+
+    def load_state(self, inventory=True):
+        """Run the inventory (if requested) and rebuild the in-memory bucket lookup and todo queue."""
+        previous = self.lookup
+        if inventory:
+            self.stats.update(generate_bucket_structure(DDSS_BUCKET_NAME, DDSS_PATH_NAME))
+        self.bucket_data = load_bucket_structure(BUCKET_JSON)
+        self.lookup = {}
+        self.by_status = {}
+        for index_name, buckets in self.bucket_data.items():
+            for bucket_info in buckets:
+                key = (index_name, bucket_info["bucket"])
+                old_info = previous.get(key)
+                # The inventory cannot see in-flight or registered-but-unconfirmed buckets, keep what we know
+                if old_info and old_info["status"] in ("inprogress", "uploaded") and bucket_info["status"] not in ("done", "pendingevict"):
+                    bucket_info["status"] = old_info["status"]
+                self.lookup[key] = bucket_info
+                self.by_status.setdefault(bucket_info["status"], set()).add(key)
+        self.rebuild_queue()
+
+    def set_status(self, key, status):
+        """Change a bucket's status, keeping the per-status sets used by the stages in step."""
+        bucket_info = self.lookup.get(key)
+        if bucket_info is None:
+            return
+        self.by_status.get(bucket_info["status"], set()).discard(key)
+        bucket_info["status"] = status
+        self.by_status.setdefault(status, set()).add(key)
+        self.dirty = True
+
+    def keys_with_status(self, status):
+        return sorted(self.by_status.get(status, ()))
+
+    def rebuild_queue(self):
+        """Queue every "todo" bucket of the configured (or selected) indexes for thawing."""
+        configured_indexes = get_configured_indexes() if not self.index_name else {self.index_name}
+        time_index = TimeIndex(self.bucket_data) if RESTORE_EARLIEST or RESTORE_LATEST else None
+        queued = [
+            (index_name, bucket_info)
+            for index_name in self.bucket_data
+            if index_name in configured_indexes
+            for bucket_info in restore_candidates(self.bucket_data, index_name, time_index=time_index)
+        ]
+        self.configured_indexes = configured_indexes
+        if COORDINATOR is not None:
+            # Work is claimed from the shared store on every tick instead
+            self.todo = RestoreQueue()
+            print(f"Claiming buckets from {COORDINATION} as {COORDINATOR.host} ({len(queued)} todo in the local inventory)")
+            return
+        self.todo = RestoreQueue(queued, make_priority_key())
+        policies = restore_policies()
+        print(f"Queued {len(self.todo)} bucket(s) for thawing" + (f" by {','.join(policies)}" if policies else ""))
+
+    def apply_control(self):
+        """Re-read the control file if it changed since the last tick."""
+        try:
+            mtime = os.path.getmtime(DAEMON_CONTROL_FILE)
+        except OSError:
+            return
+        if mtime == self.control_mtime:
+            return
+        self.control_mtime = mtime
+        try:
+            with open(DAEMON_CONTROL_FILE, "r") as file:
+                control = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"\033[31mIgnoring unreadable control file {DAEMON_CONTROL_FILE}: {e}\033[0m")
+            return
+        self.paused = bool(control.get("paused", False))
+        self.draining = bool(control.get("drain", False))
+        self.set_max_workers(control.get("max_workers") or MAX_WORKERS)
+        download_rate = control.get("download_rate")
+        GOVERNOR.set_override(None if download_rate is None else parse_rate(download_rate))
+        index_name = control.get("index_name") or os.getenv("INDEX_NAME")
+        if index_name != self.index_name:
+            self.index_name = index_name
+            self.rebuild_queue()
+        print(
+            f"Applied control file: paused={self.paused} drain={self.draining} max_workers={self.max_workers} "
+            f"index={self.index_name} download_rate={GOVERNOR.rate() or 'unlimited'}"
+        )
+
+    def set_max_workers(self, requested):
+        """
+        Apply a max_workers value from the control file and resize the thaw pool to it.
+
+        Values outside 1..the S3 connection pool size are clamped (every thaw downloads over one pooled
+        connection), with a message saying so. Thaws already running finish on the threads of the old pool,
+        which exit afterwards; admission counts them against the new value.
+        """
+        try:
+            max_workers = int(requested)
+        except (TypeError, ValueError):
+            print(f"\033[31mIgnoring max_workers={requested!r} in {DAEMON_CONTROL_FILE}, keeping {self.max_workers}\033[0m")
+            return
+        clamped = min(max(max_workers, 1), s3.pool_size)
+        if clamped != max_workers:
+            print(
+                f"\033[31mClamped max_workers={max_workers} to {clamped} "
+                f"(allowed 1..{s3.pool_size}, the S3 connection pool size; raise S3_MAX_POOL_CONNECTIONS for more)\033[0m"
+            )
+        if clamped == self.max_workers:
+            return
+        previous = self.executor
+        self.executor = ThreadPoolExecutor(max_workers=clamped, thread_name_prefix="thaw")
+        previous.shutdown(wait=False)
+        self.max_workers = clamped
+
+    def admit(self):
+        """Start thawing queued buckets until max_workers are busy (or scratch space is reserved)."""
+        if COORDINATOR is not None:
+            self.admit_claimed()
+            return
+        while self.todo and len(self.in_flight) < self.max_workers:
+            index_name, bucket_info = self.todo.peek()
+            if bucket_info["status"] != "todo":
+                self.todo.pop()
+                continue
+            scratch_reserved = None
+            if SCRATCH is not None:
+                scratch_reserved = estimate_scratch_bytes(index_name, bucket_info)
+                if not SCRATCH.try_reserve(scratch_reserved):
+                    # Scratch is full; retry once a running bucket has been promoted
+                    break
+            self.todo.pop()
+            self.start_thaw(index_name, bucket_info, scratch_reserved)
+
+    def admit_claimed(self):
+        """Claim buckets from the coordination store one at a time until max_workers are busy."""
+        while len(self.in_flight) < self.max_workers:
+            claimed = claim_buckets(self.lookup, 1, self.configured_indexes)
+            if not claimed:
+                break
+            index_name, bucket_info = claimed[0]
+            scratch_reserved = None
+            if SCRATCH is not None:
+                scratch_reserved = estimate_scratch_bytes(index_name, bucket_info)
+                if not SCRATCH.try_reserve(scratch_reserved):
+                    COORDINATOR.finish(index_name, bucket_info["bucket"], "todo", counted=False)
+                    break
+            self.start_thaw(index_name, bucket_info, scratch_reserved)
+
+    def start_thaw(self, index_name, bucket_info, scratch_reserved):
+        """Lease a bucket and submit its thaw to the worker pool."""
+        key = (index_name, bucket_info["bucket"])
+        self.set_status(key, "inprogress")
+        take_lease(bucket_info)
+        self.bucket_counter += 1
+        # Workers get a copy so the shared structure is only ever touched by the daemon thread
+        future = self.executor.submit(
+            process_bucket, dict(bucket_info), index_name, None, self.bucket_counter, scratch_reserved
+        )
+        future.add_done_callback(lambda _: self.wakeup.set())
+        self.in_flight[future] = key
+
+    def collect(self):
+        """Apply the result of every finished thaw."""
+        finished = [future for future in self.in_flight if future.done()]
+        thawed = []
+        for future in finished:
+            index_name, bucket_name = self.in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"\033[31mError processing bucket {bucket_name}: {e}\033[0m")
+                result = {"status": "todo", "bucket": bucket_name, "index_name": index_name}
+            self.set_status((index_name, bucket_name), result["status"])
+            release_lease(self.lookup.get((index_name, bucket_name), {}))
+            if COORDINATOR is not None:
+                finish_claim(result)
+            if result["status"] == "pendingupload":
+                thawed.append(result)
+                self.stats["thawed"] += 1
+            else:
+                self.stats["failed"] += 1
+        if thawed:
+            record_thawed_buckets(self.restart_state, thawed)
+            save_restart_state(self.restart_state)
+
+    def restart_stage(self):
+        """Restart Splunk when the coalescing policy says so; rebuilds keep running meanwhile."""
+        idle = not self.todo and not self.in_flight
+        force = idle or self.stop_requested or self.draining
+        schedule_restart(self.restart_state, self.stats, force=force, report_deferral=False)
+
+    def register_stage(self):
+        """Register every thawed bucket that Splunk has picked up."""
+        waiting = self.restart_state["pending"]
+        for index_name, bucket_name in self.keys_with_status("pendingupload"):
+            if get_bid(index_name, bucket_name) in waiting:
+                continue
+            if register_bucket(index_name, bucket_name):
+                self.set_status((index_name, bucket_name), "uploaded")
+                self.stats["uploaded"] += 1
+
+    def check_stage(self):
+        """Poll cacheman for uploaded buckets without blocking on any single one."""
+        uploaded = self.keys_with_status("uploaded")
+        for start in range(0, len(uploaded), DAEMON_CHECK_BATCH):
+            batch = {get_bid(index_name, bucket_name): (index_name, bucket_name) for index_name, bucket_name in uploaded[start:start + DAEMON_CHECK_BATCH]}
+            statuses = get_bucket_statuses(list(batch))
+            for bid, (index_name, bucket_name) in batch.items():
+                upload_status, _ = statuses.get(bid, (None, None))
+                if upload_status != "idle":
+                    continue
+                bucket_parts = bucket_name.split("_")
+                if check_receipt_on_s3(index_name, bucket_parts[3], bucket_parts[4], fresh=True):
+                    self.set_status((index_name, bucket_name), "pendingevict")
+                    METRICS.count("status_changes", status="pendingevict")
+
+    def evict_stage(self):
+        """Evict every bucket whose upload has been confirmed."""
+        for index_name, bucket_name in self.keys_with_status("pendingevict"):
+            update_cachemanager_file(index_name, bucket_name)
+            bucket_parts = bucket_name.split("_")
+            with METRICS.timer("evict", bucket=bucket_name):
+                evicted = evict_bucket(index_name, bucket_parts[3], bucket_parts[4])
+            if evicted:
+                self.set_status((index_name, bucket_name), "done")
+                METRICS.count("status_changes", status="done")
+                self.stats["evicted"] += 1
+
+    def save(self, force=False):
+        """Persist the in-memory bucket structure if it changed and the save interval has passed."""
+        # Leases of buckets still being thawed are renewed well before they expire
+        now = time.time()
+        for key in self.in_flight.values():
+            if self.lookup[key].get("lease_expires", 0) - now < LEASE_DURATION / 2:
+                take_lease(self.lookup[key])
+                self.dirty = True
+        if not self.dirty or (not force and now - self.last_save < DAEMON_SAVE_INTERVAL):
+            return
+        save_bucket_structure(BUCKET_JSON, self.bucket_data)
+        self.dirty = False
+        self.last_save = time.time()
+        self.export_metrics()
+
+    def export_metrics(self):
+        counts = {}
+        for status, keys in self.by_status.items():
+            for index_name, _ in keys:
+                counts[(index_name, status)] = counts.get((index_name, status), 0) + 1
+        METRICS.set_status_gauges(counts)
+        METRICS.set_gauge("in_flight", len(self.in_flight))
+        METRICS.export_prometheus()
+        METRICS.export_json(extra={"run_stats": self.stats, "restart_state": {key: value for key, value in self.restart_state.items() if key != "pending"}})
+        if time.time() - self.last_history >= METRICS_HISTORY_INTERVAL:
+            METRICS.append_history(self.stats["thawed"])
+            self.last_history = time.time()
+
+    def print_status(self):
+        print(
+            f"\033[46mDaemon status\033[0m: queued={len(self.todo)} in_flight={len(self.in_flight)} "
+            f"waiting_restart={len(self.restart_state['pending'])} paused={self.paused} "
+            f"download_mb_s={GOVERNOR.throughput() / 1048576:.1f} "
+            + " ".join(f"{key}={value if isinstance(value, int) else round(value, 1)}" for key, value in self.stats.items())
+        )
+        if COORDINATOR is not None:
+            COORDINATOR.print_report()
+
+    def run_stages(self):
+        self.collect()
+        self.restart_stage()
+        self.register_stage()
+        self.check_stage()
+        self.evict_stage()
+
+    def run(self):
+        print("Starting DDSS Restore Daemon...")
+        self.install_signal_handlers()
+        self.apply_control()
+        self.load_state()
+        if RECEIPT_CACHE is not None:
+            RECEIPT_CACHE.start_refresher()
+        while True:
+            self.wakeup.clear()
+            self.apply_control()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.control_mtime = None
+                self.apply_control()
+                self.save(force=True)
+                self.load_state()
+            if self.status_requested:
+                self.status_requested = False
+                self.print_status()
+            if self.stop_requested or self.draining:
+                if not self.in_flight:
+                    break
+            elif not self.paused:
+                self.admit()
+            try:
+                self.run_stages()
+            except Exception as e:
+                # A failed REST or S3 call should not take the daemon down; retry on the next tick
+                print(f"\033[31mError in daemon stage: {e}\033[0m")
+            self.save()
+            self.wakeup.wait(DAEMON_TICK)
+
+        self.run_stages()
+        self.save(force=True)
+        METRICS.append_history(self.stats["thawed"])
+        self.executor.shutdown()
+        print_run_summary(self.restart_state, self.stats)
+        print("Daemon stopped.")
+
+
+# Planning
+PLAN_S2_OBJECTS_PER_BUCKET = 12  # Objects SmartStore keeps per uploaded bucket (receipt, tsidx, bloomfilter, ...), for listing estimates
+LIST_PAGE_SIZE = 1000
+
+
+def load_metrics_history(path=METRICS_HISTORY, runs=PLAN_HISTORY_RUNS):
+    """
+    Read the most recent runs from the metrics history.
+
+    Returns:
+        list: The last line of each of the most recent runs, oldest first.
+    """
+    records = {}
+    if path and os.path.exists(path):
+        with open(path, "r") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["started"]] = record
+    return sorted(records.values(), key=lambda record: record["started"])[-runs:]
+
+
+def measured_throughput(history):
+    """
+    Derive restore throughput from history records of runs that thawed something.
+
+    Returns:
+        dict: Runs used, buckets and bytes per second, mean journal bytes per bucket, worker count and
+              mean seconds per observation of each stage; None if there is no usable history.
+    """
+    runs = [record for record in history if record.get("thawed")]
+    elapsed = sum(record["elapsed"] for record in runs)
+    if not runs or not elapsed:
+        return None
+    thawed = sum(record["thawed"] for record in runs)
+    downloaded = sum(record.get("download_bytes", 0) for record in runs)
+    stages = {}
+    for record in runs:
+        for stage, summary in record.get("stages", {}).items():
+            total = stages.setdefault(stage, [0, 0.0])
+            total[0] += summary["count"]
+            total[1] += summary["sum"]
+    return {
+        "runs": len(runs),
+        "buckets_per_second": thawed / elapsed,
+        "bytes_per_second": downloaded / elapsed if downloaded else None,
+        "bytes_per_bucket": downloaded / thawed if downloaded else None,
+        "workers": runs[-1].get("workers"),
+        "stage_seconds": {stage: total / count for stage, (count, total) in stages.items() if count},
+    }
+
+
+def estimate_requests(total, todo, present, inventories):
+    """
+    Estimate the S3 requests the rest of the restore of one index will make.
+
+    Every inventory lists the index's DDSS buckets and looks up the receipts it does not know yet: at
+    most the "todo" buckets with the receipt cache (HEADs, or a listing of the index's SmartStore
+    objects above RECEIPT_LIST_MIN), the whole index without it. Every thawed bucket costs one journal
+    GET and one receipt HEAD when its upload is checked, plus a journal HEAD to size its scratch space.
+
+    Args:
+        total (int): Buckets of the index.
+        todo (int): Buckets still to restore.
+        present (int): Buckets whose receipt already exists.
+        inventories (int): Inventories still to run.
+
+    Returns:
+        dict: {"LIST": n, "HEAD": n, "GET": n}.
+    """
+    requests_per_inventory = {"LIST": 1 + math.ceil(total / LIST_PAGE_SIZE), "HEAD": 0}
+    if not RECEIPT_CACHE_DB or todo >= RECEIPT_LIST_MIN:
+        s2_objects = max(present, 1) * PLAN_S2_OBJECTS_PER_BUCKET
+        requests_per_inventory["LIST"] += math.ceil(s2_objects / LIST_PAGE_SIZE)
+    else:
+        requests_per_inventory["HEAD"] += todo
+    return {
+        "LIST": requests_per_inventory["LIST"] * inventories,
+        "HEAD": requests_per_inventory["HEAD"] * inventories + todo * (2 if SCRATCH_PATH else 1),
+        "GET": todo,
+    }
+
+
+def plan_restore(json_file=BUCKET_JSON, output=None):
+    """
+    Print a dry-run plan of the remaining restore, from bucket_structure.json and the metrics history only.
+
+    Per index: bucket counts by status, journal bytes still to download (known sizes, otherwise the
+    index's mean known size or the measured bytes per bucket), estimated S3 requests and cost, and the
+    projected wall time at the throughput measured by previous runs (capped by DOWNLOAD_RATE if set).
+    Nothing is read from S3 or Splunk. The structure is streamed an index at a time and only per-index
+    totals are kept, so planning a large restore does not load its whole state.
+
+    Args:
+        json_file (str): The bucket structure to plan from.
+        output (str): Also write the plan as JSON to this file.
+
+    Returns:
+        dict: The plan.
+    """
+    throughput = measured_throughput(load_metrics_history())
+    earliest, latest = parse_restore_time(RESTORE_EARLIEST), parse_restore_time(RESTORE_LATEST)
+    num_buckets = int(os.getenv("NUM_BUCKETS") or 0)
+    download_rate = parse_rate(DOWNLOAD_RATE)
+
+    indexes = {}
+    for index_name, buckets in iter_bucket_structure(json_file):
+        counts = {}
+        todo_known_bytes = todo_known = 0
+        sized = sized_bytes = 0
+        for bucket_info in buckets:
+            status = bucket_info["status"]
+            size = bucket_info.get("size")
+            if size is not None:
+                sized += 1
+                sized_bytes += size
+            if status == "todo" and (earliest is not None or latest is not None):
+                bucket_earliest, bucket_latest = bucket_time_range(bucket_info["bucket"])
+                if (earliest is not None and bucket_latest < earliest) or (latest is not None and bucket_earliest > latest):
+                    status = "outside_window"
+            counts[status] = counts.get(status, 0) + 1
+            if status == "todo" and size is not None:
+                todo_known += 1
+                todo_known_bytes += size
+        todo = counts.get("todo", 0) + counts.get("inprogress", 0)
+        bytes_per_bucket = (sized_bytes / sized) if sized else (throughput or {}).get("bytes_per_bucket")
+        if todo == todo_known:
+            todo_bytes = todo_known_bytes
+        else:
+            todo_bytes = todo_known_bytes + (todo - todo_known) * bytes_per_bucket if bytes_per_bucket else None
+        present = counts.get("done", 0) + counts.get("pendingevict", 0)
+        indexes[index_name] = {
+            "buckets": len(buckets),
+            "statuses": counts,
+            "todo": todo,
+            "todo_bytes": round(todo_bytes) if todo_bytes is not None else None,
+            "bytes_estimated": todo > todo_known,
+            "present": present,
+        }
+
+    # The one-shot workflow inventories every index once per NUM_BUCKETS batch; the daemon once
+    inventories = sum(math.ceil(info["todo"] / num_buckets) for info in indexes.values()) if num_buckets else 1
+    totals = {"todo": 0, "todo_bytes": 0, "LIST": 0, "HEAD": 0, "GET": 0, "hours": 0.0}
+    for index_name, info in indexes.items():
+        info["requests"] = estimate_requests(info["buckets"], info["todo"], info["present"], max(inventories, 1))
+        seconds = 0 if not info["todo"] else None
+        if throughput and info["todo_bytes"] and throughput["bytes_per_second"]:
+            seconds = info["todo_bytes"] / throughput["bytes_per_second"]
+        elif throughput:
+            seconds = info["todo"] / throughput["buckets_per_second"]
+        if download_rate and info["todo_bytes"]:
+            seconds = max(seconds or 0, info["todo_bytes"] / download_rate)
+        info["hours"] = round(seconds / 3600, 2) if seconds is not None else None
+        totals["todo"] += info["todo"]
+        # A total is only known if every index's part of it is
+        for key in ("todo_bytes", "hours"):
+            totals[key] = totals[key] + info[key] if totals[key] is not None and info[key] is not None else None
+        for op, value in info["requests"].items():
+            totals[op] += value
+    totals["cost_usd"] = round(
+        totals["LIST"] / 1000 * S3_LIST_PRICE + (totals["HEAD"] + totals["GET"]) / 1000 * S3_GET_PRICE
+        + totals["todo_bytes"] / 1073741824 * S3_TRANSFER_PRICE, 2
+    ) if totals["todo_bytes"] is not None else None
+    plan = {"indexes": indexes, "totals": totals, "throughput": throughput, "inventories": inventories}
+
+    print(f"\033[46mRestore plan\033[0m from {json_file} ({sum(info['buckets'] for info in indexes.values())} buckets):")
+    for index_name, info in sorted(indexes.items()):
+        statuses = " ".join(f"{status}={count}" for status, count in sorted(info["statuses"].items()))
+        gigabytes = f"{'~' if info['bytes_estimated'] else ''}{info['todo_bytes'] / 1073741824:.2f}" if info["todo_bytes"] is not None else "unknown"
+        print(
+            f"  {index_name}: {statuses} | todo_gb={gigabytes} "
+            + " ".join(f"{op}={value}" for op, value in info["requests"].items())
+            + f" | hours={info['hours'] if info['hours'] is not None else 'unknown'}"
+        )
+    total_gb = f"{totals['todo_bytes'] / 1073741824:.2f}" if totals["todo_bytes"] is not None else "unknown"
+    total_hours = round(totals["hours"], 2) if totals["hours"] is not None else "unknown"
+    total_cost = totals["cost_usd"] if totals["cost_usd"] is not None else "unknown"
+    print(
+        f"Total: todo={totals['todo']} todo_gb={total_gb} LIST={totals['LIST']} "
+        f"HEAD={totals['HEAD']} GET={totals['GET']} cost_usd={total_cost} hours={total_hours} "
+        f"(inventories={inventories})"
+    )
+    if throughput:
+        stages = " ".join(
+            f"{stage}={seconds:.1f}s" for stage, seconds in sorted(throughput["stage_seconds"].items())
+            if stage in ("download", "thaw", "promote", "register", "evict", "restart")
+        )
+        print(
+            f"Measured over {throughput['runs']} run(s) with {throughput['workers']} workers: "
+            f"{throughput['buckets_per_second'] * 3600:.1f} buckets/hour"
+            + (f", {throughput['bytes_per_second'] / 1048576:.1f} MB/s" if throughput["bytes_per_second"] else "")
+            + (f" | per bucket: {stages}" if stages else "")
+        )
+    else:
+        print(f"No throughput history in {METRICS_HISTORY or '(METRICS_HISTORY disabled)'} yet, wall time cannot be projected")
+    if output:
+        with open(output, "w") as file:
+            json.dump(plan, file, indent=4)
+        print(f"Plan saved to {output}")
+    return plan
+
+
+# Profiling
+PROFILABLE_STAGES = ("generate_bucket_structure", "process_buckets", "upload_buckets", "check_buckets", "evict_buckets")
+PROFILE_RESULTS = []
+
+
+def profiled(stage, func, mode, run_id):
+    """
+    Wrap a stage function so every call runs under cProfile and/or tracemalloc.
+
+    Each call writes its own files to PROFILE_DIR (<run_id>-<stage>-<call>.prof for cProfile, .tracemalloc
+    snapshot plus a .mem.txt listing for tracemalloc) and keeps a short top-N summary for the end of the run.
+    cProfile only sees the calling thread, so work done in pool threads shows up as time spent waiting.
+
+    Args:
+        stage (str): Stage function name, used in file names.
+        func (callable): The stage function.
+        mode (str): "cpu", "memory" or "both".
+        run_id (str): Identifier shared by all profiles of this run.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+
+    calls = [0]
+
+    def wrapper(*args, **kwargs):
+        calls[0] += 1
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{run_id}-{stage}-{calls[0]}")
+        result = {"stage": stage, "call": calls[0], "files": []}
+        profiler = cProfile.Profile() if mode in ("cpu", "both") else None
+        started_tracing = False
+        if mode in ("memory", "both"):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                started_tracing = True
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler:
+                profiler.disable()
+            result["seconds"] = time.perf_counter() - start
+
+            # Snapshot memory before pstats allocates anything of its own
+            if mode in ("memory", "both"):
+                current, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+                snapshot.dump(f"{base}.tracemalloc")
+                top_stats = snapshot.statistics("lineno")
+                lines = [f"current={current / 1e6:.1f}MB peak={peak / 1e6:.1f}MB"]
+                lines += [str(stat) for stat in top_stats[:PROFILE_TOP]]
+                with open(f"{base}.mem.txt", "w") as file:
+                    file.write("\n".join(lines + [str(stat) for stat in top_stats[PROFILE_TOP:PROFILE_TOP * 10]]) + "\n")
+                result["files"] += [f"{base}.tracemalloc", f"{base}.mem.txt"]
+                result["memory"] = "\n".join(lines)
+
+            if profiler:
+                profiler.dump_stats(f"{base}.prof")
+                result["files"].append(f"{base}.prof")
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP)
+                result["cpu"] = stream.getvalue()
+
+            PROFILE_RESULTS.append(result)
+
+    return wrapper
+
+
+def enable_profiling(stages, mode):
+    """
+    Replace the selected stage functions with profiled wrappers.
+
+    Args:
+        stages (list): Stage function names (see PROFILABLE_STAGES).
+        mode (str): "cpu", "memory" or "both".
+    """
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    for stage in stages:
+        if stage not in PROFILABLE_STAGES:
+            raise ValueError(f"Unknown stage to profile: {stage} (choose from {', '.join(PROFILABLE_STAGES)})")
+        globals()[stage] = profiled(stage, globals()[stage], mode, run_id)
+    print(f"Profiling {', '.join(stages)} ({mode}) into {PROFILE_DIR}/{run_id}-*")
+
+
+def print_profile_summary():
+    """Print the top-N summary of every profiled stage call of this run."""
+    for result in PROFILE_RESULTS:
+        print(f"\033[46mProfile {result['stage']} #{result['call']}\033[0m: {result['seconds']:.2f}s -> {', '.join(result['files'])}")
+        if "memory" in result:
+            print(result["memory"])
+        if "cpu" in result:
+            # Skip the pstats preamble and keep the table of the top functions
+            print(result["cpu"].split("\n\n", 2)[-1].strip())
+
+
+COMMANDS = {
+    "run": "Run the full workflow once: inventory, thaw, restart, register, check, evict (the default)",
+    "daemon": "Run continuously, moving each bucket through the stages independently",
+    "inventory": "Scan S3 and rebuild bucket_structure.json",
+    "thaw": "Download and rebuild a batch of buckets from the saved inventory",
+    "register": "Restart Splunk for thawed buckets per the restart policy and register them with cacheman",
+    "check": "Check uploads and mark confirmed buckets for eviction",
+    "evict": "Evict uploaded buckets from the local cache",
+    "status": "Print counts, throughput and ETAs from the status summary (no S3 or Splunk calls)",
+    "plan": "Print a dry-run plan (statuses, bytes, S3 requests, projected time) from the saved state",
+}
+
+
+def add_restore_options(parser, suppress=False):
+    """
+    Add the restore window, order and profiling options.
+
+    They are accepted before and after the command; the command's copy uses SUPPRESS defaults so it does
+    not overwrite a value given before the command.
+    """
+    def default(value):
+        return argparse.SUPPRESS if suppress else value
+
+    parser.add_argument(
+        "--earliest",
+        type=parse_restore_time,
+        default=default(RESTORE_EARLIEST),
+        help="Only restore buckets with events at or after this time (epoch seconds or ISO 8601)",
+    )
+    parser.add_argument(
+        "--latest",
+        type=parse_restore_time,
+        default=default(RESTORE_LATEST),
+        help="Only restore buckets with events at or before this time (epoch seconds or ISO 8601)",
+    )
+    parser.add_argument(
+        "--order",
+        choices=["newest", "oldest", ""],
+        default=default(RESTORE_ORDER),
+        help="Restore the newest or oldest data first (default: listing order)",
+    )
+    parser.add_argument(
+        "--policy",
+        type=parse_restore_policy,
+        default=default(RESTORE_POLICY),
+        help=f"Restore priority, most significant first, e.g. requested,index,newest ({', '.join(RESTORE_POLICIES)}; overrides --order)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=PROFILABLE_STAGES,
+        # None rather than the PROFILE_STAGES list: "append" would add to the default instead of replacing it
+        default=default(None),
+        help="Profile a stage function (repeatable, replaces PROFILE_STAGES)",
+    )
+    parser.add_argument(
+        "--profile-mode",
+        choices=["cpu", "memory", "both"],
+        default=default(PROFILE_MODE),
+        help="cProfile, tracemalloc or both (default: cpu)",
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Restore DDSS archived Splunk buckets into SmartStore.",
+        epilog="Without a command the full workflow runs once (or the daemon with --daemon or DAEMON_MODE=1).",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=os.getenv("DAEMON_MODE") == "1",
+        help="Same as the daemon command",
+    )
+    add_restore_options(parser)
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers = {name: commands.add_parser(name, help=help, description=help) for name, help in COMMANDS.items()}
+    for name, subparser in subparsers.items():
+        if name != "status":
+            add_restore_options(subparser, suppress=True)
+    subparsers["thaw"].add_argument("--index", help="Index to thaw (default: INDEX_NAME or the first index with work left)")
+    subparsers["thaw"].add_argument("--buckets", type=int, help="Buckets to thaw (default: NUM_BUCKETS or prompt)")
+    subparsers["register"].add_argument(
+        "--restart",
+        choices=["policy", "now", "never"],
+        default="policy",
+        help="Restart Splunk for waiting buckets per RESTART_MODE (default), whenever any wait, or never",
+    )
+    subparsers["plan"].add_argument("--output", metavar="FILE", help="Also write the plan as JSON to FILE")
+    args = parser.parse_args(argv)
+    if args.profile is None:
+        args.profile = [stage for stage in PROFILE_STAGES.split(",") if stage]
+        unknown = [stage for stage in args.profile if stage not in PROFILABLE_STAGES]
+        if unknown:
+            parser.error(f"PROFILE_STAGES: invalid stage {', '.join(unknown)} (choose from {', '.join(PROFILABLE_STAGES)})")
+    return args
+
+
+def main(argv=None):
+    global RESTORE_EARLIEST, RESTORE_LATEST, RESTORE_ORDER, RESTORE_POLICY
+    args = parse_args(argv)
+    RESTORE_EARLIEST, RESTORE_LATEST, RESTORE_ORDER, RESTORE_POLICY = args.earliest, args.latest, args.order, args.policy
+    command = args.command or ("daemon" if args.daemon else "run")
+    # Read-only commands: no clients, no profiling
+    if command == "status":
+        print_status_summary()
+        return
+    if command == "plan":
+        plan_restore(output=args.output)
+        return
+    if args.profile:
+        enable_profiling(args.profile, args.profile_mode)
+    try:
+        if command == "daemon":
+            RestoreDaemon().run()
+        elif command == "run":
+            run_workflow()
+        elif command == "inventory":
+            generate_bucket_structure(DDSS_BUCKET_NAME, DDSS_PATH_NAME)
+        elif command == "thaw":
+            if not run_thaw(args.index, args.buckets):
+                sys.exit(10)
+        elif command == "register":
+            run_register(args.restart)
+        elif command == "check":
+            check_buckets()
+        elif command == "evict":
+            evict_buckets()
+    finally:
+        print_profile_summary()
 
 if __name__ == "__main__":
     main()
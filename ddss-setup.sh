@@ -10,3 +10,100 @@ export S2_BUCKET_NAME="mystackname-btwxa8f7miac-archive"
 export S2_PATH_NAME="smartstore/"
 # Defaults to /opt/splunk/var/lib/splunk/
 # export LOCAL_BASE_PATH="/splunkdata/indexes/"
+# Restart readiness: per-phase timeout and port/health probe backoff (seconds)
+# export READY_TIMEOUT=300
+# export READY_BACKOFF_MIN=0.25
+# export READY_BACKOFF_MAX=2
+# Restart coalescing: "coalesce" (default) restarts once enough thawed buckets are waiting,
+# "always" restarts after every batch, "never" relies on registration working without a restart.
+# Defaults: 100 buckets or 1800 seconds of waiting; larger batches mean fewer restarts but later registration
+# export RESTART_MODE=coalesce
+# export RESTART_MIN_BUCKETS=500
+# export RESTART_MIN_BYTES=500000000000
+# export RESTART_MAX_WAIT=3600
+# Daemon mode (python ddss-restore.py daemon, or DAEMON_MODE=1): runtime control file and loop timing
+# export DAEMON_CONTROL_FILE=ddss-daemon.json
+# export DAEMON_TICK=5
+# export DAEMON_SAVE_INTERVAL=60
+# export DAEMON_CHECK_BATCH=50
+# Replicated bucket copies (db_/rb_ with the same bucketNum~GUID): keep "origin" (db_), "smallest" or "newest", or "off"
+# export DEDUP_PREFERENCE=origin
+# Selective restore: only buckets overlapping this window (epoch seconds or ISO 8601), newest or oldest first
+# export RESTORE_EARLIEST=2023-01-01T00:00:00+00:00
+# export RESTORE_LATEST=2023-02-01T00:00:00+00:00
+# export RESTORE_ORDER=newest
+# Metrics: Prometheus textfile (point at the node exporter textfile collector directory) and JSON run summary
+# export METRICS_TEXTFILE=/var/lib/node_exporter/textfile_collector/ddss_restore.prom
+# export METRICS_SUMMARY_JSON=ddss_run_summary.json
+# Profiling (or --profile STAGE --profile-mode cpu|memory|both): per-run files in PROFILE_DIR plus a top-N summary
+# export PROFILE_STAGES=generate_bucket_structure,process_buckets
+# export PROFILE_MODE=both
+# export PROFILE_DIR=profiles
+# export PROFILE_TOP=15
+# Receipt index used during inventory: "exact" (packed sorted array) or "bloom" (filter only, hits confirmed with a HEAD)
+# export RECEIPT_INDEX_MODE=exact
+# export RECEIPT_BLOOM_FP_RATE=0.01
+# Persisted receipt indexes, reused by inventories within RECEIPT_NEGATIVE_TTL seconds of the listing
+# export RECEIPT_INDEX_DIR=receipt_index
+# Receipt cache shared by all stages and runs (RECEIPT_CACHE_DB="" disables it): negative answer TTL,
+# unknown receipts per index above which the inventory lists instead of HEADing, daemon refresh of expired negatives
+# export RECEIPT_CACHE_DB=receipt_cache.db
+# export RECEIPT_NEGATIVE_TTL=900
+# export RECEIPT_LIST_MIN=1000
+# export RECEIPT_REFRESH_INTERVAL=300
+# export RECEIPT_REFRESH_BATCH=1000
+# S3 access layer (s3_access.py): connection pool (default 2 x MAX_WORKERS + INVENTORY_WORKERS), retry mode/attempts, per-thread clients, endpoint
+# export S3_MAX_POOL_CONNECTIONS=20
+# export S3_RETRY_MODE=adaptive
+# export S3_MAX_ATTEMPTS=10
+# export S3_PER_THREAD_CLIENTS=0
+# export S3_ENDPOINT_URL=
+# Download bandwidth shared by all thaw workers (bytes/s, K/M/G suffixes, empty or 0 = unlimited),
+# optionally by time of day (first matching window wins); the daemon control file's "download_rate" overrides both
+# export DOWNLOAD_RATE=200M
+# export DOWNLOAD_RATE_SCHEDULE="08:00-20:00=50M;20:00-08:00=0"
+# export DOWNLOAD_PROGRESS_INTERVAL=30
+# Crash recovery: inprogress lease length (renewed while thawing) and resumes of an interrupted journal download
+# export LEASE_DURATION=1800
+# export DOWNLOAD_RETRIES=3
+# Fresh downloads after a journal fails its checksum before the bucket is marked "integrityfailed"
+# export INTEGRITY_RETRIES=2
+# Scratch staging: download and rebuild on fast local storage (NVMe/tmpfs), then promote into LOCAL_BASE_PATH;
+# in-flight buckets reserve journal size x SCRATCH_EXPANSION of SCRATCH_BUDGET (default: free space on SCRATCH_PATH)
+# export SCRATCH_PATH=/mnt/nvme/ddss-scratch
+# export SCRATCH_BUDGET=400G
+# export SCRATCH_EXPANSION=2.0
+# Multi-host restore: shared coordination store ("sqlite:<path on shared storage>" or "memory"), this host's ID,
+# heartbeat interval and how long a silent host keeps its leases
+# export COORDINATION=sqlite:/shared/ddss/coordination.db
+# export COORD_HOST_ID=$(hostname)
+# export COORD_HEARTBEAT=30
+# export COORD_HOST_TIMEOUT=180
+# Restore plan (python ddss-restore.py plan): run history it projects from, and S3 prices (USD per 1,000 requests / per GB)
+# export METRICS_HISTORY=ddss_metrics_history.jsonl
+# export METRICS_HISTORY_INTERVAL=600
+# export PLAN_HISTORY_RUNS=20
+# export S3_LIST_PRICE=0.005
+# export S3_GET_PRICE=0.0004
+# export S3_TRANSFER_PRICE=0
+# Status summary (python ddss-restore.py status): progress snapshot spacing/retention (seconds) and throughput windows
+# export STATUS_SNAPSHOT_INTERVAL=60
+# export STATUS_HISTORY_SECONDS=604800
+# export STATUS_WINDOWS=15m,1h,24h
+# Local reconciliation: CACHEMANAGER file types a local bucket needs to count as rebuilt, and the
+# cachemanager_upload.json process_bucket.sh registers rebuilt BIDs in
+# export LOCAL_REQUIRED_FILE_TYPES=tsidx,bloomfilter,journal_gz,hosts_data,sources_data,sourcetypes_data
+# export CACHEMANAGER_UPLOAD_JSON=/opt/splunk/var/run/splunk/cachemanager_upload.json
+# Restore priority: policies most significant first (requested, index, newest, oldest, smallest), the
+# indexes the "index" policy puts first and the bid/bucket list the "requested" policy puts first
+# export RESTORE_POLICY=requested,index,newest
+# export INDEX_PRIORITY=security,web
+# export RESTORE_REQUEST_FILE=/opt/ddss/restore_requests.txt
+# Inventory: join bucket lists against receipt indexes with NumPy when it is installed ("auto") or never ("off")
+# export INVENTORY_NUMPY=auto
+# Inventory: indexes scanned at once (their DDSS listing, receipt listing and local scan overlap)
+# export INVENTORY_WORKERS=4
+# Inventory checkpoints: per-index results of a running inventory (default <BUCKET_JSON root>.inventory), and how
+# recently an interrupted inventory must have started to be resumed instead of restarted (0 always restarts)
+# export INVENTORY_CHECKPOINT_DIR=/opt/ddss/bucket_structure.inventory
+# export INVENTORY_RESUME_MAX_AGE=21600
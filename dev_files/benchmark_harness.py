@@ -0,0 +1,518 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import bisect
+import hashlib
+import argparse
+import tempfile
+import threading
+import importlib.util
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse, parse_qs
+
+# Offline end-to-end benchmark for ddss-restore.py.
+#
+# Generates a DDSS layout and S2 receipt tree in a local S3 stand-in, serves the splunkd REST endpoints the
+# workflow uses from a fake server, replaces process_bucket.sh with a stub that "rebuilds" for a configurable
+# time, then drives the real stages of ddss-restore.py and reports buckets/hour and per-stage percentiles.
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DDSS_SCRIPT = os.path.join(REPO_DIR, "ddss-restore.py")
+sys.path.insert(0, REPO_DIR)
+from s3_access import S3Access
+DDSS_BUCKET = "bench-ddss"
+S2_BUCKET = "bench-s2"
+DDSS_PATH = "archive/"
+S2_PATH = "smartstore/"
+
+
+class FakeClientError(Exception):
+    """Stands in for botocore's ClientError (only the response shape is used)."""
+
+    def __init__(self, code, operation):
+        self.response = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": int(code) if code.isdigit() else 400}}
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation")
+
+
+class FakeBody:
+    """Minimal StreamingBody: read(amt) over an in-memory payload."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.offset = 0
+
+    def read(self, amt=None):
+        end = len(self.payload) if amt is None else self.offset + amt
+        chunk = self.payload[self.offset:end]
+        self.offset += len(chunk)
+        return chunk
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class FakeS3:
+    """
+    In-process S3 stand-in implementing the subset of the boto3 client used by ddss-restore.py.
+
+    Objects are kept as sorted keys per bucket, so prefix/delimiter listings paginate (1000 keys per page)
+    like the real service. An optional latency is added to every request; requests are counted by the
+    S3Access layer wrapping it.
+    """
+
+    class exceptions:
+        ClientError = FakeClientError
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.keys = {}
+        self.objects = {}
+
+    def _request(self, operation):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        body = Body if isinstance(Body, bytes) else Body.encode()
+        with self.lock:
+            if (Bucket, Key) not in self.objects:
+                bisect.insort(self.keys.setdefault(Bucket, []), Key)
+            self.objects[(Bucket, Key)] = (body, datetime.now(timezone.utc), hashlib.md5(body).hexdigest())
+        return {"ETag": f'"{self.objects[(Bucket, Key)][2]}"'}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._request("HEAD")
+        entry = self.objects.get((Bucket, Key))
+        if entry is None:
+            raise FakeClientError("404", "HeadObject")
+        body, modified, etag = entry
+        return {"ContentLength": len(body), "LastModified": modified, "ETag": f'"{etag}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._request("GET")
+        entry = self.objects.get((Bucket, Key))
+        if entry is None:
+            raise FakeClientError("NoSuchKey", "GetObject")
+        body, modified, etag = entry
+        if Range:
+            start, _, end = Range.replace("bytes=", "").partition("-")
+            body = body[int(start):int(end) + 1 if end else None]
+        return {"Body": FakeBody(body), "ContentLength": len(body), "LastModified": modified, "ETag": f'"{etag}"'}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._request("LIST")
+        keys = self.keys.get(Bucket, [])
+        position = int(ContinuationToken) if ContinuationToken else bisect.bisect_left(keys, Prefix)
+        contents, prefixes = [], []
+        while position < len(keys) and len(contents) + len(prefixes) < MaxKeys:
+            key = keys[position]
+            if not key.startswith(Prefix):
+                break
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common_prefix = Prefix + rest.split(Delimiter, 1)[0] + Delimiter
+                prefixes.append({"Prefix": common_prefix})
+                # Skip every key under this common prefix
+                position = bisect.bisect_left(keys, common_prefix + "￿")
+                continue
+            body, modified, etag = self.objects[(Bucket, key)]
+            contents.append({"Key": key, "Size": len(body), "LastModified": modified, "ETag": f'"{etag}"'})
+            position += 1
+        response = {"Contents": contents, "CommonPrefixes": prefixes, "KeyCount": len(contents) + len(prefixes)}
+        if position < len(keys) and keys[position].startswith(Prefix):
+            response["IsTruncated"] = True
+            response["NextContinuationToken"] = str(position)
+        return response
+
+
+def receipt_key(index_name, bucket_name):
+    bucket_parts = bucket_name.split("_")
+    sha1_hash = hashlib.sha1(f"{bucket_parts[3]}~{bucket_parts[4]}".encode()).hexdigest()
+    return f"{S2_PATH}{index_name}/db/{sha1_hash[:2]}/{sha1_hash[2:4]}/{bucket_parts[3]}~{bucket_parts[4]}/receipt.json"
+
+
+def generate_archive(s3, indexes, buckets_per_index, replica_ratio, done_ratio, journal_bytes, seed):
+    """
+    Fill the fake S3 with a DDSS archive and an S2 receipt tree.
+
+    Args:
+        s3 (FakeS3): The S3 stand-in.
+        indexes (int): Number of indexes.
+        buckets_per_index (int): Origin buckets per index.
+        replica_ratio (float): Fraction of buckets that also have an rb_ replica copy.
+        done_ratio (float): Fraction of buckets that already have a receipt (restored earlier).
+        journal_bytes (int): Size of every journal.zst.
+        seed (int): Random seed.
+
+    Returns:
+        tuple: (index names, number of buckets that already have a receipt).
+    """
+    rng = random.Random(seed)
+    payload = bytes(rng.getrandbits(8) for _ in range(min(journal_bytes, 4096)))
+    payload = (payload * (journal_bytes // max(len(payload), 1) + 1))[:journal_bytes]
+    index_names = [f"bench_{number:03d}" for number in range(indexes)]
+    already_done = 0
+    for index_name in index_names:
+        for bucket_num in range(buckets_per_index):
+            guid = f"{rng.getrandbits(64):016X}-BENCH"
+            latest = 1_600_000_000 + bucket_num * 3600
+            names = [f"db_{latest}_{latest - 3600}_{bucket_num}_{guid}"]
+            if rng.random() < replica_ratio:
+                names.append(f"rb_{latest}_{latest - 3600}_{bucket_num}_{guid}")
+            for name in names:
+                s3.put_object(Bucket=DDSS_BUCKET, Key=f"{DDSS_PATH}{index_name}/{name}/rawdata/journal.zst", Body=payload)
+            if rng.random() < done_ratio:
+                s3.put_object(Bucket=S2_BUCKET, Key=receipt_key(index_name, names[0]), Body=b"{}")
+                already_done += 1
+    return index_names, already_done
+
+
+class FakeSplunkd:
+    """
+    Fake splunkd management port serving the endpoints used by ddss-restore.py.
+
+    A restart takes restart_seconds: /services/server/info answers 503 meanwhile and the startup message is
+    appended to the fake splunkd.log. Closing a bucket in cacheman "uploads" it after upload_seconds, which
+    also writes its receipt to the S2 tree. Every request gets rest_latency added and fails with
+    probability failure_rate.
+    """
+
+    def __init__(self, s3, log_path, restart_seconds, upload_seconds, rest_latency, failure_rate, seed):
+        self.s3 = s3
+        self.log_path = log_path
+        self.restart_seconds = restart_seconds
+        self.upload_seconds = upload_seconds
+        self.rest_latency = rest_latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.down_until = 0
+        self.uploads = {}
+        self.receipts = set()
+        self.restarts = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def restart(self):
+        with self.lock:
+            self.restarts += 1
+            self.down_until = time.time() + self.restart_seconds
+
+        def announce():
+            with open(self.log_path, "a") as log_file:
+                log_file.write(f"{datetime.now().isoformat()} INFO  ServerConfig [0 MainThread] - My server name is bench.\n")
+
+        # The startup message appears shortly before the REST port answers again
+        threading.Timer(self.restart_seconds * 0.8, announce).start()
+
+    def upload_status(self, bid):
+        with self.lock:
+            finished_at = self.uploads.get(bid)
+        if finished_at is None:
+            return None
+        if time.time() < finished_at:
+            return "in_progress"
+        index_name, bucket_num, guid = bid.split("~")
+        key = receipt_key(index_name, f"db_0_0_{bucket_num}_{guid}")
+        with self.lock:
+            new_receipt = key not in self.receipts
+            self.receipts.add(key)
+        if new_receipt:
+            self.s3.put_object(Bucket=S2_BUCKET, Key=key, Body=b"{}")
+        return "idle"
+
+    def handler_class(self):
+        splunkd = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, payload=None):
+                body = json.dumps(payload or {}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def handle_request(self):
+                if splunkd.rest_latency:
+                    time.sleep(splunkd.rest_latency)
+                path = unquote(urlparse(self.path).path)
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode()) if length else {}
+                if time.time() < splunkd.down_until:
+                    return self.reply(503, {"messages": [{"type": "ERROR", "text": "restarting"}]})
+                if splunkd.failure_rate and splunkd.rng.random() < splunkd.failure_rate:
+                    return self.reply(500, {"messages": [{"type": "ERROR", "text": "injected failure"}]})
+                if path == "/services/server/info":
+                    return self.reply(200, {"entry": [{"content": {"serverName": "bench"}}]})
+                if path == "/services/server/control/restart":
+                    splunkd.restart()
+                    return self.reply(200)
+                if path == "/services/search/jobs":
+                    bids = re.findall(r'title="bid\|([^|]+)\|"', form.get("search", [""])[0])
+                    results = []
+                    for bid in bids:
+                        status = splunkd.upload_status(bid)
+                        if status is not None:
+                            results.append({"title": f"bid|{bid}|", "cm:bucket.upload_status": status, "cm:bucket.status": "remote"})
+                    return self.reply(200, {"results": results})
+                match = re.match(r"/services/admin/cacheman/bid\|([^|]+)\|(/\w+)?$", path)
+                if match:
+                    bid, action = match.group(1), match.group(2)
+                    if action == "/close":
+                        with splunkd.lock:
+                            splunkd.uploads[bid] = time.time() + splunkd.upload_seconds
+                    return self.reply(200)
+                return self.reply(404)
+
+            do_GET = handle_request
+            do_POST = handle_request
+
+        return Handler
+
+
+STUB_PROCESS_SCRIPT = """#!/bin/bash
+# Stub for process_bucket.sh: fake rebuild that takes FSCK_SECONDS and leaves a complete-looking bucket.
+set -e
+BUCKET_ID=$1
+INDEX_NAME=$2
+BUCKET_DIR="${{BUCKET_DIR:-$LOCAL_BASE_PATH/$INDEX_NAME/db/$BUCKET_ID}}"
+mkdir -p "$BUCKET_DIR/rawdata"
+if [ ! -f "$BUCKET_DIR/rawdata/journal.zst" ]; then
+    head -c {journal_bytes} /dev/zero > "$BUCKET_DIR/rawdata/journal.zst"
+fi
+sleep {fsck_seconds}
+if [ "$(awk 'BEGIN {{ srand(); print (rand() < {fsck_failure_rate}) }}')" = "1" ]; then
+    echo "stub fsck failed for $BUCKET_ID" >&2
+    exit 1
+fi
+for name in Hosts.data Sources.data SourceTypes.data Strings.data bloomfilter 1_1.tsidx; do
+    echo stub > "$BUCKET_DIR/$name"
+done
+"""
+
+
+def load_ddss_module(workdir, env):
+    """Import ddss-restore.py as a module with the benchmark configuration in its environment."""
+    os.environ.update(env)
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("ddss_restore", DDSS_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentiles(values, points=(0.5, 0.9, 0.99)):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {f"p{int(point * 100)}": round(values[min(len(values) - 1, int(point * len(values)))], 4) for point in points}
+
+
+def restore_finished(ddss, statuses):
+    """
+    Check whether this host has nothing left to do.
+
+    With COORDINATION the buckets other hosts restored stay "todo" in the local inventory, so the run is
+    over once the shared store is exhausted and no local bucket is still between thaw and eviction.
+    """
+    active = ("inprogress", "pendingupload", "uploaded", "pendingevict")
+    if ddss.COORDINATOR is not None:
+        return ddss.COORDINATOR.exhausted() and not any(status in active for status in statuses)
+    return not any(status == "todo" or status in active for status in statuses)
+
+
+def run_workflow_cycles(ddss, max_cycles):
+    """Run the shipped one-shot workflow (run_workflow) cycle after cycle until every bucket is done."""
+    for cycle in range(1, max_cycles + 1):
+        try:
+            # Cycles follow each other straight away; every sleep inside a cycle still happens
+            ddss.run_workflow(pause=0)
+        except SystemExit as e:
+            # Exit code 10: nothing left to thaw (the workflow flushed its last restart first)
+            if e.code != 10:
+                raise
+        statuses = [bucket_info["status"] for buckets in ddss.load_bucket_structure(ddss.BUCKET_JSON).values() for bucket_info in buckets]
+        if restore_finished(ddss, statuses):
+            return cycle
+    return max_cycles
+
+
+def run_stage_commands(ddss, num_buckets, max_cycles):
+    """Drive the stage commands (one inventory, then thaw/register/check/evict) until every bucket is done."""
+    ddss.main(["inventory"])
+    for cycle in range(1, max_cycles + 1):
+        exhausted = False
+        try:
+            ddss.main(["thaw", "--buckets", str(num_buckets)])
+        except SystemExit as e:
+            exhausted = e.code == 10
+        ddss.main(["register", "--restart", "now" if exhausted else "policy"])
+        ddss.main(["check"])
+        ddss.main(["evict"])
+        statuses = [bucket_info["status"] for buckets in ddss.load_bucket_structure(ddss.BUCKET_JSON).values() for bucket_info in buckets]
+        if restore_finished(ddss, statuses):
+            return cycle
+    return max_cycles
+
+
+def run_daemon(ddss):
+    """Run the daemon until every bucket is done, then stop it the way SIGTERM would."""
+    daemon = ddss.RestoreDaemon()
+
+    def watch():
+        while True:
+            time.sleep(0.2)
+            statuses = [status for status, keys in list(daemon.by_status.items()) for _ in keys]
+            if daemon.lookup and not daemon.in_flight and restore_finished(ddss, statuses):
+                daemon.stop_requested = True
+                daemon.wakeup.set()
+                return
+
+    threading.Thread(target=watch, daemon=True).start()
+    daemon.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for ddss-restore.py")
+    parser.add_argument("--indexes", type=int, default=2)
+    parser.add_argument("--buckets-per-index", type=int, default=50)
+    parser.add_argument("--replica-ratio", type=float, default=0.5, help="Fraction of buckets with an rb_ copy")
+    parser.add_argument("--done-ratio", type=float, default=0.1, help="Fraction of buckets already restored")
+    parser.add_argument("--journal-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--s3-latency", type=float, default=0.0, help="Seconds added to every S3 request")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="Seconds added to every REST request")
+    parser.add_argument("--rest-failure-rate", type=float, default=0.0)
+    parser.add_argument("--fsck-seconds", type=float, default=0.05)
+    parser.add_argument("--fsck-failure-rate", type=float, default=0.0)
+    parser.add_argument("--restart-seconds", type=float, default=1.0)
+    parser.add_argument("--upload-seconds", type=float, default=0.1)
+    parser.add_argument("--num-buckets", type=int, default=20, help="NUM_BUCKETS per workflow cycle")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--max-cycles", type=int, default=1000)
+    parser.add_argument("--mode", choices=["workflow", "stages", "daemon"], default="workflow")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE settings for ddss-restore.py")
+    parser.add_argument("--moto", action="store_true", help="Use moto's in-process S3 mock instead of the built-in fake")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_report.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    workdir = tempfile.mkdtemp(prefix="ddss-bench-")
+    local_base = os.path.join(workdir, "indexes")
+    log_path = os.path.join(workdir, "splunkd.log")
+    open(log_path, "w").close()
+
+    if args.moto:
+        import boto3
+        from moto import mock_aws
+
+        mock = mock_aws()
+        mock.start()
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=DDSS_BUCKET)
+        s3.create_bucket(Bucket=S2_BUCKET)
+    else:
+        s3 = FakeS3(latency=args.s3_latency)
+    index_names, already_done = generate_archive(s3, args.indexes, args.buckets_per_index, args.replica_ratio, args.done_ratio, args.journal_bytes, args.seed)
+
+    splunkd = FakeSplunkd(s3, log_path, args.restart_seconds, args.upload_seconds, args.rest_latency, args.rest_failure_rate, args.seed)
+    splunkd.start()
+
+    stub_script = os.path.join(workdir, "process_bucket.sh")
+    with open(stub_script, "w") as file:
+        file.write(STUB_PROCESS_SCRIPT.format(fsck_seconds=args.fsck_seconds, fsck_failure_rate=args.fsck_failure_rate, journal_bytes=args.journal_bytes))
+    os.chmod(stub_script, 0o755)
+
+    env = {
+        "SPLUNK_URL": splunkd.url,
+        "SPLUNK_USERNAME": "admin",
+        "SPLUNK_PASSWORD": "bench",
+        "DDSS_BUCKET_NAME": DDSS_BUCKET,
+        "DDSS_PATH_NAME": DDSS_PATH,
+        "S2_BUCKET_NAME": S2_BUCKET,
+        "S2_PATH_NAME": S2_PATH,
+        "LOCAL_BASE_PATH": local_base,
+        "LOG_FILE_PATH": log_path,
+        "MAX_WORKERS": str(args.max_workers),
+        "NUM_BUCKETS": str(args.num_buckets),
+        "DAEMON_TICK": "0.2",
+        "DAEMON_SAVE_INTERVAL": "5",
+    }
+    env.update(setting.split("=", 1) for setting in args.env)
+    ddss = load_ddss_module(workdir, env)
+    ddss.s3 = S3Access(concurrency=args.max_workers * 2, client_factory=lambda: s3, observer=ddss.record_s3_request)
+    ddss.PROCESS_BUCKET_SCRIPT = stub_script
+    ddss.get_configured_indexes = lambda: set(index_names)
+
+    total_buckets = args.indexes * args.buckets_per_index
+    print(f"Benchmarking {total_buckets} buckets across {args.indexes} indexes in {workdir} ({args.mode} mode)...")
+    start = time.time()
+    cycles = None
+    try:
+        if args.mode == "daemon":
+            run_daemon(ddss)
+        elif args.mode == "stages":
+            cycles = run_stage_commands(ddss, args.num_buckets, args.max_cycles)
+        else:
+            cycles = run_workflow_cycles(ddss, args.max_cycles)
+    finally:
+        elapsed = time.time() - start
+        splunkd.stop()
+
+    bucket_data = ddss.load_bucket_structure(ddss.BUCKET_JSON)
+    statuses = {}
+    for buckets in bucket_data.values():
+        for bucket_info in buckets:
+            statuses[bucket_info["status"]] = statuses.get(bucket_info["status"], 0) + 1
+    snapshot = ddss.METRICS.snapshot()
+    stage_samples = {}
+    for record in snapshot["bucket_durations"]:
+        stage_samples.setdefault(record["stage"], []).append(record["seconds"])
+    restored = statuses.get("done", 0) - already_done
+
+    report = {
+        "mode": args.mode,
+        "settings": vars(args),
+        "elapsed_seconds": round(elapsed, 3),
+        "cycles": cycles,
+        "restarts": splunkd.restarts,
+        "statuses": statuses,
+        "restored_buckets": restored,
+        "buckets_per_hour": round(restored / elapsed * 3600, 1) if elapsed else None,
+        "s3_requests": ddss.s3.stats()["requests"],
+        "stage_percentiles": {stage: percentiles(values) for stage, values in sorted(stage_samples.items())},
+        "stage_summaries": {stage: {key: summary[key] for key in ("count", "sum", "max", "quantiles")} for stage, summary in sorted(snapshot["durations"].items())},
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=4)
+
+    print(f"Restored {restored} bucket(s) in {elapsed:.1f}s ({report['buckets_per_hour']} buckets/hour), restarts={splunkd.restarts}")
+    for stage, values in report["stage_percentiles"].items():
+        print(f"  {stage:<14} " + " ".join(f"{name}={value}s" for name, value in values.items()))
+    print(f"Report saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+
+# Microbenchmarks for the ddss-restore.py operations whose cost grows with the number of buckets.
+#
+# Synthetic bucket structures are generated at each scale (10k buckets up to 5M, spread over many indexes),
+# every operation is timed (best of --repeat runs) and run once more under tracemalloc for its peak memory.
+# Results can be saved as a baseline and later runs compared against it to catch regressions.
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DDSS_SCRIPT = os.path.join(REPO_DIR, "ddss-restore.py")
+sys.path.insert(0, REPO_DIR)
+DEFAULT_SCALES = "10000,100000,1000000"
+STATUSES = ["todo"] * 6 + ["done"] * 3 + ["pendingupload", "pendingevict", "duplicate"]
+UPDATE_BATCH = 100
+# Timings below this are mostly noise and never count as regressions
+MIN_SECONDS = 0.005
+
+
+def load_ddss_module(workdir):
+    """Import ddss-restore.py as a module without running the workflow."""
+    os.environ.setdefault("S2_PATH_NAME", "smartstore/")
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("ddss_restore", DDSS_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_structure(num_buckets, num_indexes, seed):
+    """
+    Generate a synthetic bucket structure.
+
+    Args:
+        num_buckets (int): Total number of buckets.
+        num_indexes (int): Number of indexes to spread them over.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Index name -> list of {"bucket", "status"} entries, as in bucket_structure.json.
+    """
+    rng = random.Random(seed)
+    guids = [f"{rng.getrandbits(64):016X}-{rng.getrandbits(32):08X}" for _ in range(64)]
+    bucket_data = {f"index_{number:04d}": [] for number in range(num_indexes)}
+    index_names = list(bucket_data)
+    for bucket_num in range(num_buckets):
+        latest = 1_600_000_000 + bucket_num * 60
+        bucket_data[index_names[bucket_num % num_indexes]].append({
+            "bucket": f"db_{latest}_{latest - 3600}_{bucket_num}_{guids[bucket_num % len(guids)]}",
+            "status": rng.choice(STATUSES),
+        })
+    return bucket_data
+
+
+def receipt_keys_for(ddss, bucket_data, fraction=0.5):
+    """Build the receipt key set load_s2_index_structure would return for one index holding every bucket."""
+    index_name = next(iter(bucket_data))
+    buckets = [bucket_info for index_buckets in bucket_data.values() for bucket_info in index_buckets]
+    keys = set()
+    for bucket_info in buckets[:int(len(buckets) * fraction)]:
+        _, _, _, bucket_num, guid = bucket_info["bucket"].split("_")
+        sha1_hash = ddss.calculate_sha(bucket_num, guid)
+        keys.add(f"{ddss.S2_PATH_NAME}{index_name}/db/{sha1_hash[:2]}/{sha1_hash[2:4]}/{bucket_num}~{guid}/receipt.json")
+    return index_name, buckets, keys
+
+
+def receipt_index_for(ddss, index_name, keys):
+    """Build the compact ReceiptIndex load_s2_index_structure returns from the same keys."""
+    receipt_index = ddss.ReceiptIndex(index_name, ddss.RECEIPT_INDEX_MODE)
+    prefix = f"{ddss.S2_PATH_NAME}{index_name}/db/"
+    for key in keys:
+        receipt_index.add_key(key, prefix)
+    return receipt_index.finalize()
+
+
+def build_operations(ddss, bucket_data, json_path):
+    """
+    Return the benchmarked operations as name -> (setup, run) pairs.
+
+    setup() prepares whatever the operation needs and is excluded from the measurement.
+    """
+    all_buckets = [(index_name, bucket_info) for index_name, buckets in bucket_data.items() for bucket_info in buckets]
+    last_index, last_bucket = all_buckets[-1]
+    updates = [
+        {"index_name": index_name, "bucket": bucket_info["bucket"], "status": "pendingupload"}
+        for index_name, bucket_info in all_buckets[::max(1, len(all_buckets) // UPDATE_BATCH)][:UPDATE_BATCH]
+    ]
+    receipt_state = {}
+
+    def write_state():
+        ddss.save_bucket_structure(json_path, bucket_data)
+
+    def build_receipts():
+        receipt_state["index"], receipt_state["buckets"], receipt_state["keys"] = receipt_keys_for(ddss, bucket_data)
+
+    def build_receipt_index():
+        build_receipts()
+        receipt_state["receipt_index"] = receipt_index_for(ddss, receipt_state["index"], receipt_state["keys"])
+
+    def check_receipts(structure="keys"):
+        for bucket_info in receipt_state["buckets"]:
+            _, _, _, bucket_num, guid = bucket_info["bucket"].split("_")
+            ddss.check_receipt_in_structure(receipt_state[structure], receipt_state["index"], bucket_num, guid)
+
+    def check_receipts_batch():
+        names = [bucket_info["bucket"] for bucket_info in receipt_state["buckets"]]
+        bucket_nums = [name.split("_")[3] for name in names]
+        server_guids = [name.split("_")[4] for name in names]
+        receipt_state["receipt_index"].contains_many(receipt_state["index"], bucket_nums, server_guids)
+
+    def calculate_keys():
+        for index_name, bucket_info in all_buckets:
+            _, _, _, bucket_num, guid = bucket_info["bucket"].split("_")
+            sha1_hash = ddss.calculate_sha(bucket_num, guid)
+            f"{ddss.S2_PATH_NAME}{index_name}/db/{sha1_hash[:2]}/{sha1_hash[2:4]}/{bucket_num}~{guid}/receipt.json"
+
+    return {
+        "json_load": (write_state, lambda: ddss.load_bucket_structure(json_path)),
+        "json_dump": (lambda: None, write_state),
+        "update_json_file": (write_state, lambda: ddss.update_json_file(json_path, last_bucket["bucket"], "pendingupload")),
+        "update_multiple_status": (write_state, lambda: ddss.update_multiple_status(json_path, updates)),
+        "calculate_sha_keys": (lambda: None, calculate_keys),
+        "receipt_set_build": (lambda: None, build_receipts),
+        "check_receipt_in_structure": (build_receipts, check_receipts),
+        "receipt_index_build": (build_receipts, lambda: receipt_index_for(ddss, receipt_state["index"], receipt_state["keys"])),
+        "check_receipt_in_index": (build_receipt_index, lambda: check_receipts("receipt_index")),
+        "check_receipts_batched": (build_receipt_index, check_receipts_batch),
+    }
+
+
+def measure(setup, run, repeat):
+    """
+    Time an operation and record its peak traced memory.
+
+    Returns:
+        dict: {"seconds": best wall time, "peak_bytes": peak memory allocated while running}.
+    """
+    best = None
+    for _ in range(repeat):
+        setup()
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    setup()
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(best, 6), "peak_bytes": peak}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline.
+
+    Returns:
+        list: (key, metric, baseline value, current value) for every metric that grew by more than threshold.
+    """
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if metric == "seconds" and current[metric] < MIN_SECONDS:
+                continue
+            if previous[metric] and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append((key, metric, previous[metric], current[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for ddss-restore.py state operations")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="Comma separated bucket counts, e.g. 10000,100000,1000000,5000000")
+    parser.add_argument("--indexes", type=int, default=50, help="Indexes to spread the buckets over")
+    parser.add_argument("--only", action="append", default=[], help="Run only these operations")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per operation (best is kept)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="microbenchmark_results.json")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Also write the results to this baseline file")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against this baseline and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed growth over the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    save_baseline = os.path.abspath(args.save_baseline) if args.save_baseline else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix="ddss-microbench-")
+    ddss = load_ddss_module(workdir)
+    json_path = os.path.join(workdir, "bucket_structure.json")
+
+    results = {}
+    for scale in [int(value) for value in args.scales.split(",")]:
+        bucket_data = generate_structure(scale, min(args.indexes, scale), args.seed)
+        # Large structures are slow enough that a single timed run is representative
+        repeat = args.repeat if scale <= 100_000 else 1
+        for name, (setup, run) in build_operations(ddss, bucket_data, json_path).items():
+            if args.only and name not in args.only:
+                continue
+            result = measure(setup, run, repeat)
+            results[f"{name}@{scale}"] = result
+            print(f"{name:<28} buckets={scale:<9} seconds={result['seconds']:<10} peak_mb={result['peak_bytes'] / 1048576:.1f}")
+        del bucket_data
+        gc.collect()
+
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"Results saved to {output}")
+    if save_baseline:
+        with open(save_baseline, "w") as file:
+            json.dump(results, file, indent=4)
+        print(f"Baseline saved to {save_baseline}")
+
+    if baseline_path:
+        with open(baseline_path) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for key, metric, previous, current in regressions:
+            print(f"\033[31mRegression: {key} {metric} {previous} -> {current}\033[0m")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,25 +20,30 @@ LATEST_TIME=$(echo "$BUCKET_ID" | cut -d'_' -f2)
 EARLIEST_TIME=$(echo "$BUCKET_ID" | cut -d'_' -f3 | cut -d'_' -f2)
 BID="${INDEX_NAME}~${BUCKET_NUM}~${GUID}"
 
-# Paths
-BUCKET_DIR="/opt/splunk/var/lib/splunk/$INDEX_NAME/db/$BUCKET_ID"
+# Paths (ddss-restore.py passes LOCAL_BASE_PATH and BUCKET_DIR; BUCKET_DIR is on SCRATCH_PATH when staging is enabled)
+LOCAL_BASE_PATH="${LOCAL_BASE_PATH:-/opt/splunk/var/lib/splunk}"
+BUCKET_DIR="${BUCKET_DIR:-$LOCAL_BASE_PATH/$INDEX_NAME/db/$BUCKET_ID}"
 RAWDATA_DIR="$BUCKET_DIR/rawdata"
-UPLOAD_JSON="/opt/splunk/var/run/splunk/cachemanager_upload.json"
+UPLOAD_JSON="${CACHEMANAGER_UPLOAD_JSON:-/opt/splunk/var/run/splunk/cachemanager_upload.json}"
 
 # Create directory structure
 echo "Creating directory structure at $RAWDATA_DIR..."
 mkdir -p "$RAWDATA_DIR"
 
-# Download the journal.zst file from S3
-S3_BUCKET="s3://scde-3usvpx5d8elc6o712-d0hrpb07azl9-testing2"
-echo "Downloading journal.zst from $S3_BUCKET/$INDEX_NAME/$BUCKET_ID/rawdata/journal.zst to $RAWDATA_DIR..."
-aws s3 cp "$S3_BUCKET/$INDEX_NAME/$BUCKET_ID/rawdata/journal.zst" "$RAWDATA_DIR/"
+# Download the journal.zst file from S3, unless ddss-restore.py already fetched it through its bandwidth governor
+S3_BUCKET="s3://${DDSS_BUCKET_NAME:-scde-3usvpx5d8elc6o712-d0hrpb07azl9-testing2}/${DDSS_PATH_NAME}"
+if [ -s "$RAWDATA_DIR/journal.zst" ]; then
+    echo "journal.zst already present in $RAWDATA_DIR, skipping download..."
+else
+    echo "Downloading journal.zst from $S3_BUCKET$INDEX_NAME/$BUCKET_ID/rawdata/journal.zst to $RAWDATA_DIR..."
+    aws s3 cp "$S3_BUCKET$INDEX_NAME/$BUCKET_ID/rawdata/journal.zst" "$RAWDATA_DIR/"
+fi
 
 # Rebuild the bucket
 echo "Rebuilding bucket $BUCKET_ID..."
 /opt/splunk/bin/splunk cmd splunkd fsck repair --one-bucket --include-hots --bucket-path="$BUCKET_DIR" --index-name="$INDEX_NAME" --log-to--splunkd-log
 
-# Append BID to cachemanager_upload.json
+# Append BID to cachemanager_upload.json (last step: ddss-restore.py treats a registered BID as a finished rebuild)
 echo "Updating cachemanager_upload.json with BID: $BID..."
 if [ ! -f "$UPLOAD_JSON" ]; then
     echo '{"bucket_ids":[]}' > "$UPLOAD_JSON"
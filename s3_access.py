@@ -0,0 +1,114 @@
+"""
+Shared S3 access layer for ddss-restore.py and the dev_files scripts.
+
+Builds boto3 clients with a connection pool sized for the configured concurrency and adaptive retries,
+optionally one client per thread, and counts every LIST/HEAD/GET request and the bytes transferred so
+cost and throughput can be reported. boto3 is only imported when the first client is built.
+"""
+import os
+import time
+import threading
+
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS") or 0)  # 0 sizes the pool from the caller's concurrency
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE") or "adaptive"  # botocore retry mode: "adaptive", "standard" or "legacy"
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS") or 10)
+S3_PER_THREAD_CLIENTS = (os.getenv("S3_PER_THREAD_CLIENTS") or "0") == "1"  # One client (and pool) per thread
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. a local S3 stand-in for testing
+
+
+class S3Access:
+    """
+    S3 client wrapper that accounts for every request.
+
+    The methods mirror the boto3 calls the scripts use (list_objects_v2 pages, head_object, get_object),
+    so call sites stay the same apart from the paginator. Errors are re-raised unchanged; catch
+    s3.exceptions.ClientError as with a plain client.
+    """
+
+    def __init__(self, concurrency=10, per_thread=None, client_factory=None, observer=None):
+        """
+        Args:
+            concurrency (int): Threads expected to share the client; sizes the connection pool.
+            per_thread (bool): Give every thread its own client (defaults to S3_PER_THREAD_CLIENTS).
+            client_factory (callable): Builds a client instead of boto3 (e.g. an in-process fake).
+            observer (callable): Called as observer(op, seconds, outcome, nbytes) after every request.
+        """
+        self.pool_size = S3_MAX_POOL_CONNECTIONS or max(10, concurrency)
+        self.per_thread = S3_PER_THREAD_CLIENTS if per_thread is None else per_thread
+        self.client_factory = client_factory or self.build_client
+        self.observer = observer
+        self.lock = threading.Lock()
+        self.shared_client = None
+        self.local = threading.local()
+        self.requests = {}
+        self.bytes = {}
+
+    def build_client(self):
+        import boto3
+        from botocore.config import Config
+
+        config = Config(
+            max_pool_connections=self.pool_size,
+            retries={"mode": S3_RETRY_MODE, "max_attempts": S3_MAX_ATTEMPTS},
+        )
+        # A session per client: the default session is not safe to use from several threads at once
+        return boto3.session.Session().client("s3", config=config, endpoint_url=S3_ENDPOINT_URL)
+
+    def client(self):
+        """Return the client for the calling thread (the shared one unless per-thread clients are enabled)."""
+        if self.per_thread:
+            client = getattr(self.local, "client", None)
+            if client is None:
+                with self.lock:
+                    client = self.local.client = self.client_factory()
+            return client
+        if self.shared_client is None:
+            with self.lock:
+                if self.shared_client is None:
+                    self.shared_client = self.client_factory()
+        return self.shared_client
+
+    @property
+    def exceptions(self):
+        return self.client().exceptions
+
+    def record(self, op, seconds, outcome="ok", nbytes=0):
+        with self.lock:
+            self.requests[op] = self.requests.get(op, 0) + 1
+            if nbytes:
+                self.bytes[op] = self.bytes.get(op, 0) + nbytes
+        if self.observer is not None:
+            self.observer(op, seconds, outcome, nbytes)
+
+    def call(self, op, method, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = getattr(self.client(), method)(**kwargs)
+        except self.exceptions.ClientError as e:
+            code = str(e.response.get("Error", {}).get("Code", ""))
+            self.record(op, time.perf_counter() - start, "missing" if code in ("404", "NoSuchKey", "NotFound") else "error")
+            raise
+        self.record(op, time.perf_counter() - start, nbytes=response.get("ContentLength", 0) if op == "GET" else 0)
+        return response
+
+    def list_pages(self, **kwargs):
+        """Yield list_objects_v2 pages (same arguments as the paginator), one LIST request each."""
+        kwargs = dict(kwargs)
+        while True:
+            page = self.call("LIST", "list_objects_v2", **kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+    def head_object(self, **kwargs):
+        return self.call("HEAD", "head_object", **kwargs)
+
+    def get_object(self, **kwargs):
+        """GET an object; the response's ContentLength is counted as transferred bytes."""
+        return self.call("GET", "get_object", **kwargs)
+
+    def stats(self):
+        """Return {"requests": {op: count}, "bytes": {op: bytes}} so far."""
+        with self.lock:
+            return {"requests": dict(self.requests), "bytes": dict(self.bytes)}